@@ -0,0 +1,224 @@
+"""Load balancing across llama-server backends.
+
+Each upstream ("chat", "embed") has a BackendPool built from the URL list in
+config. Requests go to the healthy backend with the fewest outstanding
+requests. A request can carry an affinity key (conversation id or prompt
+prefix hash); it is then routed by rendezvous hashing so the same key keeps
+landing on the same backend, unless that backend is unhealthy or much busier
+than the rest.
+
+A background task probes every backend's /health endpoint and takes failing
+backends out of rotation until they answer again. A connect error on a live
+request also marks the backend down right away, and a backend whose circuit
+breaker is not closed (see breaker.py) is only used when nothing else is left.
+The probe results back the /ready endpoint, so readiness checks never reach
+the model themselves.
+
+Usage:
+    pool = balancer.get_pool("chat")
+    async with pool.acquire(affinity_key) as backend:
+        resp = await client.post(f"{backend.url}/v1/chat/completions", json=body)
+"""
+
+import asyncio
+import hashlib
+import logging
+import time
+from contextlib import asynccontextmanager
+
+import httpx
+
+import upstream
+from config import (
+    CHAT_STICKY_MAX_SKEW,
+    CHAT_URLS,
+    EMBED_URLS,
+    HEALTH_PROBE_INTERVAL,
+    HEALTH_PROBE_TIMEOUT,
+)
+from shared import metrics
+
+logger = logging.getLogger("ai.balancer")
+
+BACKEND_OUTSTANDING = metrics.gauge(
+    "ai_backend_outstanding_requests", "Requests in flight per llama backend", ["upstream", "backend"]
+)
+BACKEND_HEALTHY = metrics.gauge("ai_backend_healthy", "1 if the backend passes health probes", ["upstream", "backend"])
+
+
+class Backend:
+    __slots__ = ("url", "outstanding", "healthy", "requests", "failures")
+
+    def __init__(self, url: str):
+        self.url = url
+        self.outstanding = 0
+        self.healthy = True
+        self.requests = 0
+        self.failures = 0
+
+
+def _hrw_score(key: str, url: str) -> int:
+    digest = hashlib.blake2b(f"{key}|{url}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+class BackendPool:
+    def __init__(self, name: str, urls: list[str], max_skew: int = 0, health_path: str = "/health"):
+        if not urls:
+            raise ValueError(f"No backends configured for '{name}'")
+        self.name = name
+        self.backends = [Backend(url) for url in urls]
+        for backend in self.backends:
+            BACKEND_OUTSTANDING.labels(name, backend.url).set_function(lambda b=backend: b.outstanding)
+            BACKEND_HEALTHY.labels(name, backend.url).set_function(lambda b=backend: int(b.healthy))
+        self.max_skew = max_skew
+        self.health_path = health_path
+        self._rr = 0
+        self._probe_task: asyncio.Task | None = None
+        self.last_probe: float | None = None  # time.time() of the last completed probe round
+
+    def pick(self, affinity: str | None = None, limit: int | None = None) -> Backend | None:
+        """Choose a backend. Falls back to all backends if none is healthy.
+
+        With `limit`, only backends with fewer than `limit` outstanding requests
+        qualify, and None is returned when all of them are full.
+        """
+        candidates = self.available() or self.backends
+        if limit is not None:
+            candidates = [b for b in candidates if b.outstanding < limit]
+            if not candidates:
+                return None
+        if len(candidates) == 1:
+            return candidates[0]
+        least = min(b.outstanding for b in candidates)
+        if affinity is not None:
+            preferred = max(candidates, key=lambda b: _hrw_score(affinity, b.url))
+            if not self.max_skew or preferred.outstanding - least < self.max_skew:
+                return preferred
+        # Least outstanding; rotate the starting point so ties spread evenly.
+        self._rr = (self._rr + 1) % len(candidates)
+        rotated = candidates[self._rr:] + candidates[:self._rr]
+        return next(b for b in rotated if b.outstanding == least)
+
+    def available(self) -> list[Backend]:
+        """Backends that pass health probes and whose circuit is closed."""
+        return [b for b in self.backends if b.healthy and not upstream.circuit(self.name, b.url).blocking]
+
+    def reserve(self, backend: Backend) -> None:
+        backend.outstanding += 1
+        backend.requests += 1
+
+    def release(self, backend: Backend) -> None:
+        backend.outstanding -= 1
+
+    def report_connect_error(self, backend: Backend) -> None:
+        backend.failures += 1
+        self._mark(backend, False, "connect error")
+
+    @asynccontextmanager
+    async def acquire(self, affinity: str | None = None):
+        """Reserve a backend for the duration of one upstream request."""
+        backend = self.pick(affinity)
+        self.reserve(backend)
+        try:
+            yield backend
+        except httpx.ConnectError:
+            self.report_connect_error(backend)
+            raise
+        finally:
+            self.release(backend)
+
+    def _mark(self, backend: Backend, healthy: bool, reason: str = "") -> None:
+        if backend.healthy == healthy:
+            return
+        backend.healthy = healthy
+        if healthy:
+            logger.info("%s backend %s is back in rotation", self.name, backend.url)
+        else:
+            logger.warning("%s backend %s removed from rotation (%s)", self.name, backend.url, reason)
+
+    async def probe(self) -> None:
+        """Probe every backend once and update its health."""
+        client = upstream.get_client(self.name)
+
+        async def check(backend: Backend) -> None:
+            try:
+                resp = await client.get(f"{backend.url}{self.health_path}", timeout=HEALTH_PROBE_TIMEOUT)
+                self._mark(backend, resp.status_code == 200, f"health returned {resp.status_code}")
+            except httpx.HTTPError as exc:
+                self._mark(backend, False, type(exc).__name__)
+
+        await asyncio.gather(*(check(b) for b in self.backends))
+        self.last_probe = time.time()
+
+    async def _probe_loop(self) -> None:
+        while True:
+            try:
+                await self.probe()
+            except Exception:
+                logger.exception("Health probe for %s failed", self.name)
+            await asyncio.sleep(HEALTH_PROBE_INTERVAL)
+
+    def start(self) -> None:
+        if self._probe_task is None and HEALTH_PROBE_INTERVAL > 0:
+            self._probe_task = asyncio.create_task(self._probe_loop())
+
+    async def stop(self) -> None:
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            try:
+                await self._probe_task
+            except asyncio.CancelledError:
+                pass
+            self._probe_task = None
+
+    def stats(self) -> list[dict]:
+        return [
+            {
+                "url": b.url,
+                "healthy": b.healthy,
+                "outstanding": b.outstanding,
+                "requests": b.requests,
+                "failures": b.failures,
+                "circuit": upstream.circuit(self.name, b.url).stats(),
+            }
+            for b in self.backends
+        ]
+
+    def readiness(self) -> dict:
+        available = len(self.available())
+        return {
+            "ready": available > 0,
+            "available": available,
+            "backends": len(self.backends),
+            "last_probe": self.last_probe,
+        }
+
+
+_pools = {
+    "chat": BackendPool("chat", CHAT_URLS, max_skew=CHAT_STICKY_MAX_SKEW),
+    "embed": BackendPool("embed", EMBED_URLS),
+}
+
+
+def get_pool(name: str) -> BackendPool:
+    return _pools[name]
+
+
+def start() -> None:
+    """Start background health probing. Called from the app lifespan."""
+    for pool in _pools.values():
+        pool.start()
+
+
+async def stop() -> None:
+    for pool in _pools.values():
+        await pool.stop()
+
+
+def stats() -> dict:
+    return {name: pool.stats() for name, pool in _pools.items()}
+
+
+def readiness() -> dict:
+    return {name: pool.readiness() for name, pool in _pools.items()}
@@ -0,0 +1,506 @@
+"""Batch chat jobs: many chat requests run in the background, results on disk.
+
+A job is a directory under CHAT_BATCH_DIR:
+
+    job.json       owner, state and number of requests; replaced atomically
+    input.jsonl    one {"index", "id", "body"} line per accepted request
+    results.jsonl  one {"index", "id", "status", "response" | "error"} line per
+                   finished request, appended in completion order
+
+Progress is whatever results.jsonl holds, so after a restart every request
+without a result line is simply run again. A shared pool of worker tasks
+takes requests from the active jobs in turn; how a request is executed is
+up to the `run` callable the runner is built with.
+
+With several server processes (shared.serve) the directory is the source of
+truth: any process can accept, list, stream or delete jobs, but only the one
+holding the lock on CHAT_BATCH_DIR/.runner.lock runs them. It rescans the
+directory every few seconds for jobs submitted or deleted elsewhere; when it
+exits, another process takes the lock over and resumes the jobs.
+"""
+
+import asyncio
+import fcntl
+import logging
+import os
+import re
+import secrets
+import shutil
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable
+
+from codec import JSONDecodeError, dumps, loads
+
+logger = logging.getLogger("ai.batch")
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+CANCELLED = "cancelled"
+
+JOB_ID_RE = re.compile(r"^[0-9a-f]{24}$")
+_READ_CHUNK = 64 * 1024
+_SCAN_INTERVAL = 2.0  # seconds between directory scans (and attempts to take the lock)
+_POLL_INTERVAL = 0.5  # result polling for jobs run by another process
+
+
+class RetryLater(Exception):
+    """A request failed for a reason that may go away (busy, unreachable, timeout)."""
+
+    def __init__(self, reason: str, delay: float | None = None):
+        super().__init__(reason)
+        self.reason = reason
+        self.delay = delay
+
+
+class Job:
+    def __init__(self, path: str, meta: dict):
+        self.path = path
+        self.id: str = meta["id"]
+        self.subject: str = meta["subject"]
+        self.created: float = meta["created"]
+        self.total: int = meta["total"]
+        self.state: str = meta["state"]
+        self.finished: float | None = meta.get("finished")
+        self.pending: deque[tuple[int, int]] = deque()  # (index, offset in input.jsonl)
+        self.in_flight = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.updated = asyncio.Event()  # set (and replaced) whenever a result is appended
+        self._input = None
+        self._results = None
+
+    @property
+    def done(self) -> bool:
+        return self.state in (COMPLETED, CANCELLED)
+
+    def file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def save(self) -> None:
+        meta = {
+            "id": self.id,
+            "subject": self.subject,
+            "created": self.created,
+            "total": self.total,
+            "state": self.state,
+            "finished": self.finished,
+        }
+        tmp = self.file("job.json.tmp")
+        with open(tmp, "wb") as f:
+            f.write(dumps(meta))
+        os.replace(tmp, self.file("job.json"))
+
+    def read_item(self, offset: int) -> dict:
+        if self._input is None:
+            self._input = open(self.file("input.jsonl"), "rb")
+        self._input.seek(offset)
+        return loads(self._input.readline())
+
+    def append_result(self, result: dict) -> None:
+        if self._results is None:
+            self._results = open(self.file("results.jsonl"), "ab")
+        self._results.write(dumps(result) + b"\n")
+        self._results.flush()
+        if result.get("status") == 200:
+            self.succeeded += 1
+        else:
+            self.failed += 1
+        self.updated.set()
+        self.updated = asyncio.Event()
+
+    def close(self) -> None:
+        for f in (self._input, self._results):
+            if f is not None:
+                f.close()
+        self._input = self._results = None
+
+    def info(self) -> dict:
+        return {
+            "job_id": self.id,
+            "state": self.state,
+            "total": self.total,
+            "remaining": self.total - self.succeeded - self.failed,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "created": self.created,
+            "finished": self.finished,
+        }
+
+
+class BatchRunner:
+    def __init__(
+        self,
+        directory: str,
+        run: Callable[[dict, str], Awaitable[dict]],
+        concurrency: int,
+        retries: int,
+        retention: float,
+    ):
+        self.directory = directory
+        self.run = run  # (body, subject) -> {"status", "response" | "error"}; may raise RetryLater
+        self.concurrency = concurrency
+        self.retries = retries
+        self.retention = retention
+        self.jobs: dict[str, Job] = {}  # jobs this process runs; empty unless it holds the lock
+        self._active: deque[Job] = deque()
+        self._wake = asyncio.Event()
+        self._workers: list[asyncio.Task] = []
+        self._scanner: asyncio.Task | None = None
+        self._lock_file = None
+        self._unreadable: set[str] = set()
+        self.retried = 0
+
+    @property
+    def owner(self) -> bool:
+        """Whether this process runs the jobs."""
+        return self._lock_file is not None
+
+    # --- Submission ---
+
+    def create(self, subject: str) -> "JobWriter":
+        os.makedirs(self.directory, exist_ok=True)
+        job_id = secrets.token_hex(12)
+        path = os.path.join(self.directory, job_id)
+        os.makedirs(path)
+        meta = {"id": job_id, "subject": subject, "created": time.time(), "total": 0, "state": QUEUED}
+        return JobWriter(self, Job(path, meta))
+
+    def _submit(self, job: Job) -> None:
+        job.save()
+        if self.owner:
+            self.jobs[job.id] = job
+            self._schedule(job)
+        # Otherwise the owning process picks the job up on its next scan.
+
+    def _schedule(self, job: Job) -> None:
+        if job.pending:
+            self._active.append(job)
+            self._wake.set()
+        else:
+            self._finish(job)
+
+    # --- Lookup / cancel ---
+
+    def _job_ids(self) -> list[str]:
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(name for name in names if JOB_ID_RE.match(name))
+
+    def _read(self, job_id: str, resume: bool = False) -> Job | None:
+        """Load a job from disk; None if it is gone, still being uploaded or unreadable."""
+        try:
+            return _load(os.path.join(self.directory, job_id), resume)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, JSONDecodeError):
+            if job_id not in self._unreadable:
+                self._unreadable.add(job_id)
+                logger.warning("Skipping unreadable batch job directory %s", job_id)
+            return None
+
+    def get(self, job_id: str, subject: str) -> Job | None:
+        """The live job if this process runs it, else a snapshot read from disk."""
+        if not JOB_ID_RE.match(job_id):
+            return None
+        job = self.jobs.get(job_id)
+        if job is not None and not os.path.isdir(job.path):
+            self._forget(job)  # deleted through another process since the last scan
+            job = None
+        job = job or self._read(job_id)
+        if job is None or job.subject != subject:
+            return None
+        return job
+
+    def list(self, subject: str) -> list[Job]:
+        jobs = (self.jobs.get(job_id) or self._read(job_id) for job_id in self._job_ids())
+        return [job for job in jobs if job is not None and job.subject == subject]
+
+    def is_live(self, job: Job) -> bool:
+        return self.jobs.get(job.id) is job
+
+    def refresh(self, job: Job) -> None:
+        """Re-read the state of a snapshot job (a live job is always current)."""
+        if self.is_live(job):
+            return
+        try:
+            with open(job.file("job.json"), "rb") as f:
+                meta = loads(f.read())
+            job.state, job.finished = meta["state"], meta.get("finished")
+        except FileNotFoundError:
+            job.state = CANCELLED
+
+    def delete(self, job: Job) -> None:
+        """Cancel the job (requests in flight finish unrecorded) and remove its files."""
+        self._forget(job)
+        shutil.rmtree(job.path, ignore_errors=True)
+
+    def _forget(self, job: Job) -> None:
+        self.jobs.pop(job.id, None)
+        if job in self._active:
+            self._active.remove(job)
+        job.pending.clear()
+        if not job.done:
+            job.state = CANCELLED
+            job.updated.set()
+        job.close()
+
+    # --- Workers ---
+
+    def _next_item(self) -> tuple[Job, int, int] | None:
+        while self._active:
+            job = self._active[0]
+            if not job.pending:
+                self._active.popleft()
+                continue
+            index, offset = job.pending.popleft()
+            self._active.rotate(-1)  # jobs take turns
+            return job, index, offset
+        return None
+
+    async def _worker(self) -> None:
+        while True:
+            item = self._next_item()
+            if item is None:
+                self._wake.clear()
+                await self._wake.wait()
+                continue
+            job, index, offset = item
+            job.in_flight += 1
+            try:
+                if job.state == QUEUED:
+                    job.state = RUNNING
+                    job.save()
+                await self._execute(job, index, offset)
+                if not job.pending and job.in_flight == 1 and job.id in self.jobs:
+                    self._finish(job)
+            except FileNotFoundError:
+                self._forget(job)  # deleted through another process
+            finally:
+                job.in_flight -= 1
+
+    async def _execute(self, job: Job, index: int, offset: int) -> None:
+        try:
+            item = job.read_item(offset)
+        except FileNotFoundError:
+            raise
+        except (OSError, ValueError, JSONDecodeError):
+            if job.id in self.jobs:
+                logger.exception("Unreadable input line %d of batch job %s", index, job.id)
+            return
+        attempt = 0
+        while True:
+            try:
+                outcome = await self.run(item["body"], job.subject)
+                break
+            except RetryLater as exc:
+                if attempt >= self.retries or job.id not in self.jobs:
+                    outcome = {"status": 503, "error": exc.reason}
+                    break
+                self.retried += 1
+                delay = exc.delay if exc.delay is not None else 2 ** attempt
+                attempt += 1
+                await asyncio.sleep(min(delay, 60))
+            except Exception:
+                logger.exception("Batch job %s request %d failed", job.id, index)
+                outcome = {"status": 500, "error": "Internal AI service error"}
+                break
+        if job.id in self.jobs:
+            job.append_result({"index": index, "id": item.get("id"), **outcome})
+
+    def _finish(self, job: Job) -> None:
+        job.state = COMPLETED
+        job.finished = time.time()
+        job.save()
+        job.close()
+        job.updated.set()
+        logger.info("Batch job %s finished: %d ok, %d failed", job.id, job.succeeded, job.failed)
+
+    # --- Ownership ---
+
+    def _acquire(self) -> bool:
+        os.makedirs(self.directory, exist_ok=True)
+        f = open(os.path.join(self.directory, ".runner.lock"), "ab")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            return False
+        self._lock_file = f
+        return True
+
+    def _scan(self) -> None:
+        """Take the lock if it is free; as owner, sync the job table with the directory."""
+        if not self.owner:
+            if not self._acquire():
+                return
+            logger.info("Process %d runs the batch jobs", os.getpid())
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+        on_disk = set(self._job_ids())
+        for job in list(self.jobs.values()):
+            if job.id not in on_disk:
+                self._forget(job)
+        for job_id in sorted(on_disk - self.jobs.keys()):
+            job = self._read(job_id, resume=True)
+            if job is not None:
+                self.jobs[job.id] = job
+                if not job.done:
+                    self._schedule(job)
+        self._purge()
+
+    async def _scan_loop(self) -> None:
+        while True:
+            try:
+                self._scan()
+            except Exception:
+                logger.exception("Batch job scan failed")
+            await asyncio.sleep(_SCAN_INTERVAL)
+
+    # --- Lifecycle ---
+
+    def start(self) -> None:
+        """Start scanning; the process that gets the lock resumes unfinished jobs and runs them."""
+        if self._scanner is None:
+            self._scanner = asyncio.create_task(self._scan_loop())
+
+    async def stop(self) -> None:
+        tasks = [task for task in (self._scanner, *self._workers) if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._scanner = None
+        self._workers = []
+        for job in self.jobs.values():
+            job.close()
+            job.updated.set()  # result streams fall back to polling
+        self.jobs.clear()
+        self._active.clear()
+        if self._lock_file is not None:
+            self._lock_file.close()  # releases the lock to another process
+            self._lock_file = None
+
+    def _purge(self) -> None:
+        cutoff = time.time() - self.retention
+        for job in list(self.jobs.values()):
+            if job.done and job.finished is not None and job.finished < cutoff:
+                self.delete(job)
+
+    def stats(self) -> dict:
+        states: dict[str, int] = {}
+        for job in self.jobs.values():
+            states[job.state] = states.get(job.state, 0) + 1
+        return {
+            "owner": self.owner,
+            "jobs": states,
+            "pending": sum(len(job.pending) for job in self._active),
+            "in_flight": sum(job.in_flight for job in self.jobs.values()),
+            "workers": len(self._workers),
+            "retried": self.retried,
+        }
+
+
+class JobWriter:
+    """Writes input.jsonl for a new job; commit() hands the job to the runner."""
+
+    def __init__(self, runner: BatchRunner, job: Job):
+        self.runner = runner
+        self.job = job
+        self._input = open(job.file("input.jsonl"), "wb")
+        self._offset = 0
+
+    def add(self, item_id, body: dict) -> None:
+        index = self.job.total
+        line = dumps({"index": index, "id": item_id, "body": body}) + b"\n"
+        self._input.write(line)
+        self.job.pending.append((index, self._offset))
+        self._offset += len(line)
+        self.job.total += 1
+
+    def reject(self, item_id, error: str) -> None:
+        """Count an invalid line as a request whose result is the error."""
+        index = self.job.total
+        self.job.total += 1
+        self.job.append_result({"index": index, "id": item_id, "status": 422, "error": error})
+
+    def commit(self) -> Job:
+        self._input.close()
+        self.job.close()  # job.json last: the owner only picks up jobs that have one
+        self.runner._submit(self.job)
+        return self.job
+
+    def abort(self) -> None:
+        self._input.close()
+        self.job.close()
+        shutil.rmtree(self.job.path, ignore_errors=True)
+
+
+def _load(path: str, resume: bool = False) -> Job:
+    """Read a job from its directory. With `resume` (only in the process that
+    runs the jobs) also find the requests still without a result."""
+    with open(os.path.join(path, "job.json"), "rb") as f:
+        job = Job(path, loads(f.read()))
+    done: set[int] = set()
+    results = job.file("results.jsonl")
+    if os.path.exists(results):
+        with open(results, "rb+" if resume else "rb") as f:
+            data = f.read()
+            # Drop a line cut off by a crash so new results start on a fresh line.
+            end = data.rfind(b"\n") + 1
+            if resume and end < len(data):
+                f.truncate(end)
+        for line in data[:end].splitlines():
+            result = loads(line)
+            done.add(result["index"])
+            if result.get("status") == 200:
+                job.succeeded += 1
+            else:
+                job.failed += 1
+    if resume and not job.done:
+        offset = 0
+        with open(job.file("input.jsonl"), "rb") as f:
+            for line in f:
+                index = loads(line)["index"]
+                if index not in done:
+                    job.pending.append((index, offset))
+                offset += len(line)
+    return job
+
+
+async def follow_results(runner: BatchRunner, job: Job, follow: bool):
+    """Yield results.jsonl in chunks of whole lines; with `follow`, keep
+    yielding new results until the job is done, then a summary line.
+
+    A job run by this process wakes the stream on each new result; one run
+    by another process is polled."""
+    offset = 0
+    while True:
+        live = runner.is_live(job)
+        updated = job.updated
+        runner.refresh(job)
+        finished = job.done
+        try:
+            with open(job.file("results.jsonl"), "rb") as f:
+                f.seek(offset)
+                buf = b""
+                while chunk := f.read(_READ_CHUNK):
+                    buf += chunk
+                    end = buf.rfind(b"\n") + 1
+                    if end:
+                        offset += end
+                        yield buf[:end]
+                        buf = buf[end:]
+        except FileNotFoundError:
+            pass  # no results yet, or the job was deleted
+        if finished or not follow:
+            break
+        if live:
+            await updated.wait()
+        else:
+            await asyncio.sleep(_POLL_INTERVAL)
+    if job.done:
+        if not runner.is_live(job):
+            job = runner._read(job.id) or job  # counts as of now
+        yield dumps({"done": True, **job.info()}) + b"\n"
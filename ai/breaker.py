@@ -0,0 +1,95 @@
+"""Circuit breakers for the llama-server backends.
+
+Without a breaker, every request to a dead or wedged backend waits for its
+connect or read timeout (up to LLAMA_CHAT_TIMEOUT) before failing. A breaker
+counts consecutive connect errors and timeouts per backend:
+
+- closed: requests pass; UPSTREAM_BREAKER_FAILURES failures in a row open it.
+- open: requests fail at once with CircuitOpenError (a ConnectError, so the
+  routers answer 502 as for a refused connection) for UPSTREAM_BREAKER_RESET
+  seconds.
+- half-open: one trial request is let through (usually the next background
+  health probe); success closes the breaker, failure opens it again.
+
+Any upstream response, whatever its status, counts as a success: the backend
+is reachable and answering.
+"""
+
+import logging
+import time
+
+import httpx
+
+logger = logging.getLogger("ai.breaker")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(httpx.ConnectError):
+    """The backend's breaker is open; the request was not sent."""
+
+
+class CircuitBreaker:
+    def __init__(self, label: str, failures: int, reset_after: float):
+        self.label = label
+        self.threshold = failures  # 0 disables the breaker
+        self.reset_after = reset_after
+        self.state = CLOSED
+        self.consecutive = 0
+        self.opened_at = 0.0
+        self._trial = False
+        self.opens = 0
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        """Whether a request may be sent now. Every allowed request must be
+        followed by success(), failure() or abandon()."""
+        if self.threshold <= 0 or self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            if time.monotonic() - self.opened_at < self.reset_after:
+                self.rejected += 1
+                return False
+            self.state = HALF_OPEN
+        if self._trial:
+            self.rejected += 1
+            return False
+        self._trial = True
+        return True
+
+    def success(self) -> None:
+        self.consecutive = 0
+        self._trial = False
+        if self.state != CLOSED:
+            self.state = CLOSED
+            logger.info("Circuit for %s closed", self.label)
+
+    def failure(self) -> None:
+        self._trial = False
+        self.consecutive += 1
+        if self.threshold <= 0:
+            return
+        if self.state == HALF_OPEN or (self.state == CLOSED and self.consecutive >= self.threshold):
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+            self.opens += 1
+            logger.warning("Circuit for %s opened after %d failures", self.label, self.consecutive)
+
+    def abandon(self) -> None:
+        """The request ended without an outcome (e.g. it was cancelled)."""
+        self._trial = False
+
+    @property
+    def blocking(self) -> bool:
+        """True while requests are (mostly) being rejected."""
+        return self.state != CLOSED
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive,
+            "opens": self.opens,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,87 @@
+"""Fast JSON encoding and size-capped request body reading.
+
+Uses orjson when it is installed (it parses and encodes several times faster
+than the json module and emits bytes directly) and falls back to the standard
+library otherwise, so the service still runs without it.
+
+read_body() enforces the size limit while the body streams in: a request
+without Content-Length (chunked upload) is cut off as soon as it exceeds the
+limit instead of being read into memory first.
+"""
+
+import json
+
+from fastapi import Request
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+
+if orjson is not None:
+    JSONDecodeError = orjson.JSONDecodeError
+
+    def loads(data: bytes | str):
+        return orjson.loads(data)
+
+    def dumps(obj) -> bytes:
+        return orjson.dumps(obj)
+
+else:
+    JSONDecodeError = ValueError
+
+    def loads(data: bytes | str):
+        return json.loads(data)
+
+    def dumps(obj) -> bytes:
+        return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+# For httpx calls that send pre-encoded JSON bytes.
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with the fast encoder."""
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+class BodyError(Exception):
+    """The request body could not be read; carries the response to send."""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.response = JSONResponse(status_code=status_code, content={"error": message})
+
+
+async def read_body(request: Request, max_bytes: int) -> bytes:
+    """Read the raw request body, raising BodyError past `max_bytes`."""
+    content_length = request.headers.get("content-length")
+    if content_length:
+        try:
+            if int(content_length) > max_bytes:
+                raise BodyError(413, "Payload too large")
+        except ValueError:
+            raise BodyError(400, "Invalid Content-Length header") from None
+
+    chunks = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > max_bytes:
+            raise BodyError(413, "Payload too large")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+async def read_json(request: Request, max_bytes: int):
+    """read_body() + loads(); invalid JSON raises BodyError(400)."""
+    raw = await read_body(request, max_bytes)
+    try:
+        return loads(raw)
+    except JSONDecodeError:
+        raise BodyError(400, "Invalid JSON body") from None
@@ -1,6 +1,121 @@
 import os
 
 
-CHAT_URL = os.environ.get("LLAMA_CHAT_URL", "http://127.0.0.1:8081")
-EMBED_URL = os.environ.get("LLAMA_EMBED_URL", "http://127.0.0.1:8082")
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _env_list(name: str, default: str) -> list[str]:
+    """Comma- or whitespace-separated list of URLs."""
+    raw = os.environ.get(name, default).replace(",", " ")
+    return [item.rstrip("/") for item in raw.split() if item]
+
+
+# One or more llama-server backends each, e.g. "http://127.0.0.1:8081,http://127.0.0.1:8083"
+CHAT_URLS = _env_list("LLAMA_CHAT_URL", "http://127.0.0.1:8081")
+EMBED_URLS = _env_list("LLAMA_EMBED_URL", "http://127.0.0.1:8082")
 AI_PORT = int(os.environ.get("AI_PORT", "8090"))
+# Worker processes of this server; set by shared.serve before forking.
+SERVE_WORKERS = int(os.environ.get("SERVE_WORKERS", "1"))
+
+# --- Upstream HTTP clients (one pooled client per llama-server upstream) ---
+CHAT_TIMEOUT = float(os.environ.get("LLAMA_CHAT_TIMEOUT", "120"))
+EMBED_TIMEOUT = float(os.environ.get("LLAMA_EMBED_TIMEOUT", "60"))
+UPSTREAM_CONNECT_TIMEOUT = float(os.environ.get("UPSTREAM_CONNECT_TIMEOUT", "10"))
+UPSTREAM_MAX_CONNECTIONS = int(os.environ.get("UPSTREAM_MAX_CONNECTIONS", "100"))
+UPSTREAM_MAX_KEEPALIVE = int(os.environ.get("UPSTREAM_MAX_KEEPALIVE", "20"))
+# Keep below the upstream's own keep-alive timeout (5 s for llama-server), or
+# requests race the server closing idle connections and fail.
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.environ.get("UPSTREAM_KEEPALIVE_EXPIRY", "4"))
+UPSTREAM_HTTP2 = _env_bool("UPSTREAM_HTTP2", False)  # needs the `h2` package
+# Circuit breaker per backend: after this many connect errors / timeouts in a
+# row, fail requests at once for UPSTREAM_BREAKER_RESET seconds, then let one
+# trial request through. 0 disables the breaker.
+UPSTREAM_BREAKER_FAILURES = int(os.environ.get("UPSTREAM_BREAKER_FAILURES", "5"))
+UPSTREAM_BREAKER_RESET = float(os.environ.get("UPSTREAM_BREAKER_RESET", "10"))
+
+# --- Embedding cache ---
+EMBED_CACHE_MAX_BYTES = int(os.environ.get("EMBED_CACHE_MAX_BYTES", str(128 * 1024 * 1024)))
+EMBED_CACHE_PATH = os.environ.get("EMBED_CACHE_PATH", "")  # SQLite file; empty = memory only
+# Vector bytes kept in the SQLite file; oldest-written rows go first. 0 = unbounded.
+EMBED_CACHE_DISK_MAX_BYTES = int(os.environ.get("EMBED_CACHE_DISK_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+
+# --- Embedding micro-batching (window 0 disables batching) ---
+EMBED_BATCH_WINDOW_MS = float(os.environ.get("EMBED_BATCH_WINDOW_MS", "5"))
+EMBED_BATCH_MAX_INPUTS = int(os.environ.get("EMBED_BATCH_MAX_INPUTS", "64"))
+
+# --- Bulk embedding (/embed/bulk) ---
+EMBED_CHUNK_CHARS = int(os.environ.get("EMBED_CHUNK_CHARS", "2000"))
+EMBED_CHUNK_OVERLAP = int(os.environ.get("EMBED_CHUNK_OVERLAP", "200"))
+EMBED_BULK_CONCURRENCY = int(os.environ.get("EMBED_BULK_CONCURRENCY", "4"))
+EMBED_BULK_MAX_LINE_BYTES = int(os.environ.get("EMBED_BULK_MAX_LINE_BYTES", str(8 * 1024 * 1024)))
+
+# --- Local data (caches, vector collections) ---
+AI_DATA_DIR = os.environ.get("AI_DATA_DIR", os.path.expanduser("~/.local/share/research-ai"))
+
+# --- Vector index ---
+VECTOR_DATA_DIR = os.environ.get("VECTOR_DATA_DIR", os.path.join(AI_DATA_DIR, "vectors"))
+VECTOR_IVF_MIN_ROWS = int(os.environ.get("VECTOR_IVF_MIN_ROWS", "20000"))  # below this, approx = exact
+VECTOR_IVF_NPROBE = int(os.environ.get("VECTOR_IVF_NPROBE", "8"))
+
+# --- Backend load balancing ---
+HEALTH_PROBE_INTERVAL = float(os.environ.get("HEALTH_PROBE_INTERVAL", "5"))
+HEALTH_PROBE_TIMEOUT = float(os.environ.get("HEALTH_PROBE_TIMEOUT", "2"))
+# Route requests with the same conversation / prompt prefix to the same chat
+# backend so llama.cpp can reuse its prompt cache. 0 disables prefix stickiness.
+CHAT_STICKY_PREFIX_CHARS = int(os.environ.get("CHAT_STICKY_PREFIX_CHARS", "2048"))
+# Give up stickiness when the preferred backend has this many more requests
+# outstanding than the least busy one.
+CHAT_STICKY_MAX_SKEW = int(os.environ.get("CHAT_STICKY_MAX_SKEW", "4"))
+
+# --- Chat response cache (deterministic, non-streaming requests only) ---
+CHAT_CACHE_TTL = float(os.environ.get("CHAT_CACHE_TTL", "300"))  # seconds; 0 disables
+CHAT_CACHE_MAX_BYTES = int(os.environ.get("CHAT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# --- Chat admission control ---
+# Concurrent requests per chat backend; match llama-server's --parallel.
+CHAT_SLOTS_PER_BACKEND = int(os.environ.get("CHAT_SLOTS_PER_BACKEND", "4"))
+CHAT_QUEUE_MAX = int(os.environ.get("CHAT_QUEUE_MAX", "64"))
+CHAT_QUEUE_TIMEOUT = float(os.environ.get("CHAT_QUEUE_TIMEOUT", "60"))  # max seconds spent waiting
+
+# --- Context-budget preflight ---
+CHAT_PREFLIGHT = _env_bool("CHAT_PREFLIGHT", True)
+# Context window per request (llama-server n_ctx per slot); 0 = read it from the backend's /props.
+CHAT_CONTEXT_TOKENS = int(os.environ.get("CHAT_CONTEXT_TOKENS", "0"))
+CHAT_CONTEXT_OVERFLOW = os.environ.get("CHAT_CONTEXT_OVERFLOW", "reject")  # "reject" or "trim"
+CHAT_TEMPLATE_TOKENS_PER_MESSAGE = int(os.environ.get("CHAT_TEMPLATE_TOKENS_PER_MESSAGE", "8"))
+CHAT_TOKEN_CACHE_ENTRIES = int(os.environ.get("CHAT_TOKEN_CACHE_ENTRIES", "50000"))
+
+# --- Stream coalescing (per request: X-Stream-Coalesce: <ms> | on | off) ---
+# Merge upstream SSE events into one write per interval; the first event is
+# always sent at once. 0 = off unless a request asks for it.
+CHAT_STREAM_COALESCE_MS = float(os.environ.get("CHAT_STREAM_COALESCE_MS", "0"))
+CHAT_STREAM_COALESCE_BYTES = int(os.environ.get("CHAT_STREAM_COALESCE_BYTES", "4096"))  # flush early at this size
+
+# --- Semantic chat cache (near-duplicate questions; non-streaming only) ---
+CHAT_SEMANTIC_CACHE_TTL = float(os.environ.get("CHAT_SEMANTIC_CACHE_TTL", "0"))  # seconds; 0 disables
+CHAT_SEMANTIC_THRESHOLD = float(os.environ.get("CHAT_SEMANTIC_THRESHOLD", "0.95"))  # min cosine similarity
+CHAT_SEMANTIC_CAPACITY = int(os.environ.get("CHAT_SEMANTIC_CAPACITY", "10000"))  # entries
+CHAT_SEMANTIC_EMBED_MODEL = os.environ.get("CHAT_SEMANTIC_EMBED_MODEL", "")  # "model" sent to the embed backend
+
+# --- Server-side chat sessions (/chat/sessions) ---
+# Backend "memory" is per process; "sqlite" shares sessions between worker
+# processes through a SQLite file (put it on tmpfs, e.g. /dev/shm).
+CHAT_SESSION_BACKEND = os.environ.get("CHAT_SESSION_BACKEND", "sqlite" if SERVE_WORKERS > 1 else "memory")
+CHAT_SESSION_PATH = os.environ.get("CHAT_SESSION_PATH", "/dev/shm/research-ai-sessions.sqlite3")
+CHAT_SESSION_MAX = int(os.environ.get("CHAT_SESSION_MAX", "1000"))  # sessions kept
+CHAT_SESSION_MAX_BYTES = int(os.environ.get("CHAT_SESSION_MAX_BYTES", str(64 * 1024 * 1024)))  # total history size
+CHAT_SESSION_IDLE_TTL = float(os.environ.get("CHAT_SESSION_IDLE_TTL", "3600"))  # seconds without a turn
+# Pin each session to one llama-server slot (id_slot) so its KV cache survives
+# other traffic; needs llama-server with --parallel >= CHAT_SLOTS_PER_BACKEND.
+CHAT_SESSION_PIN_SLOT = _env_bool("CHAT_SESSION_PIN_SLOT", False)
+
+# --- Batch chat jobs (/chat/batch) ---
+CHAT_BATCH_DIR = os.environ.get("CHAT_BATCH_DIR", os.path.join(AI_DATA_DIR, "batch"))
+CHAT_BATCH_CONCURRENCY = int(os.environ.get("CHAT_BATCH_CONCURRENCY", "4"))  # requests in flight, all jobs
+CHAT_BATCH_MAX_REQUESTS = int(os.environ.get("CHAT_BATCH_MAX_REQUESTS", "50000"))  # per job
+CHAT_BATCH_RETRIES = int(os.environ.get("CHAT_BATCH_RETRIES", "5"))  # per request while busy / unreachable
+CHAT_BATCH_RETENTION = float(os.environ.get("CHAT_BATCH_RETENTION", str(7 * 24 * 3600)))  # keep finished jobs (s)
@@ -0,0 +1,180 @@
+"""Micro-batching coalescer for upstream embedding calls.
+
+Concurrent callers submit their inputs to a shared queue. A single collector
+task drains the queue for up to EMBED_BATCH_WINDOW_MS or until
+EMBED_BATCH_MAX_INPUTS inputs are gathered, sends one combined request per
+parameter set, and hands each caller back its own slice of the result.
+
+If a combined request is rejected by the upstream, each caller's inputs are
+retried on their own so one bad input only fails its own caller.
+"""
+
+import asyncio
+import json
+import logging
+import time
+from collections.abc import Awaitable, Callable
+
+from upstream import UpstreamStatusError
+
+logger = logging.getLogger("ai.embed_batcher")
+
+FetchFn = Callable[[dict, list[str]], Awaitable[tuple[list[list[float]], dict]]]
+
+
+class _Pending:
+    __slots__ = ("params", "texts", "future", "enqueued_at")
+
+    def __init__(self, params: dict, texts: list[str], future: asyncio.Future):
+        self.params = params
+        self.texts = texts
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+
+class EmbedBatcher:
+    def __init__(self, fetch: FetchFn, window_ms: float, max_inputs: int):
+        self._fetch = fetch
+        self.window = window_ms / 1000
+        self.max_inputs = max_inputs
+        self._queue: asyncio.Queue[_Pending] = asyncio.Queue()
+        self._collector: asyncio.Task | None = None
+        self._in_flight: set[asyncio.Task] = set()
+        # Stats
+        self.batches = 0
+        self.batched_inputs = 0
+        self.max_batch_size = 0
+        self.isolated_retries = 0
+        self._size_buckets: dict[int, int] = {}
+        self._wait_total = 0.0
+        self._callers = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0 and self.max_inputs > 1
+
+    def start(self) -> None:
+        if self.enabled and self._collector is None:
+            self._collector = asyncio.create_task(self._collect_loop())
+
+    async def stop(self) -> None:
+        if self._collector is not None:
+            self._collector.cancel()
+            try:
+                await self._collector
+            except asyncio.CancelledError:
+                pass
+            self._collector = None
+        while not self._queue.empty():
+            pending = self._queue.get_nowait()
+            if not pending.future.done():
+                pending.future.set_exception(RuntimeError("embedding batcher stopped"))
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+
+    async def submit(self, params: dict, texts: list[str]) -> tuple[list[list[float]], dict]:
+        """Embed `texts`, sharing an upstream request with concurrent callers."""
+        if self._collector is None:
+            return await self._fetch(params, texts)
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait(_Pending(params, texts, future))
+        return await future
+
+    async def _collect_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            size = len(batch[0].texts)
+            deadline = loop.time() + self.window
+            while size < self.max_inputs:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    pending = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(pending)
+                size += len(pending.texts)
+
+            # Only requests with identical parameters can share an upstream call.
+            groups: dict[str, list[_Pending]] = {}
+            for pending in batch:
+                if pending.future.done():
+                    continue  # caller went away
+                key = json.dumps(pending.params, sort_keys=True)
+                groups.setdefault(key, []).append(pending)
+            for group in groups.values():
+                task = asyncio.create_task(self._dispatch(group))
+                self._in_flight.add(task)
+                task.add_done_callback(self._in_flight.discard)
+
+    async def _dispatch(self, group: list[_Pending]) -> None:
+        texts = [text for pending in group for text in pending.texts]
+        now = time.monotonic()
+        self.batches += 1
+        self.batched_inputs += len(texts)
+        self.max_batch_size = max(self.max_batch_size, len(texts))
+        bucket = 1 << (len(texts) - 1).bit_length()
+        self._size_buckets[bucket] = self._size_buckets.get(bucket, 0) + 1
+        self._wait_total += sum(now - pending.enqueued_at for pending in group)
+        self._callers += len(group)
+
+        try:
+            vectors, payload = await self._fetch(group[0].params, texts)
+        except UpstreamStatusError as exc:
+            if len(group) == 1:
+                _fail(group[0], exc)
+                return
+            self.isolated_retries += 1
+            await asyncio.gather(*(self._dispatch_one(pending) for pending in group))
+            return
+        except Exception as exc:
+            for pending in group:
+                _fail(pending, exc)
+            return
+
+        total_chars = sum(len(text) for text in texts) or 1
+        prompt_tokens = (payload.get("usage") or {}).get("prompt_tokens", 0)
+        offset = 0
+        for pending in group:
+            count = len(pending.texts)
+            share = round(prompt_tokens * sum(len(t) for t in pending.texts) / total_chars)
+            result = {
+                "model": payload.get("model"),
+                "usage": {"prompt_tokens": share, "total_tokens": share},
+            }
+            if not pending.future.done():
+                pending.future.set_result((vectors[offset:offset + count], result))
+            offset += count
+
+    async def _dispatch_one(self, pending: _Pending) -> None:
+        try:
+            result = await self._fetch(pending.params, pending.texts)
+        except Exception as exc:
+            _fail(pending, exc)
+            return
+        if not pending.future.done():
+            pending.future.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self._collector is not None,
+            "window_ms": self.window * 1000,
+            "max_inputs": self.max_inputs,
+            "queue_depth": self._queue.qsize(),
+            "in_flight_batches": len(self._in_flight),
+            "batches": self.batches,
+            "inputs": self.batched_inputs,
+            "avg_batch_size": round(self.batched_inputs / self.batches, 2) if self.batches else 0.0,
+            "max_batch_size": self.max_batch_size,
+            "avg_queue_wait_ms": round(self._wait_total / self._callers * 1000, 3)
+            if self._callers else 0.0,
+            "isolated_retries": self.isolated_retries,
+            "batch_size_buckets": {f"<={k}": v for k, v in sorted(self._size_buckets.items())},
+        }
+
+
+def _fail(pending: _Pending, exc: BaseException) -> None:
+    if not pending.future.done():
+        pending.future.set_exception(exc)
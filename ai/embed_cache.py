@@ -0,0 +1,206 @@
+"""Content-addressed cache for embedding vectors.
+
+Entries are keyed by a SHA-256 of the request parameters (model etc.) and the
+input text. A byte-bounded in-memory LRU tier sits in front of an optional
+SQLite tier on local disk that survives restarts; the disk tier has its own
+byte cap and drops the oldest-written rows first once it is exceeded. Vectors are stored as packed
+little-endian float32, the precision llama-server computes them in.
+
+Memory-tier methods must be called from the event loop thread; disk access is
+pushed to a worker thread.
+"""
+
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+
+from config import EMBED_CACHE_DISK_MAX_BYTES, EMBED_CACHE_MAX_BYTES, EMBED_CACHE_PATH
+
+logger = logging.getLogger("ai.embed_cache")
+
+# Rough per-entry bookkeeping cost (key string, dict slot, bytes header).
+_ENTRY_OVERHEAD = 200
+
+# A disk trim cuts down to this fraction of the cap so that the next one is
+# many writes away rather than on every insert.
+_DISK_TRIM_TARGET = 0.9
+
+
+def _pack(vector: list[float]) -> bytes:
+    arr = array("f", vector)
+    if sys.byteorder != "little":
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def _unpack(blob: bytes) -> list[float]:
+    arr = array("f")
+    arr.frombytes(blob)
+    if sys.byteorder != "little":
+        arr.byteswap()
+    return arr.tolist()
+
+
+class EmbeddingCache:
+    def __init__(self, max_bytes: int, path: str = "", disk_max_bytes: int = 0):
+        self.max_bytes = max_bytes
+        self.disk_max_bytes = disk_max_bytes
+        self._disk_bytes = 0
+        self._mem: OrderedDict[str, bytes] = OrderedDict()
+        self._mem_bytes = 0
+        self._db: sqlite3.Connection | None = None
+        self._db_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vec BLOB NOT NULL)"
+            )
+            self._db.commit()
+            self._disk_bytes = self._db_size()
+
+    @staticmethod
+    def key(namespace: str, text: str) -> str:
+        h = hashlib.sha256(namespace.encode())
+        h.update(b"\0")
+        h.update(text.encode())
+        return h.hexdigest()
+
+    # --- Memory tier ---
+
+    def _mem_get(self, key: str) -> bytes | None:
+        blob = self._mem.get(key)
+        if blob is not None:
+            self._mem.move_to_end(key)
+        return blob
+
+    def _mem_put(self, key: str, blob: bytes) -> None:
+        size = len(blob) + _ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        old = self._mem.pop(key, None)
+        if old is not None:
+            self._mem_bytes -= len(old) + _ENTRY_OVERHEAD
+        self._mem[key] = blob
+        self._mem_bytes += size
+        while self._mem_bytes > self.max_bytes:
+            _, evicted = self._mem.popitem(last=False)
+            self._mem_bytes -= len(evicted) + _ENTRY_OVERHEAD
+
+    # --- Disk tier ---
+
+    def _db_get(self, keys: list[str]) -> dict[str, bytes]:
+        found: dict[str, bytes] = {}
+        with self._db_lock:
+            # Stay well below SQLite's bound-parameter limit.
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                marks = ",".join("?" * len(chunk))
+                rows = self._db.execute(
+                    f"SELECT key, vec FROM embeddings WHERE key IN ({marks})", chunk
+                )
+                found.update(rows)
+        return found
+
+    def _db_size(self) -> int:
+        row = self._db.execute("SELECT COALESCE(SUM(length(vec)), 0) FROM embeddings").fetchone()
+        return row[0]
+
+    def _db_put(self, items: list[tuple[str, bytes]]) -> None:
+        with self._db_lock:
+            self._db.executemany("INSERT OR REPLACE INTO embeddings (key, vec) VALUES (?, ?)", items)
+            self._db.commit()
+            # Replaced keys are counted twice here; the trim recounts exactly.
+            self._disk_bytes += sum(len(blob) for _, blob in items)
+            if self.disk_max_bytes and self._disk_bytes > self.disk_max_bytes:
+                self._db_trim()
+
+    def _db_trim(self) -> None:
+        """Delete the oldest-written rows until the tier is under the trim target.
+
+        INSERT OR REPLACE gives a rewritten key a fresh rowid, so rowid order is
+        write order. Freed pages are reused by later inserts, so the file stops
+        growing at about the cap rather than shrinking.
+        """
+        self._disk_bytes = self._db_size()
+        if self._disk_bytes <= self.disk_max_bytes:
+            return
+        keep = int(self.disk_max_bytes * _DISK_TRIM_TARGET)
+        cur = self._db.execute(
+            "DELETE FROM embeddings WHERE rowid IN ("
+            " SELECT rowid FROM ("
+            "  SELECT rowid, SUM(length(vec)) OVER (ORDER BY rowid DESC) AS newer"
+            "  FROM embeddings)"
+            " WHERE newer > ?)",
+            (keep,),
+        )
+        self._db.commit()
+        self._disk_bytes = self._db_size()
+        logger.info(
+            "Embedding cache disk tier trimmed %d rows (%d bytes left)",
+            cur.rowcount, self._disk_bytes,
+        )
+
+    # --- Public API ---
+
+    async def lookup(self, keys: list[str]) -> dict[str, list[float]]:
+        """Return the cached vectors for whichever of `keys` are present."""
+        blobs: dict[str, bytes] = {}
+        missing = []
+        for key in keys:
+            blob = self._mem_get(key)
+            if blob is not None:
+                blobs[key] = blob
+            else:
+                missing.append(key)
+        if missing and self._db is not None:
+            try:
+                from_disk = await asyncio.to_thread(self._db_get, missing)
+            except sqlite3.Error:
+                logger.exception("Embedding cache disk lookup failed")
+                from_disk = {}
+            for key, blob in from_disk.items():
+                self._mem_put(key, blob)
+            blobs.update(from_disk)
+        self.hits += len(blobs)
+        self.misses += len(keys) - len(blobs)
+        return {key: _unpack(blob) for key, blob in blobs.items()}
+
+    async def store(self, vectors: dict[str, list[float]]) -> None:
+        items = [(key, _pack(vec)) for key, vec in vectors.items()]
+        for key, blob in items:
+            self._mem_put(key, blob)
+        if items and self._db is not None:
+            try:
+                await asyncio.to_thread(self._db_put, items)
+            except sqlite3.Error:
+                logger.exception("Embedding cache disk write failed")
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._mem),
+            "bytes": self._mem_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "persistent": self._db is not None,
+            "disk_bytes": self._disk_bytes,
+            "disk_max_bytes": self.disk_max_bytes,
+        }
+
+    def close(self) -> None:
+        if self._db is not None:
+            with self._db_lock:
+                self._db.close()
+            self._db = None
+
+
+cache = EmbeddingCache(EMBED_CACHE_MAX_BYTES, EMBED_CACHE_PATH, EMBED_CACHE_DISK_MAX_BYTES)
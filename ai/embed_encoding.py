@@ -0,0 +1,80 @@
+"""Compact encodings for embedding responses.
+
+JSON float lists are several times larger than the vectors themselves and
+slow to parse. /embed can instead return each vector base64-encoded in one of
+these little-endian formats (`encoding_format`):
+
+    float    JSON list of floats (default)
+    base64   float32, base64 (same as the OpenAI API)
+    float16  float16, base64
+    int8     int8, base64, plus a per-vector "scale": value = int8 * scale
+
+With `Accept: application/octet-stream` the whole batch is returned as one
+contiguous matrix instead:
+
+    offset 0   magic b"EMBM"
+    offset 4   uint32 rows
+    offset 8   uint32 dim
+    offset 12  uint8 dtype code (0 float32, 1 float16, 2 int8), 3 bytes padding
+    offset 16  rows * dim elements, row-major
+    then       rows float32 scales (int8 only)
+
+which loads into NumPy without any per-float parsing:
+
+    rows, dim, code = struct.unpack_from("<IIB", body, 4)
+    matrix = np.frombuffer(body, DTYPE[code], rows * dim, 16).reshape(rows, dim)
+"""
+
+import base64
+import struct
+
+import numpy as np
+
+OCTET_STREAM = "application/octet-stream"
+MATRIX_MAGIC = b"EMBM"
+MATRIX_HEADER = struct.Struct("<4sIIB3x")
+
+# encoding_format -> (numpy dtype, dtype code in the matrix header)
+FORMATS: dict[str, tuple[np.dtype, int]] = {
+    "float": (np.dtype("<f4"), 0),
+    "base64": (np.dtype("<f4"), 0),
+    "float16": (np.dtype("<f2"), 1),
+    "int8": (np.dtype("i1"), 2),
+}
+
+
+def quantize(matrix: np.ndarray, fmt: str) -> tuple[np.ndarray, np.ndarray | None]:
+    """Convert a float32 matrix to `fmt`; returns (data, scales or None)."""
+    dtype, _ = FORMATS[fmt]
+    if fmt != "int8":
+        return matrix.astype(dtype, copy=False), None
+    peak = np.abs(matrix).max(axis=1)
+    peak[peak == 0] = 1.0
+    data = np.round(matrix / peak[:, None] * 127).astype(np.int8)
+    return data, (peak / 127).astype(np.float32)
+
+
+def encode_items(vectors: list[list[float]], fmt: str) -> list[dict]:
+    """OpenAI-style `data` items with each embedding encoded as `fmt`."""
+    if fmt == "float":
+        return [{"object": "embedding", "index": i, "embedding": vec} for i, vec in enumerate(vectors)]
+    data, scales = quantize(np.asarray(vectors, dtype=np.float32), fmt)
+    items = []
+    for i, row in enumerate(data):
+        item = {"object": "embedding", "index": i, "embedding": base64.b64encode(row.tobytes()).decode()}
+        if scales is not None:
+            item["scale"] = float(scales[i])
+        items.append(item)
+    return items
+
+
+def encode_matrix(vectors: list[list[float]], fmt: str) -> bytes:
+    """One contiguous matrix with the header described in the module docstring."""
+    matrix = np.asarray(vectors, dtype=np.float32)
+    if matrix.ndim != 2:
+        matrix = matrix.reshape(len(vectors), -1)
+    data, scales = quantize(matrix, fmt)
+    parts = [MATRIX_HEADER.pack(MATRIX_MAGIC, data.shape[0], data.shape[1], FORMATS[fmt][1]), data.tobytes()]
+    if scales is not None:
+        parts.append(scales.tobytes())
+    return b"".join(parts)
@@ -1,15 +1,50 @@
+from contextlib import asynccontextmanager
 from datetime import datetime
 
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
 
-from routers import chat, embed
+import balancer
+import upstream
+import vector_index
+from embed_cache import cache as embed_cache
+from routers import batch, chat, embed, sessions, vectors
+from shared import debug, metrics, remote_auth
 from shared.auth.router import router as auth_router
 
-app = FastAPI(title="Research-AI AI Service")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await upstream.startup()
+    balancer.start()
+    embed.batcher.start()
+    batch.runner.start()
+    await remote_auth.start_all()
+    debug.start_monitor("ai")
+    try:
+        yield
+    finally:
+        await debug.stop_monitor()
+        await remote_auth.close_all()
+        await batch.runner.stop()
+        await embed.batcher.stop()
+        await balancer.stop()
+        await upstream.shutdown()
+        embed_cache.close()
+        vector_index.close_all()
+
+
+app = FastAPI(title="Research-AI AI Service", lifespan=lifespan)
+app.add_middleware(metrics.MetricsMiddleware, prefix="ai")
+app.add_route("/metrics", metrics.metrics_endpoint, include_in_schema=False)
+debug.install(app)
 
 app.include_router(auth_router)
+app.include_router(sessions.router, prefix="/chat/sessions")
+app.include_router(batch.router, prefix="/chat/batch")
 app.include_router(chat.router, prefix="/chat")
 app.include_router(embed.router)
+app.include_router(vectors.router, prefix="/vectors")
 
 
 @app.get("/health")
@@ -19,3 +54,18 @@ def health():
         "service": "Research-AI AI",
         "time": datetime.now().isoformat(),
     }
+
+
+@app.get("/ready")
+def ready():
+    """Readiness for the load balancer: every upstream has a usable backend.
+
+    Answers from the cached background probe results and circuit-breaker
+    state, so frequent checks put no load on llama-server.
+    """
+    upstreams = balancer.readiness()
+    ok = all(u["ready"] for u in upstreams.values())
+    return JSONResponse(
+        status_code=200 if ok else 503,
+        content={"status": "ready" if ok else "degraded", "upstreams": upstreams},
+    )
@@ -0,0 +1,75 @@
+"""Helpers for streaming NDJSON request and response bodies.
+
+`iter_lines` reads a request body incrementally and yields one decoded line at
+a time, so arbitrarily large uploads never sit in memory as a whole.
+`FullDuplexResponse` streams a response while the request body is still being
+read.
+"""
+
+from collections.abc import AsyncIterator
+
+from fastapi import Request
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+class LineTooLong(Exception):
+    """A single line exceeded the allowed size; the rest of it was skipped."""
+
+
+async def iter_lines(request: Request, max_line_bytes: int) -> AsyncIterator[bytes | LineTooLong]:
+    """Yield each non-empty line of the request body (without the newline).
+
+    A line longer than `max_line_bytes` is discarded up to its newline and a
+    LineTooLong instance is yielded in its place, so callers can report it and
+    carry on with the next line.
+    """
+    buf = bytearray()
+    skipping = False
+    async for chunk in request.stream():
+        start = 0
+        while True:
+            nl = chunk.find(b"\n", start)
+            if nl == -1:
+                if not skipping:
+                    buf += chunk[start:]
+                    if len(buf) > max_line_bytes:
+                        buf.clear()
+                        skipping = True
+                break
+            if skipping:
+                skipping = False
+                yield LineTooLong()
+            else:
+                buf += chunk[start:nl]
+                if len(buf) > max_line_bytes:
+                    yield LineTooLong()
+                elif buf.strip():
+                    yield bytes(buf)
+                buf.clear()
+            start = nl + 1
+    if skipping:
+        yield LineTooLong()
+    elif buf.strip():
+        yield bytes(buf)
+
+
+class FullDuplexResponse(StreamingResponse):
+    """StreamingResponse that never reads from `receive` itself.
+
+    Starlette's StreamingResponse may listen for `http.disconnect` while it
+    streams, which would swallow request body chunks that are still arriving.
+    Here a disconnect surfaces instead through the request body reader
+    (ClientDisconnect) or a failing send.
+    """
+
+    def __init__(self, content, **kwargs):
+        kwargs.setdefault("media_type", NDJSON_MEDIA_TYPE)
+        super().__init__(content, **kwargs)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
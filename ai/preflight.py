@@ -0,0 +1,174 @@
+"""Context-budget preflight for chat requests.
+
+Counts prompt tokens with llama-server's /tokenize endpoint before a request
+is admitted, so requests that cannot fit the context window are rejected (or
+trimmed) without spending GPU prefill on them.
+
+Token counts are cached per message content in an LRU, so the shared history
+that clients resend on every turn is tokenized once. Each message is charged a
+fixed CHAT_TEMPLATE_TOKENS_PER_MESSAGE on top of its content for the chat
+template's role markers.
+
+Preflight fails open: if the tokenizer cannot be reached the request goes
+through unchecked. The same holds while the context window is unknown: a
+backend without a usable /props is asked again only every
+_PROPS_RETRY_SECONDS, not on every request.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+
+import httpx
+
+import balancer
+import upstream
+from config import (
+    CHAT_CONTEXT_TOKENS,
+    CHAT_TEMPLATE_TOKENS_PER_MESSAGE,
+    CHAT_TOKEN_CACHE_ENTRIES,
+)
+from upstream import UpstreamStatusError
+
+logger = logging.getLogger("ai.preflight")
+
+# Tokens the template adds once per prompt (assistant turn header).
+_PROMPT_PRIMING_TOKENS = 3
+# /tokenize calls in flight at once (all requests together), so preflight
+# cannot crowd out generation traffic on the backends.
+_TOKENIZE_CONCURRENCY = 4
+_PROPS_RETRY_SECONDS = 60
+
+
+class ContextOverflow(Exception):
+    def __init__(self, prompt_tokens: int, max_tokens: int, context: int):
+        super().__init__(
+            f"prompt ({prompt_tokens} tokens) plus max_tokens ({max_tokens}) "
+            f"exceeds the context window ({context} tokens)"
+        )
+
+
+class TokenCounter:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._counts: OrderedDict[bytes, int] = OrderedDict()
+        self._context: int | None = CHAT_CONTEXT_TOKENS or None
+        self._props_retry_at = 0.0
+        self._tokenize_slots = asyncio.Semaphore(_TOKENIZE_CONCURRENCY)
+        self.hits = 0
+        self.misses = 0
+
+    async def _call(self, path: str, body: dict | None = None) -> httpx.Response:
+        """Call a chat backend without reserving it.
+
+        /tokenize and /props do not occupy a generation slot, so they must not
+        count towards the outstanding requests the scheduler admits against:
+        the scheduler only re-dispatches when one of its own slots is freed,
+        and requests queued behind a preflight call would wait for nothing.
+        """
+        pool = balancer.get_pool("chat")
+        backend = pool.pick()
+        client = upstream.get_client("chat")
+        try:
+            if body is None:
+                return await client.get(f"{backend.url}{path}")
+            return await client.post(f"{backend.url}{path}", json=body)
+        except httpx.ConnectError:
+            pool.report_connect_error(backend)
+            raise
+
+    async def _tokenize(self, text: str) -> int:
+        async with self._tokenize_slots:
+            resp = await self._call("/tokenize", {"content": text})
+        if resp.status_code != 200:
+            raise UpstreamStatusError(resp.status_code)
+        return len(resp.json()["tokens"])
+
+    async def count(self, texts: list[str]) -> list[int]:
+        """Token counts for `texts`, tokenizing only the ones not cached yet."""
+        keys = [hashlib.blake2b(text.encode(), digest_size=16).digest() for text in texts]
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key in self._counts:
+                self._counts.move_to_end(key)
+                self.hits += 1
+            elif key not in missing:
+                missing[key] = text
+                self.misses += 1
+        if missing:
+            counts = await asyncio.gather(*(self._tokenize(text) for text in missing.values()))
+            for key, n in zip(missing, counts):
+                self._counts[key] = n
+            while len(self._counts) > self.max_entries:
+                self._counts.popitem(last=False)
+        return [self._counts[key] for key in keys]
+
+    async def context_window(self) -> int | None:
+        """CHAT_CONTEXT_TOKENS, or the per-slot n_ctx reported by a chat backend."""
+        if self._context is None and time.monotonic() >= self._props_retry_at:
+            # Set first, so concurrent requests do not all ask at once.
+            self._props_retry_at = time.monotonic() + _PROPS_RETRY_SECONDS
+            resp = await self._call("/props")
+            if resp.status_code == 200:
+                n_ctx = resp.json().get("default_generation_settings", {}).get("n_ctx")
+                if isinstance(n_ctx, int) and n_ctx > 0:
+                    self._context = n_ctx
+        return self._context
+
+    def stats(self) -> dict:
+        return {
+            "context_tokens": self._context,
+            "entries": len(self._counts),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+counter = TokenCounter(CHAT_TOKEN_CACHE_ENTRIES)
+
+
+def _content_text(msg: dict) -> str:
+    content = msg.get("content", "")
+    return content if isinstance(content, str) else json.dumps(content)
+
+
+async def check_budget(body: dict, trim: bool) -> tuple[dict, int]:
+    """Make sure the prompt plus max_tokens fits the context window.
+
+    Returns (body, dropped) where `dropped` is the number of messages removed
+    when `trim` is set: the oldest non-system turns go first, and the last
+    message is always kept. Raises ContextOverflow if it still does not fit.
+    """
+    try:
+        context = await counter.context_window()
+        if context is None:
+            return body, 0
+        messages = body["messages"]
+        counts = await counter.count([_content_text(m) for m in messages])
+    except (httpx.HTTPError, UpstreamStatusError, KeyError, ValueError) as exc:
+        logger.warning("Skipping context preflight: %s", type(exc).__name__)
+        return body, 0
+
+    per_message = [n + CHAT_TEMPLATE_TOKENS_PER_MESSAGE for n in counts]
+    max_tokens = int(body.get("max_tokens", 1))
+    prompt = sum(per_message) + _PROMPT_PRIMING_TOKENS
+    if prompt + max_tokens <= context:
+        return body, 0
+    if not trim:
+        raise ContextOverflow(prompt, max_tokens, context)
+
+    keep = [True] * len(messages)
+    for i, msg in enumerate(messages[:-1]):
+        if prompt + max_tokens <= context:
+            break
+        if msg.get("role") == "system":
+            continue
+        keep[i] = False
+        prompt -= per_message[i]
+    if prompt + max_tokens > context:
+        raise ContextOverflow(prompt, max_tokens, context)
+    trimmed = [m for m, k in zip(messages, keep) if k]
+    return {**body, "messages": trimmed}, len(messages) - len(trimmed)
@@ -0,0 +1,112 @@
+"""Exact-match response cache with single-flight deduplication.
+
+Values are raw response bodies (bytes) keyed by a SHA-256 of the canonical
+JSON of the request. Entries expire after a TTL and the least recently used
+ones are evicted once the total size passes a byte budget.
+
+Concurrent requests for the same key share one upstream call: the first
+caller starts it as a separate task and later callers await that task instead
+of issuing their own. Because the fetch runs in its own task, a caller that
+disconnects does not cancel it for the others.
+"""
+
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+
+
+class ResponseCache:
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, bytes]] = OrderedDict()
+        self._bytes = 0
+        self._inflight: dict[str, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_bytes > 0
+
+    @staticmethod
+    def key(body: dict) -> str:
+        canonical = json.dumps(body, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    def get(self, key: str) -> bytes | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: bytes) -> None:
+        if len(value) > self.max_bytes:
+            return
+        self._remove(key)
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._bytes += len(value)
+        while self._bytes > self.max_bytes:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self._bytes -= len(evicted)
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry[1])
+
+    async def get_or_fetch(
+        self, key: str, fetch: Callable[[], Awaitable[bytes | None]]
+    ) -> tuple[bytes | None, str]:
+        """Return (value, source) where source is "HIT", "SHARED" or "MISS".
+
+        `fetch` returns the body to cache, or None for a response that must
+        not be cached (it is still handed to every caller sharing the call).
+        """
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value, "HIT"
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.shared += 1
+            return await asyncio.shield(task), "SHARED"
+
+        self.misses += 1
+        task = asyncio.create_task(self._fetch_and_store(key, fetch))
+        # Mark the exception retrieved even if every caller has gone away.
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        self._inflight[key] = task
+        return await asyncio.shield(task), "MISS"
+
+    async def _fetch_and_store(self, key: str, fetch: Callable[[], Awaitable[bytes | None]]) -> bytes | None:
+        try:
+            value = await fetch()
+            if value is not None:
+                self.put(key, value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "shared": self.shared,
+            "in_flight": len(self._inflight),
+        }
@@ -0,0 +1,154 @@
+import logging
+
+import httpx
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse
+from starlette.requests import ClientDisconnect
+from starlette.responses import StreamingResponse
+
+import preflight
+from batch_jobs import BatchRunner, RetryLater, follow_results
+from codec import JSONDecodeError, loads
+from config import (
+    CHAT_BATCH_CONCURRENCY,
+    CHAT_BATCH_DIR,
+    CHAT_BATCH_MAX_REQUESTS,
+    CHAT_BATCH_RETENTION,
+    CHAT_BATCH_RETRIES,
+    CHAT_CONTEXT_OVERFLOW,
+    CHAT_PREFLIGHT,
+)
+from ndjson import NDJSON_MEDIA_TYPE, LineTooLong, iter_lines
+from preflight import ContextOverflow
+from routers.chat import MAX_BODY_BYTES, _proxy_response, _subject, _validate_body
+from scheduler import PRIORITY_BATCH, QueueFull
+
+logger = logging.getLogger("ai.batch")
+
+router = APIRouter()
+
+
+async def _run_request(body: dict, subject: str) -> dict:
+    """Run one batch request like a non-streaming /chat/completions call, at batch priority."""
+    if CHAT_PREFLIGHT:
+        try:
+            body, _ = await preflight.check_budget(body, trim=CHAT_CONTEXT_OVERFLOW == "trim")
+        except ContextOverflow as exc:
+            return {"status": 422, "error": str(exc)}
+    try:
+        response = await _proxy_response(body, subject, PRIORITY_BATCH)
+    except QueueFull as exc:
+        raise RetryLater("AI model is busy", exc.retry_after) from None
+    except httpx.ConnectError:
+        raise RetryLater("AI model is unavailable") from None
+    except httpx.TimeoutException:
+        raise RetryLater("AI model timed out") from None
+    if response.status_code != 200:
+        return {"status": 502, "error": "AI model returned an error"}
+    return {"status": 200, "response": loads(response.body)}
+
+
+runner = BatchRunner(CHAT_BATCH_DIR, _run_request, CHAT_BATCH_CONCURRENCY, CHAT_BATCH_RETRIES, CHAT_BATCH_RETENTION)
+
+
+def _parse_line(line: bytes, line_no: int) -> tuple[object, dict | None, str | None]:
+    """Return (id, cleaned body, error) for one request line.
+
+    A line is either a chat request body or {"custom_id"?, "body": {...}}.
+    """
+    try:
+        obj = loads(line)
+    except JSONDecodeError:
+        return line_no, None, "Invalid JSON line"
+    if not isinstance(obj, dict):
+        return line_no, None, "Line must be a JSON object"
+    item_id = obj.get("custom_id", obj.get("id", line_no))
+    body = obj["body"] if isinstance(obj.get("body"), dict) else obj
+    cleaned, error = _validate_body(body)
+    if error:
+        return item_id, None, error
+    cleaned["stream"] = False
+    return item_id, cleaned, None
+
+
+def _not_found() -> JSONResponse:
+    return JSONResponse(status_code=404, content={"error": "Batch job not found"})
+
+
+@router.post("")
+async def submit_batch(request: Request):
+    """Queue a JSONL file of chat requests; returns the job id at once (202).
+
+    Invalid lines do not fail the job: each gets an error result line.
+    """
+    writer = runner.create(_subject(request))
+    line_no = 0
+    try:
+        async for line in iter_lines(request, MAX_BODY_BYTES):
+            line_no += 1
+            if line_no > CHAT_BATCH_MAX_REQUESTS:
+                writer.abort()
+                return JSONResponse(
+                    status_code=413, content={"error": f"too many requests (max {CHAT_BATCH_MAX_REQUESTS})"}
+                )
+            if isinstance(line, LineTooLong):
+                writer.reject(line_no, f"Line exceeds {MAX_BODY_BYTES} bytes")
+                continue
+            item_id, body, error = _parse_line(line, line_no)
+            if error:
+                writer.reject(item_id, error)
+            else:
+                writer.add(item_id, body)
+    except ClientDisconnect:
+        writer.abort()
+        raise
+    except Exception:
+        writer.abort()
+        logger.exception("Failed to store batch job")
+        return JSONResponse(status_code=500, content={"error": "Internal AI service error"})
+    if line_no == 0:
+        writer.abort()
+        return JSONResponse(status_code=422, content={"error": "No requests in batch"})
+    job = writer.commit()
+    return JSONResponse(status_code=202, content=job.info())
+
+
+@router.get("")
+async def list_batches(request: Request):
+    return {"jobs": [job.info() for job in runner.list(_subject(request))]}
+
+
+@router.get("/stats")
+def batch_stats():
+    return runner.stats()
+
+
+@router.get("/{job_id}")
+async def get_batch(job_id: str, request: Request):
+    job = runner.get(job_id, _subject(request))
+    if job is None:
+        return _not_found()
+    return job.info()
+
+
+@router.get("/{job_id}/results")
+async def batch_results(job_id: str, request: Request, follow: bool = True):
+    """Stream result lines as NDJSON in completion order.
+
+    With follow (the default) the stream stays open while the job runs and
+    ends with a {"done": true, ...} summary line.
+    """
+    job = runner.get(job_id, _subject(request))
+    if job is None:
+        return _not_found()
+    return StreamingResponse(follow_results(runner, job, follow), media_type=NDJSON_MEDIA_TYPE)
+
+
+@router.delete("/{job_id}")
+async def delete_batch(job_id: str, request: Request):
+    """Cancel the job if it is still running and delete its results."""
+    job = runner.get(job_id, _subject(request))
+    if job is None:
+        return _not_found()
+    runner.delete(job)
+    return {"status": "deleted"}
@@ -1,17 +1,49 @@
+import hashlib
 import logging
+import time
+from collections.abc import Callable
+from contextlib import AsyncExitStack
 
 import httpx
 from fastapi import APIRouter, Request
-from fastapi.responses import JSONResponse
-from starlette.responses import StreamingResponse
+from fastapi.responses import JSONResponse, Response
 
-from config import CHAT_URL
+import balancer
+import preflight
+import upstream
+from codec import JSON_HEADERS, BodyError, dumps, read_json
+from config import (
+    CHAT_CACHE_MAX_BYTES,
+    CHAT_CACHE_TTL,
+    CHAT_CONTEXT_OVERFLOW,
+    CHAT_PREFLIGHT,
+    CHAT_QUEUE_MAX,
+    CHAT_QUEUE_TIMEOUT,
+    CHAT_SEMANTIC_CACHE_TTL,
+    CHAT_SEMANTIC_CAPACITY,
+    CHAT_SEMANTIC_EMBED_MODEL,
+    CHAT_SEMANTIC_THRESHOLD,
+    CHAT_SLOTS_PER_BACKEND,
+    CHAT_STICKY_PREFIX_CHARS,
+    CHAT_STREAM_COALESCE_BYTES,
+    CHAT_STREAM_COALESCE_MS,
+)
+from preflight import ContextOverflow
+from shared import metrics
+from shared.auth.dependencies import access_claims
+from response_cache import ResponseCache
+from routers.embed import embed_texts
+from scheduler import PRIORITY_BATCH, PRIORITY_INTERACTIVE, FairScheduler, QueueFull
+from semantic_cache import SemanticCache, split_prompt
+from sse_relay import SSERelayResponse
+from sse_relay import stats as relay_stats
+from upstream import UpstreamStatusError
 
 logger = logging.getLogger("ai.chat")
 
 router = APIRouter()
 
-CHAT_COMPLETIONS_URL = f"{CHAT_URL}/v1/chat/completions"
+COMPLETIONS_PATH = "/v1/chat/completions"
 
 # --- Validation limits ---
 MAX_MESSAGES = 50
@@ -21,6 +53,17 @@ ALLOWED_PARAMS = {"messages", "stream", "temperature", "top_p", "max_tokens", "s
 MAX_TOKENS_LIMIT = 8192
 TEMPERATURE_RANGE = (0.0, 2.0)
 
+response_cache = ResponseCache(CHAT_CACHE_MAX_BYTES, CHAT_CACHE_TTL)
+semantic_cache = SemanticCache(CHAT_SEMANTIC_THRESHOLD, CHAT_SEMANTIC_CACHE_TTL, CHAT_SEMANTIC_CAPACITY)
+_SEMANTIC_EMBED_PARAMS = {"model": CHAT_SEMANTIC_EMBED_MODEL} if CHAT_SEMANTIC_EMBED_MODEL else {}
+scheduler = FairScheduler(
+    balancer.get_pool("chat"), CHAT_SLOTS_PER_BACKEND, CHAT_QUEUE_MAX, CHAT_QUEUE_TIMEOUT
+)
+
+metrics.gauge("ai_chat_in_flight", "Chat requests holding a backend slot").set_function(lambda: scheduler.in_flight)
+metrics.gauge("ai_chat_queue_depth", "Chat requests waiting for a slot").set_function(lambda: scheduler.queue_depth)
+CHAT_REJECTED = metrics.counter("ai_chat_queue_rejections_total", "Chat requests rejected with 429 (queue full)")
+
 
 def _validate_body(body: dict) -> tuple[dict | None, str | None]:
     """Validate and sanitize the request body.
@@ -58,33 +101,85 @@ def _validate_body(body: dict) -> tuple[dict | None, str | None]:
 
 @router.post("/completions")
 async def chat_completions(request: Request):
-    # Early reject based on Content-Length header (not a security boundary —
-    # the per-field validation below is the real guard).
-    content_length = request.headers.get("content-length")
-    if content_length:
-        try:
-            if int(content_length) > MAX_BODY_BYTES:
-                return JSONResponse(status_code=413, content={"error": "Payload too large"})
-        except ValueError:
-            return JSONResponse(status_code=400, content={"error": "Invalid Content-Length header"})
-
+    # The size cap is enforced while the body streams in (not a security
+    # boundary on its own — the per-field validation below is the real guard).
     try:
-        body = await request.json()
-    except Exception:
-        return JSONResponse(status_code=400, content={"error": "Invalid JSON body"})
+        body = await read_json(request, MAX_BODY_BYTES)
+    except BodyError as exc:
+        return exc.response
+    if not isinstance(body, dict):
+        return JSONResponse(status_code=400, content={"error": "Body must be a JSON object"})
 
     cleaned, error = _validate_body(body)
     if error:
         return JSONResponse(status_code=422, content={"error": error})
 
+    return await run_completion(request, cleaned)
+
+
+async def run_completion(
+    request: Request,
+    body: dict,
+    affinity: str | None = None,
+    on_finish: Callable[[bytes | None], None] | None = None,
+) -> Response:
+    """Preflight, schedule and proxy a validated chat body.
+
+    `affinity` overrides the sticky-routing key. `on_finish`, if given, is
+    called exactly once with the complete response body (the raw SSE bytes
+    for streams) on success, or None on any failure or client disconnect.
+    """
+    try:
+        response = await _run_completion(request, body, affinity, on_finish)
+    except BaseException:
+        if on_finish is not None:
+            on_finish(None)
+        raise
+    if on_finish is not None and not isinstance(response, SSERelayResponse):
+        on_finish(response.body if response.status_code == 200 else None)
+    return response
+
+
+async def _run_completion(
+    request: Request,
+    cleaned: dict,
+    affinity: str | None,
+    on_finish: Callable[[bytes | None], None] | None,
+) -> Response:
+    if CHAT_PREFLIGHT:
+        # Per-request override: X-Context-Overflow: trim | reject
+        overflow = request.headers.get("x-context-overflow", CHAT_CONTEXT_OVERFLOW).lower()
+        try:
+            cleaned, dropped = await preflight.check_budget(cleaned, trim=overflow == "trim")
+        except ContextOverflow as exc:
+            return JSONResponse(status_code=422, content={"error": str(exc)})
+        if dropped:
+            logger.info("Trimmed %d oldest messages to fit the context window", dropped)
+
     stream = cleaned.get("stream", False)
+    route = {
+        "subject": _subject(request),
+        "priority": _priority(request),
+        "affinity": affinity or _affinity_key(request, cleaned),
+    }
 
     try:
         if stream:
-            return await _stream_response(cleaned)
-        return await _proxy_response(cleaned)
+            return await _stream_response(cleaned, coalesce=_coalesce(request), on_finish=on_finish, **route)
+        if semantic_cache.enabled and not _no_cache(request):
+            return await _semantic_response(cleaned, exact=_is_cacheable(request, cleaned), **route)
+        if _is_cacheable(request, cleaned):
+            return await _cached_response(cleaned, **route)
+        return await _proxy_response(cleaned, **route)
+    except QueueFull as exc:
+        CHAT_REJECTED.inc()
+        return JSONResponse(
+            status_code=429,
+            content={"error": "AI model is busy, try again later"},
+            headers={"Retry-After": str(exc.retry_after)},
+        )
     except httpx.ConnectError:
-        logger.error("Cannot connect to llama-server at %s", CHAT_COMPLETIONS_URL)
+        logger.error("Cannot connect to chat llama-server")
         return JSONResponse(status_code=502, content={"error": "AI model is unavailable"})
     except httpx.TimeoutException:
         logger.error("Timeout waiting for llama-server")
@@ -94,28 +189,200 @@ async def chat_completions(request: Request):
         return JSONResponse(status_code=500, content={"error": "Internal AI service error"})
 
 
-async def _proxy_response(body: dict):
-    # verify=True ensures TLS cert validation if CHAT_URL uses HTTPS.
-    # Do not set verify=False — it would allow MITM attacks.
-    async with httpx.AsyncClient(timeout=120.0, verify=True) as client:
-        resp = await client.post(CHAT_COMPLETIONS_URL, json=body)
+def _subject(request: Request) -> str:
+    """Fair-share key: the token subject, else the user set by forward_auth, else the client IP."""
+    claims = access_claims(request.headers.get("authorization", ""))
+    if claims is not None:
+        return claims["sub"]
+    user = request.headers.get("x-auth-user")
+    if user:
+        return user
+    return request.client.host if request.client else "unknown"
+
+
+def _priority(request: Request) -> int:
+    if request.headers.get("x-priority", "").lower() in ("batch", "low"):
+        return PRIORITY_BATCH
+    return PRIORITY_INTERACTIVE
+
+
+def _coalesce(request: Request) -> tuple[float, int] | None:
+    """Stream coalescing settings: X-Stream-Coalesce (ms, "on" or "off"), else config."""
+    value = request.headers.get("x-stream-coalesce", "").strip().lower()
+    if value in ("off", "0", "false", "no"):
+        return None
+    if value in ("on", "1", "true", "yes"):
+        ms = CHAT_STREAM_COALESCE_MS or 50
+    else:
+        try:
+            ms = float(value) if value else CHAT_STREAM_COALESCE_MS
+        except ValueError:
+            ms = CHAT_STREAM_COALESCE_MS
+    if ms <= 0:
+        return None
+    return min(ms, 1000) / 1000, CHAT_STREAM_COALESCE_BYTES
+
+
+def _affinity_key(request: Request, body: dict) -> str | None:
+    """Key for sticky routing: an explicit conversation id, else a prompt-prefix hash.
+
+    Turns of one conversation share their leading messages, so hashing the
+    first two keeps them on the backend that has that prefix in its cache.
+    """
+    conversation = request.headers.get("x-conversation-id")
+    if conversation:
+        return f"conv:{conversation}"
+    if CHAT_STICKY_PREFIX_CHARS <= 0:
+        return None
+    h = hashlib.blake2b(digest_size=16)
+    remaining = CHAT_STICKY_PREFIX_CHARS
+    for msg in body["messages"][:2]:
+        content = msg.get("content", "")
+        if not isinstance(content, str):
+            content = str(content)
+        piece = f"{msg.get('role', '')}\0{content[:remaining]}\0"
+        h.update(piece.encode())
+        remaining -= len(content)
+        if remaining <= 0:
+            break
+    return f"prefix:{h.hexdigest()}"
+
+
+async def _proxy_response(
+    body: dict,
+    subject: str = "anonymous",
+    priority: int = PRIORITY_INTERACTIVE,
+    affinity: str | None = None,
+):
+    client = upstream.get_client("chat")
+    async with scheduler.slot(subject, priority, affinity) as backend:
+        resp = await client.post(
+            f"{backend.url}{COMPLETIONS_PATH}", content=dumps(body), headers=JSON_HEADERS
+        )
+    if resp.status_code != 200:
+        return JSONResponse(
+            status_code=502,
+            content={"error": "AI model returned an error"},
+        )
+    # Pass the upstream JSON through as-is instead of decoding and re-encoding it.
+    return Response(content=resp.content, media_type="application/json")
+
+
+def _no_cache(request: Request) -> bool:
+    cache_control = request.headers.get("cache-control", "").lower()
+    return "no-cache" in cache_control or "no-store" in cache_control
+
+
+def _is_cacheable(request: Request, body: dict) -> bool:
+    """Only greedy (temperature 0) requests give repeatable answers.
+
+    Clients opt out per request with `Cache-Control: no-cache` or `no-store`.
+    """
+    if not response_cache.enabled or _no_cache(request):
+        return False
+    try:
+        return float(body.get("temperature", -1)) == 0.0
+    except (TypeError, ValueError):
+        return False
+
+
+async def _cached_response(
+    body: dict,
+    subject: str = "anonymous",
+    priority: int = PRIORITY_INTERACTIVE,
+    affinity: str | None = None,
+):
+    client = upstream.get_client("chat")
+
+    async def fetch() -> bytes | None:
+        async with scheduler.slot(subject, priority, affinity) as backend:
+            resp = await client.post(
+                f"{backend.url}{COMPLETIONS_PATH}", content=dumps(body), headers=JSON_HEADERS
+            )
+        return resp.content if resp.status_code == 200 else None
+
+    content, source = await response_cache.get_or_fetch(ResponseCache.key(body), fetch)
+    if content is None:
+        return JSONResponse(
+            status_code=502,
+            content={"error": "AI model returned an error"},
+        )
+    return Response(content=content, media_type="application/json", headers={"X-Cache": source})
+
+
+async def _semantic_response(
+    body: dict,
+    exact: bool = False,
+    subject: str = "anonymous",
+    priority: int = PRIORITY_INTERACTIVE,
+    affinity: str | None = None,
+):
+    """Serve near-duplicate questions from the semantic cache, else proxy and remember.
+
+    The last user turn is embedded with the embedding backend; if that fails
+    the request goes through uncached.
+    """
+    prompt = split_prompt(body)
+    vector = None
+    if prompt is not None:
+        text, context = prompt
+        try:
+            vectors, _, _ = await embed_texts(_SEMANTIC_EMBED_PARAMS, [text])
+            vector = vectors[0]
+        except (UpstreamStatusError, httpx.HTTPError) as exc:
+            logger.warning("Skipping semantic cache: %s", type(exc).__name__)
+        else:
+            found = semantic_cache.lookup(vector, context)
+            if found is not None:
+                content, similarity = found
+                return Response(
+                    content=content,
+                    media_type="application/json",
+                    headers={"X-Cache": "SEMANTIC", "X-Semantic-Similarity": f"{similarity:.4f}"},
+                )
+
+    fetch = _cached_response if exact else _proxy_response
+    response = await fetch(body, subject, priority, affinity)
+    if vector is not None and response.status_code == 200:
+        semantic_cache.store(vector, context, response.body)
+    return response
+
+
+async def _stream_response(
+    body: dict,
+    subject: str = "anonymous",
+    priority: int = PRIORITY_INTERACTIVE,
+    affinity: str | None = None,
+    coalesce: tuple[float, int] | None = None,
+    on_finish: Callable[[bytes | None], None] | None = None,
+):
+    client = upstream.get_client("chat")
+    started = time.perf_counter()
+    # Open the upstream stream here so connect errors and timeouts reach the
+    # handler in chat_completions; the relay response closes it when done.
+    async with AsyncExitStack() as stack:
+        backend = await stack.enter_async_context(scheduler.slot(subject, priority, affinity))
+        resp = await stack.enter_async_context(
+            client.stream(
+                "POST", f"{backend.url}{COMPLETIONS_PATH}", content=dumps(body), headers=JSON_HEADERS
+            )
+        )
         if resp.status_code != 200:
             return JSONResponse(
                 status_code=502,
-                content={"error": "AI model returned an error"},
+                content={"error": f"AI model returned status {resp.status_code}"},
             )
-        return resp.json()
-
+        close = stack.pop_all().aclose
+    return SSERelayResponse(resp, close, started, label=backend.url, coalesce=coalesce, on_finish=on_finish)
 
-async def _stream_response(body: dict):
-    async def event_generator():
-        async with httpx.AsyncClient(timeout=120.0, verify=True) as client:
-            async with client.stream("POST", CHAT_COMPLETIONS_URL, json=body) as resp:
-                if resp.status_code != 200:
-                    yield f'{{"error": "AI model returned status {resp.status_code}"}}\n\n'
-                    return
-                async for line in resp.aiter_lines():
-                    if line:
-                        yield f"{line}\n\n"
 
-    return StreamingResponse(event_generator(), media_type="text/event-stream")
+@router.get("/stats")
+def chat_stats():
+    return {
+        "backends": balancer.get_pool("chat").stats(),
+        "scheduler": scheduler.stats(),
+        "cache": response_cache.stats(),
+        "semantic_cache": semantic_cache.stats(),
+        "tokens": preflight.counter.stats(),
+        "streams": relay_stats.snapshot(),
+    }
@@ -1,19 +1,37 @@
+import asyncio
+import json
 import logging
 
 import httpx
 from fastapi import APIRouter, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 
-from config import EMBED_URL
+import balancer
+import upstream
+from codec import JSON_HEADERS, BodyError, FastJSONResponse, JSONDecodeError, dumps, loads, read_json
+from config import (
+    EMBED_BATCH_MAX_INPUTS,
+    EMBED_BATCH_WINDOW_MS,
+    EMBED_BULK_CONCURRENCY,
+    EMBED_BULK_MAX_LINE_BYTES,
+    EMBED_CHUNK_CHARS,
+    EMBED_CHUNK_OVERLAP,
+)
+from embed_batcher import EmbedBatcher
+from embed_cache import cache
+from embed_encoding import FORMATS, OCTET_STREAM, encode_items, encode_matrix
+from ndjson import FullDuplexResponse, LineTooLong, iter_lines
+from upstream import UpstreamStatusError
 
 logger = logging.getLogger("ai.embed")
 
 router = APIRouter()
 
-EMBEDDINGS_URL = f"{EMBED_URL}/v1/embeddings"
+EMBEDDINGS_PATH = "/v1/embeddings"
 
 MAX_INPUT_CHARS = 30_000
 MAX_BODY_BYTES = 256 * 1024  # 256 KB
+BULK_GROUP_CHUNKS = 16  # chunks of one document embedded per upstream call
 
 
 def _validate_body(body: dict) -> str | None:
@@ -25,6 +43,8 @@ def _validate_body(body: dict) -> str | None:
         if len(inp) > MAX_INPUT_CHARS:
             return f"input exceeds {MAX_INPUT_CHARS} characters"
     elif isinstance(inp, list):
+        if not inp:
+            return "input must not be empty"
         for i, item in enumerate(inp):
             if not isinstance(item, str):
                 return f"input[{i}] must be a string"
@@ -35,38 +55,89 @@ def _validate_body(body: dict) -> str | None:
     return None
 
 
+async def _fetch_embeddings(params: dict, texts: list[str]) -> tuple[list[list[float]], dict]:
+    """Embed `texts` upstream in one request.
+
+    Returns the vectors in input order and the upstream payload (for model/usage).
+    """
+    client = upstream.get_client("embed")
+    async with balancer.get_pool("embed").acquire() as backend:
+        resp = await client.post(
+            f"{backend.url}{EMBEDDINGS_PATH}", content=dumps({**params, "input": texts}), headers=JSON_HEADERS
+        )
+    if resp.status_code != 200:
+        raise UpstreamStatusError(resp.status_code)
+    payload = loads(resp.content)
+    data = sorted(payload["data"], key=lambda d: d.get("index", 0))
+    return [d["embedding"] for d in data], payload
+
+
+# Started and stopped in the app lifespan (ai/main.py).
+batcher = EmbedBatcher(_fetch_embeddings, EMBED_BATCH_WINDOW_MS, EMBED_BATCH_MAX_INPUTS)
+
+
+async def embed_texts(params: dict, texts: list[str]) -> tuple[list[list[float]], int, dict]:
+    """Embed `texts`, serving what it can from the cache.
+
+    Only inputs missing from the cache are sent upstream. Returns the vectors in
+    input order, the number of inputs served from cache, and the upstream
+    payload (empty on a full cache hit).
+    """
+    namespace = json.dumps(params, sort_keys=True, separators=(",", ":"))
+    keys = [cache.key(namespace, text) for text in texts]
+    found = await cache.lookup(list(dict.fromkeys(keys)))
+    served = sum(1 for key in keys if key in found)
+
+    missing: dict[str, str] = {}
+    for key, text in zip(keys, texts):
+        if key not in found and key not in missing:
+            missing[key] = text
+
+    payload: dict = {}
+    if missing:
+        vectors, payload = await batcher.submit(params, list(missing.values()))
+        fresh = dict(zip(missing, vectors))
+        await cache.store(fresh)
+        found.update(fresh)
+
+    return [found[key] for key in keys], served, payload
+
+
 @router.post("/embed")
 async def embed(request: Request):
-    content_length = request.headers.get("content-length")
-    if content_length:
-        try:
-            if int(content_length) > MAX_BODY_BYTES:
-                return JSONResponse(status_code=413, content={"error": "Payload too large"})
-        except ValueError:
-            return JSONResponse(status_code=400, content={"error": "Invalid Content-Length header"})
-
+    """OpenAI-style embeddings; see embed_encoding for the encoding_format
+    options and the `Accept: application/octet-stream` matrix response."""
     try:
-        body = await request.json()
-    except Exception:
-        return JSONResponse(status_code=400, content={"error": "Invalid JSON body"})
+        body = await read_json(request, MAX_BODY_BYTES)
+    except BodyError as exc:
+        return exc.response
+    if not isinstance(body, dict):
+        return JSONResponse(status_code=400, content={"error": "Body must be a JSON object"})
 
     error = _validate_body(body)
     if error:
         return JSONResponse(status_code=422, content={"error": error})
+    fmt = body.get("encoding_format", "float")
+    if fmt not in FORMATS:
+        return JSONResponse(
+            status_code=422, content={"error": f"encoding_format must be one of {', '.join(FORMATS)}"}
+        )
+
+    inp = body["input"]
+    texts = [inp] if isinstance(inp, str) else inp
+    # Upstream always returns floats (which is what gets cached); the
+    # requested encoding is applied here.
+    params = {k: v for k, v in body.items() if k not in ("input", "encoding_format")}
 
     try:
-        # verify=True ensures TLS cert validation if EMBED_URL uses HTTPS.
-        # Do not set verify=False — it would allow MITM attacks.
-        async with httpx.AsyncClient(timeout=60.0, verify=True) as client:
-            resp = await client.post(EMBEDDINGS_URL, json=body)
-            if resp.status_code != 200:
-                return JSONResponse(
-                    status_code=502,
-                    content={"error": "Embedding model returned an error"},
-                )
-            return resp.json()
+        vectors, served, payload = await embed_texts(params, texts)
+    except UpstreamStatusError:
+        return JSONResponse(
+            status_code=502,
+            content={"error": "Embedding model returned an error"},
+        )
     except httpx.ConnectError:
-        logger.error("Cannot connect to embedding server at %s", EMBEDDINGS_URL)
+        logger.error("Cannot connect to embedding server")
         return JSONResponse(status_code=502, content={"error": "Embedding model is unavailable"})
     except httpx.TimeoutException:
         logger.error("Timeout waiting for embedding server")
@@ -74,3 +145,168 @@ async def embed(request: Request):
     except Exception:
         logger.exception("Unexpected error proxying embed request")
         return JSONResponse(status_code=500, content={"error": "Internal AI service error"})
+
+    model = payload.get("model") or params.get("model", "")
+    usage = payload.get("usage", {"prompt_tokens": 0, "total_tokens": 0})
+    if OCTET_STREAM in request.headers.get("accept", ""):
+        return Response(
+            content=encode_matrix(vectors, fmt),
+            media_type=OCTET_STREAM,
+            headers={
+                "X-Embedding-Model": str(model),
+                "X-Prompt-Tokens": str(usage.get("prompt_tokens", 0)),
+                "X-Cached": str(served),
+            },
+        )
+    return FastJSONResponse({
+        "object": "list",
+        "data": encode_items(vectors, fmt),
+        "model": model,
+        "usage": usage,
+        "cached": served,
+    })
+
+
+def chunk_text(text: str, size: int, overlap: int) -> list[tuple[int, int]]:
+    """Split `text` into overlapping (start, end) spans of at most `size` chars.
+
+    Cuts are moved back to the last whitespace in the second half of a span
+    when there is one, so words are not split.
+    """
+    if len(text) <= size:
+        return [(0, len(text))]
+    spans = []
+    start = 0
+    while True:
+        end = min(start + size, len(text))
+        if end < len(text):
+            cut = max(text.rfind(" ", start + size // 2, end), text.rfind("\n", start + size // 2, end))
+            if cut > start:
+                end = cut
+        spans.append((start, end))
+        if end >= len(text):
+            return spans
+        start = max(end - overlap, start + 1)
+
+
+def _parse_bulk_line(line: bytes, line_no: int) -> tuple[object, str | None, str | None]:
+    """Return (id, text, error) for one /embed/bulk request line."""
+    try:
+        obj = loads(line)
+    except JSONDecodeError:
+        return line_no, None, "Invalid JSON line"
+    if not isinstance(obj, dict):
+        return line_no, None, "Line must be a JSON object"
+    doc_id = obj.get("id", line_no)
+    text = obj.get("text", obj.get("input"))
+    if not isinstance(text, str) or not text:
+        return doc_id, None, "text must be a non-empty string"
+    return doc_id, text, None
+
+
+def _bulk_error(exc: Exception) -> str:
+    if isinstance(exc, UpstreamStatusError):
+        return "Embedding model returned an error"
+    if isinstance(exc, httpx.ConnectError):
+        return "Embedding model is unavailable"
+    if isinstance(exc, httpx.TimeoutException):
+        return "Embedding model timed out"
+    logger.exception("Unexpected error in bulk embedding", exc_info=exc)
+    return "Internal AI service error"
+
+
+async def _bulk_results(request: Request, params: dict):
+    # Each queued item is (ndjson_bytes, holds_slot). A worker keeps its slot
+    # until its output has been handed to the client, so at most
+    # EMBED_BULK_CONCURRENCY groups are in flight or buffered at any time and
+    # reading the request body slows down when the client reads slowly.
+    results: asyncio.Queue[tuple[bytes, bool] | None] = asyncio.Queue()
+    slots = asyncio.Semaphore(EMBED_BULK_CONCURRENCY)
+    workers: set[asyncio.Task] = set()
+    counts = {"documents": 0, "chunks": 0, "errors": 0}
+
+    def emit(obj: dict, holds_slot: bool = False) -> None:
+        results.put_nowait((dumps(obj) + b"\n", holds_slot))
+
+    async def work(doc_id, text: str, spans: list[tuple[int, int]], first: int) -> None:
+        try:
+            vectors, _, _ = await embed_texts(params, [text[s:e] for s, e in spans])
+        except Exception as exc:
+            counts["errors"] += 1
+            emit({"id": doc_id, "chunk": first, "error": _bulk_error(exc)}, holds_slot=True)
+            return
+        counts["chunks"] += len(spans)
+        lines = [
+            dumps({"id": doc_id, "chunk": first + n, "start": s, "end": e, "embedding": vec})
+            for n, ((s, e), vec) in enumerate(zip(spans, vectors))
+        ]
+        results.put_nowait((b"\n".join(lines) + b"\n", True))
+
+    async def produce() -> None:
+        line_no = 0
+        try:
+            async for line in iter_lines(request, EMBED_BULK_MAX_LINE_BYTES):
+                line_no += 1
+                if isinstance(line, LineTooLong):
+                    counts["errors"] += 1
+                    emit({"id": line_no, "error": f"Line exceeds {EMBED_BULK_MAX_LINE_BYTES} bytes"})
+                    continue
+                doc_id, text, error = _parse_bulk_line(line, line_no)
+                if error:
+                    counts["errors"] += 1
+                    emit({"id": doc_id, "error": error})
+                    continue
+                counts["documents"] += 1
+                spans = chunk_text(text, EMBED_CHUNK_CHARS, EMBED_CHUNK_OVERLAP)
+                for first in range(0, len(spans), BULK_GROUP_CHUNKS):
+                    await slots.acquire()
+                    task = asyncio.create_task(
+                        work(doc_id, text, spans[first:first + BULK_GROUP_CHUNKS], first)
+                    )
+                    workers.add(task)
+                    task.add_done_callback(workers.discard)
+            if workers:
+                await asyncio.gather(*workers)
+            emit({"done": True, **counts})
+        except Exception:
+            logger.exception("Bulk embedding stream aborted")
+            emit({"error": "Bulk embedding aborted", **counts})
+        finally:
+            results.put_nowait(None)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while (item := await results.get()) is not None:
+            data, holds_slot = item
+            yield data
+            if holds_slot:
+                slots.release()
+    finally:
+        producer.cancel()
+        for task in list(workers):
+            task.cancel()
+
+
+@router.post("/embed/bulk")
+async def embed_bulk(request: Request):
+    """Embed a stream of NDJSON documents.
+
+    Each request line is {"id": ..., "text": "..."}. Texts longer than
+    EMBED_CHUNK_CHARS are split into overlapping chunks. Every chunk yields a
+    result line {"id", "chunk", "start", "end", "embedding"} as soon as it is
+    ready, so lines arrive in completion order. The last line is a summary
+    {"done": true, "documents", "chunks", "errors"}.
+    """
+    params = {}
+    if "model" in request.query_params:
+        params["model"] = request.query_params["model"]
+    return FullDuplexResponse(_bulk_results(request, params))
+
+
+@router.get("/embed/stats")
+def embed_stats():
+    return {
+        "cache": cache.stats(),
+        "batcher": batcher.stats(),
+        "backends": balancer.get_pool("embed").stats(),
+    }
@@ -0,0 +1,125 @@
+import logging
+
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse
+
+from codec import BodyError, read_json
+from config import (
+    CHAT_SESSION_BACKEND,
+    CHAT_SESSION_IDLE_TTL,
+    CHAT_SESSION_MAX,
+    CHAT_SESSION_MAX_BYTES,
+    CHAT_SESSION_PATH,
+    CHAT_SESSION_PIN_SLOT,
+    CHAT_SLOTS_PER_BACKEND,
+)
+from routers.chat import MAX_BODY_BYTES, MAX_MESSAGE_CHARS, MAX_MESSAGES, _subject, _validate_body, run_completion
+from sessions import build_store, reply_text
+
+logger = logging.getLogger("ai.sessions")
+
+router = APIRouter()
+
+# Parameters fixed per session at creation.
+SESSION_PARAMS = ("model", "temperature", "top_p", "max_tokens", "stop")
+
+store = build_store(
+    CHAT_SESSION_BACKEND,
+    CHAT_SESSION_PATH,
+    CHAT_SESSION_MAX,
+    CHAT_SESSION_MAX_BYTES,
+    CHAT_SESSION_IDLE_TTL,
+    slots=CHAT_SLOTS_PER_BACKEND if CHAT_SESSION_PIN_SLOT else 0,
+)
+
+
+async def _read_object(request: Request) -> tuple[dict | None, JSONResponse | None]:
+    try:
+        body = await read_json(request, MAX_BODY_BYTES)
+    except BodyError as exc:
+        return None, exc.response
+    if not isinstance(body, dict):
+        return None, JSONResponse(status_code=400, content={"error": "Body must be a JSON object"})
+    return body, None
+
+
+def _not_found() -> JSONResponse:
+    return JSONResponse(status_code=404, content={"error": "Session not found"})
+
+
+@router.post("")
+async def create_session(request: Request):
+    """Start a conversation: {"system"?, "model"?, "temperature"?, "top_p"?, "max_tokens"?, "stop"?}."""
+    body, err = await _read_object(request)
+    if err is not None:
+        return err
+    system = body.get("system")
+    if system is not None and (not isinstance(system, str) or len(system) > MAX_MESSAGE_CHARS):
+        return JSONResponse(
+            status_code=422, content={"error": f"system must be a string of at most {MAX_MESSAGE_CHARS} characters"}
+        )
+    params = {k: body[k] for k in SESSION_PARAMS if k in body}
+    _, error = _validate_body({**params, "messages": []})
+    if error:
+        return JSONResponse(status_code=422, content={"error": error})
+    session = store.create(_subject(request), params, system)
+    return session.info()
+
+
+@router.post("/{session_id}/messages")
+async def send_message(session_id: str, request: Request):
+    """Add a user turn and get the reply: {"content": "...", "stream"?: bool}.
+
+    The reply is a normal chat completion (or SSE stream); it is appended to
+    the session history once it has been delivered completely.
+    """
+    body, err = await _read_object(request)
+    if err is not None:
+        return err
+    session = store.get(session_id, _subject(request))
+    if session is None:
+        return _not_found()
+    content = body.get("content")
+    if not isinstance(content, str) or not content:
+        return JSONResponse(status_code=422, content={"error": "content must be a non-empty string"})
+    if not store.claim(session):
+        return JSONResponse(status_code=409, content={"error": "Session has a turn in progress"})
+    user_message = {"role": "user", "content": content}
+    stream = bool(body.get("stream", False))
+    cleaned, error = _validate_body({**session.params, "messages": session.messages + [user_message], "stream": stream})
+    if error:
+        store.finish(session, None, MAX_MESSAGES - 1)
+        return JSONResponse(status_code=422, content={"error": error})
+
+    # Let llama-server keep the session's prefix in its KV cache across turns.
+    cleaned["cache_prompt"] = True
+    if session.slot is not None:
+        cleaned["id_slot"] = session.slot
+
+    def on_finish(reply: bytes | None) -> None:
+        text = reply_text(reply, stream) if reply is not None else None
+        exchange = [user_message, {"role": "assistant", "content": text}] if text is not None else None
+        # Keep room for the next user message within MAX_MESSAGES.
+        store.finish(session, exchange, MAX_MESSAGES - 1)
+
+    return await run_completion(request, cleaned, affinity=session.affinity, on_finish=on_finish)
+
+
+@router.get("/{session_id}")
+async def get_session(session_id: str, request: Request):
+    session = store.get(session_id, _subject(request))
+    if session is None:
+        return _not_found()
+    return {**session.info(), "history": session.messages}
+
+
+@router.delete("/{session_id}")
+async def delete_session(session_id: str, request: Request):
+    if not store.delete(session_id, _subject(request)):
+        return _not_found()
+    return {"status": "deleted"}
+
+
+@router.get("")
+def session_stats():
+    return store.stats()
@@ -0,0 +1,191 @@
+import asyncio
+import logging
+
+import httpx
+import numpy as np
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse
+
+import vector_index
+from codec import BodyError, read_json
+from routers.embed import embed_texts
+from upstream import UpstreamStatusError
+
+logger = logging.getLogger("ai.vectors")
+
+router = APIRouter()
+
+MAX_BODY_BYTES = 32 * 1024 * 1024  # 32 MB
+MAX_ITEMS = 10_000  # vectors per add/delete request
+MAX_QUERIES = 256
+MAX_K = 1000
+
+
+async def _read_body(request: Request) -> tuple[dict | None, JSONResponse | None]:
+    try:
+        body = await read_json(request, MAX_BODY_BYTES)
+    except BodyError as exc:
+        return None, exc.response
+    if not isinstance(body, dict):
+        return None, JSONResponse(status_code=400, content={"error": "Body must be a JSON object"})
+    return body, None
+
+
+def _as_matrix(value, field: str) -> tuple[np.ndarray | None, str | None]:
+    if not isinstance(value, list) or not value:
+        return None, f"{field} must be a non-empty list of vectors"
+    try:
+        matrix = np.asarray(value, dtype=np.float32)
+    except (TypeError, ValueError):
+        return None, f"{field} must contain equal-length lists of numbers"
+    if matrix.ndim != 2 or not np.isfinite(matrix).all():
+        return None, f"{field} must contain equal-length lists of finite numbers"
+    return matrix, None
+
+
+async def _vectors_or_texts(body: dict, vec_field: str, text_field: str) -> tuple[np.ndarray | None, str | None]:
+    """Take vectors from `vec_field`, or embed the strings in `text_field`."""
+    if vec_field in body:
+        return _as_matrix(body[vec_field], vec_field)
+    texts = body.get(text_field)
+    if not isinstance(texts, list) or not texts or not all(isinstance(t, str) for t in texts):
+        return None, f"either {vec_field} or {text_field} (a list of strings) is required"
+    params = {"model": body["model"]} if "model" in body else {}
+    vectors, _, _ = await embed_texts(params, texts)
+    return _as_matrix(vectors, text_field)
+
+
+def _upstream_error(exc: Exception) -> JSONResponse:
+    if isinstance(exc, UpstreamStatusError):
+        return JSONResponse(status_code=502, content={"error": "Embedding model returned an error"})
+    if isinstance(exc, httpx.ConnectError):
+        return JSONResponse(status_code=502, content={"error": "Embedding model is unavailable"})
+    return JSONResponse(status_code=504, content={"error": "Embedding model timed out"})
+
+
+def _check_name(name: str) -> JSONResponse | None:
+    if not vector_index.NAME_RE.match(name):
+        return JSONResponse(status_code=422, content={"error": "Invalid collection name"})
+    return None
+
+
+def _not_found() -> JSONResponse:
+    return JSONResponse(status_code=404, content={"error": "Collection not found"})
+
+
+@router.post("/{name}/add")
+async def add(name: str, request: Request):
+    """Insert or overwrite items: {"ids", "vectors" | "texts", "metadata"?, "dtype"?}.
+
+    The collection is created on first add; "dtype" ("float32" or "int8")
+    only applies then.
+    """
+    if (err := _check_name(name)) is not None:
+        return err
+    body, err = await _read_body(request)
+    if err is not None:
+        return err
+
+    ids = body.get("ids")
+    if not isinstance(ids, list) or not ids or not all(isinstance(i, str) for i in ids):
+        return JSONResponse(status_code=422, content={"error": "ids must be a non-empty list of strings"})
+    if len(ids) > MAX_ITEMS:
+        return JSONResponse(status_code=422, content={"error": f"too many items (max {MAX_ITEMS})"})
+    metadata = body.get("metadata")
+    if metadata is not None and (not isinstance(metadata, list) or len(metadata) != len(ids)):
+        return JSONResponse(status_code=422, content={"error": "metadata must be a list matching ids"})
+    dtype = body.get("dtype", "float32")
+    if dtype not in vector_index.DTYPES:
+        return JSONResponse(status_code=422, content={"error": "dtype must be float32 or int8"})
+
+    try:
+        vectors, error = await _vectors_or_texts(body, "vectors", "texts")
+    except (UpstreamStatusError, httpx.ConnectError, httpx.TimeoutException) as exc:
+        return _upstream_error(exc)
+    if error:
+        return JSONResponse(status_code=422, content={"error": error})
+    if len(vectors) != len(ids):
+        return JSONResponse(status_code=422, content={"error": "ids and vectors must have the same length"})
+
+    coll = await asyncio.to_thread(vector_index.get_collection, name, vectors.shape[1], dtype)
+    try:
+        result = await asyncio.to_thread(coll.add, ids, vectors, metadata)
+    except ValueError as exc:
+        return JSONResponse(status_code=422, content={"error": str(exc)})
+    return {**result, "count": coll.count}
+
+
+@router.post("/{name}/delete")
+async def delete(name: str, request: Request):
+    if (err := _check_name(name)) is not None:
+        return err
+    body, err = await _read_body(request)
+    if err is not None:
+        return err
+    ids = body.get("ids")
+    if not isinstance(ids, list) or not all(isinstance(i, str) for i in ids):
+        return JSONResponse(status_code=422, content={"error": "ids must be a list of strings"})
+    if len(ids) > MAX_ITEMS:
+        return JSONResponse(status_code=422, content={"error": f"too many items (max {MAX_ITEMS})"})
+    coll = await asyncio.to_thread(vector_index.get_collection, name)
+    if coll is None:
+        return _not_found()
+    removed = await asyncio.to_thread(coll.delete, ids)
+    return {"deleted": removed, "count": coll.count}
+
+
+@router.post("/{name}/search")
+async def search(name: str, request: Request):
+    """Cosine top-k: {"vectors" | "queries", "k"?, "mode"?: "exact" | "approx", "nprobe"?}."""
+    if (err := _check_name(name)) is not None:
+        return err
+    body, err = await _read_body(request)
+    if err is not None:
+        return err
+    try:
+        k = int(body.get("k", 10))
+        nprobe = int(body.get("nprobe", vector_index.VECTOR_IVF_NPROBE))
+    except (TypeError, ValueError):
+        return JSONResponse(status_code=422, content={"error": "k and nprobe must be integers"})
+    if k < 1 or k > MAX_K:
+        return JSONResponse(status_code=422, content={"error": f"k must be between 1 and {MAX_K}"})
+    mode = body.get("mode", "exact")
+    if mode not in ("exact", "approx"):
+        return JSONResponse(status_code=422, content={"error": "mode must be exact or approx"})
+
+    coll = await asyncio.to_thread(vector_index.get_collection, name)
+    if coll is None:
+        return _not_found()
+    try:
+        queries, error = await _vectors_or_texts(body, "vectors", "queries")
+    except (UpstreamStatusError, httpx.ConnectError, httpx.TimeoutException) as exc:
+        return _upstream_error(exc)
+    if error:
+        return JSONResponse(status_code=422, content={"error": error})
+    if len(queries) > MAX_QUERIES:
+        return JSONResponse(status_code=422, content={"error": f"too many queries (max {MAX_QUERIES})"})
+
+    try:
+        results = await asyncio.to_thread(coll.search, queries, k, mode == "approx", nprobe)
+    except ValueError as exc:
+        return JSONResponse(status_code=422, content={"error": str(exc)})
+    return {"results": results}
+
+
+@router.get("/{name}")
+async def info(name: str):
+    if (err := _check_name(name)) is not None:
+        return err
+    coll = await asyncio.to_thread(vector_index.get_collection, name)
+    if coll is None:
+        return _not_found()
+    return coll.stats()
+
+
+@router.delete("/{name}")
+async def drop(name: str):
+    if (err := _check_name(name)) is not None:
+        return err
+    if not await asyncio.to_thread(vector_index.drop_collection, name):
+        return _not_found()
+    return {"status": "dropped"}
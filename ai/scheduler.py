@@ -0,0 +1,198 @@
+"""Admission control and fair-share scheduling for chat requests.
+
+At most CHAT_SLOTS_PER_BACKEND requests run on each chat backend at once,
+matching llama-server's parallel slots. Requests beyond that wait in a bounded
+queue instead of piling up inside llama-server; when the queue is full they
+are rejected at once with QueueFull (HTTP 429 + Retry-After).
+
+Waiting requests are served by priority first (PRIORITY_INTERACTIVE before
+PRIORITY_BATCH). Within a priority, subjects (JWT `sub`) take turns: each
+subject has its own FIFO and a freed slot goes to the next subject in
+rotation, so one client with many queued requests cannot starve the others.
+
+Usage:
+    async with scheduler.slot(subject, priority, affinity) as backend:
+        ...  # backend is reserved in the BackendPool for this block
+"""
+
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+import httpx
+
+from balancer import Backend, BackendPool
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+
+
+class QueueFull(Exception):
+    """The waiting queue is full (or the wait timed out)."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"queue full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ("subject", "affinity", "future", "enqueued_at")
+
+    def __init__(self, subject: str, affinity: str | None, future: asyncio.Future):
+        self.subject = subject
+        self.affinity = affinity
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+
+class FairScheduler:
+    def __init__(self, pool: BackendPool, slots_per_backend: int, max_queue: int, queue_timeout: float):
+        self.pool = pool
+        self.slots = slots_per_backend
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        # priority -> subject -> FIFO of waiters; dict order is the rotation.
+        self._queues: dict[int, OrderedDict[str, deque[_Waiter]]] = {}
+        self._waiting = 0
+        self._in_flight = 0
+        # Stats
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._service_ewma = 0.0  # seconds a slot is held, smoothed
+
+    @property
+    def capacity(self) -> int:
+        return self.slots * len(self.pool.backends)
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def queue_depth(self) -> int:
+        return self._waiting
+
+    @asynccontextmanager
+    async def slot(self, subject: str, priority: int = PRIORITY_INTERACTIVE, affinity: str | None = None):
+        backend = await self._admit(subject, priority, affinity)
+        started = time.monotonic()
+        try:
+            yield backend
+        except httpx.ConnectError:
+            self.pool.report_connect_error(backend)
+            raise
+        finally:
+            held = time.monotonic() - started
+            if self._service_ewma:
+                self._service_ewma += 0.1 * (held - self._service_ewma)
+            else:
+                self._service_ewma = held
+            self._release(backend)
+
+    async def _admit(self, subject: str, priority: int, affinity: str | None) -> Backend:
+        if self._waiting == 0:
+            backend = self.pool.pick(affinity, limit=self.slots)
+            if backend is not None:
+                self._grant(backend)
+                self._record_wait(0.0)
+                return backend
+
+        if self._waiting >= self.max_queue:
+            self.rejected += 1
+            raise QueueFull(self._retry_after())
+
+        waiter = _Waiter(subject, affinity, asyncio.get_running_loop().create_future())
+        self._queues.setdefault(priority, OrderedDict()).setdefault(subject, deque()).append(waiter)
+        self._waiting += 1
+        self.queued += 1
+        try:
+            backend = await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout)
+        except BaseException as exc:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Granted just as we gave up: hand the slot back.
+                self._release(waiter.future.result())
+            else:
+                waiter.future.cancel()
+                self._remove(priority, waiter)
+            if isinstance(exc, asyncio.TimeoutError):
+                self.timed_out += 1
+                raise QueueFull(self._retry_after()) from None
+            raise
+        self._record_wait(time.monotonic() - waiter.enqueued_at)
+        return backend
+
+    def _grant(self, backend: Backend) -> None:
+        self.pool.reserve(backend)
+        self._in_flight += 1
+        self.admitted += 1
+
+    def _release(self, backend: Backend) -> None:
+        self.pool.release(backend)
+        self._in_flight -= 1
+        self._dispatch()
+
+    def _remove(self, priority: int, waiter: _Waiter) -> None:
+        subjects = self._queues.get(priority)
+        fifo = subjects.get(waiter.subject) if subjects else None
+        if fifo is None:
+            return
+        try:
+            fifo.remove(waiter)
+        except ValueError:
+            return
+        self._waiting -= 1
+        if not fifo:
+            del subjects[waiter.subject]
+
+    def _dispatch(self) -> None:
+        """Hand freed slots to waiters: best priority, then next subject in turn."""
+        while self._waiting:
+            priority = min(p for p, subjects in self._queues.items() if subjects)
+            subjects = self._queues[priority]
+            subject, fifo = next(iter(subjects.items()))
+            waiter = fifo[0]
+            backend = self.pool.pick(waiter.affinity, limit=self.slots)
+            if backend is None:
+                return
+            fifo.popleft()
+            self._waiting -= 1
+            if fifo:
+                subjects.move_to_end(subject)
+            else:
+                del subjects[subject]
+            self._grant(backend)
+            waiter.future.set_result(backend)
+
+    def _record_wait(self, waited: float) -> None:
+        self._wait_total += waited
+        self._wait_max = max(self._wait_max, waited)
+
+    def _retry_after(self) -> int:
+        """Rough seconds until a newly queued request would get a slot."""
+        estimate = (self._waiting + 1) * (self._service_ewma or 1.0) / max(1, self.capacity)
+        return max(1, math.ceil(estimate))
+
+    def stats(self) -> dict:
+        return {
+            "capacity": self.capacity,
+            "in_flight": self._in_flight,
+            "queue_depth": self._waiting,
+            "queue_max": self.max_queue,
+            "queue_by_priority": {
+                str(p): sum(len(f) for f in subjects.values()) for p, subjects in sorted(self._queues.items())
+            },
+            "waiting_subjects": sum(len(subjects) for subjects in self._queues.values()),
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "avg_wait_ms": round(self._wait_total / self.admitted * 1000, 3) if self.admitted else 0.0,
+            "max_wait_ms": round(self._wait_max * 1000, 3),
+            "avg_service_ms": round(self._service_ewma * 1000, 3),
+        }
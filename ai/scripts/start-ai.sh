@@ -18,10 +18,19 @@ export LD_LIBRARY_PATH="${LLAMA_BIN}:${LD_LIBRARY_PATH:-}"
 CHAT_MODEL="${CHAT_MODEL:-${MODEL_DIR}/qwen3/Qwen3-8B-Q4_K_M.gguf}"
 EMBED_MODEL="${EMBED_MODEL:-${MODEL_DIR}/qwen3/Qwen3-Embedding-8B-Q4_K_M.gguf}"
 GPU_LAYERS="${N_GPU_LAYERS:-99}"
+# Parallel slots per chat server; the FastAPI scheduler admits this many per backend.
+CHAT_SLOTS="${CHAT_SLOTS_PER_BACKEND:-4}"
+# FastAPI worker processes (SERVE_WORKERS); 1 keeps everything in one process.
+API_WORKERS="${SERVE_WORKERS:-1}"
 
 # Cleanup child processes on exit
 cleanup() {
     echo "[AI] Shutting down..."
+    # Stop the API first so open streams can drain while the llama-servers still run.
+    if [ -n "${API_PID:-}" ]; then
+        kill -TERM "$API_PID" 2>/dev/null || true
+        wait "$API_PID" 2>/dev/null || true
+    fi
     kill 0 2>/dev/null || true
     rm -f "$RUN_DIR"/llama-*.pid
     wait 2>/dev/null || true
@@ -34,6 +43,7 @@ echo "[AI] Starting chat llama-server on port 8081..."
     --port 8081 \
     --host 127.0.0.1 \
     --n-gpu-layers "$GPU_LAYERS" \
+    --parallel "$CHAT_SLOTS" \
     &
 CHAT_PID=$!
 echo "$CHAT_PID" > "$RUN_DIR/llama-chat.pid"
@@ -52,9 +62,10 @@ echo "$EMBED_PID" > "$RUN_DIR/llama-embed.pid"
 echo "[AI] Waiting for llama-servers to initialize..."
 sleep 5
 
-echo "[AI] Starting FastAPI wrapper on port 8090..."
+echo "[AI] Starting FastAPI wrapper on port 8090 ($API_WORKERS workers)..."
 cd "$AI_DIR"
-uvicorn main:app --host 127.0.0.1 --port 8090 &
+# SIGHUP to this PID restarts the workers one generation at a time (see shared/serve.py).
+python -m shared.serve main:app --host 127.0.0.1 --port 8090 --workers "$API_WORKERS" --preload config &
 API_PID=$!
 echo "$API_PID" > "$RUN_DIR/llama-fastapi.pid"
 
@@ -5,16 +5,25 @@ RUN_DIR="/run/user/$(id -u)/research-ai"
 
 echo "[AI] Stopping AI services..."
 
-for pidfile in "$RUN_DIR"/llama-chat.pid "$RUN_DIR"/llama-embed.pid "$RUN_DIR"/llama-fastapi.pid; do
+# The API goes first and is waited for, so open streams drain while the
+# llama-servers are still up.
+for pidfile in "$RUN_DIR"/llama-fastapi.pid "$RUN_DIR"/llama-chat.pid "$RUN_DIR"/llama-embed.pid; do
     if [ -f "$pidfile" ]; then
         pid=$(cat "$pidfile")
         name=$(basename "$pidfile" .pid)
         # Verify the PID belongs to our process before killing
         if kill -0 "$pid" 2>/dev/null; then
             cmdline=$(cat "/proc/$pid/cmdline" 2>/dev/null | tr '\0' ' ' || true)
-            if echo "$cmdline" | grep -qE 'llama-server|uvicorn'; then
+            if echo "$cmdline" | grep -qE 'llama-server|uvicorn|shared\.serve'; then
                 echo "  Stopping $name (PID $pid)"
                 kill "$pid" 2>/dev/null || true
+                if [ "$name" = "llama-fastapi" ]; then
+                    # SERVE_DRAIN_TIMEOUT plus the 5 s before workers are killed
+                    for _ in $(seq $(( ${SERVE_DRAIN_TIMEOUT:-30} + 5 ))); do
+                        kill -0 "$pid" 2>/dev/null || break
+                        sleep 1
+                    done
+                fi
             else
                 echo "  Skipping $name — PID $pid belongs to another process"
             fi
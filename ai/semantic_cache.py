@@ -0,0 +1,141 @@
+"""Semantic (near-duplicate) cache for chat answers.
+
+Questions asked in slightly different words get the stored answer of an
+earlier question when their embeddings are close enough. Each entry holds:
+
+- the unit-normalised embedding of the last user turn, as a row of one
+  float32 matrix, so a lookup is a single matrix-vector product;
+- a context key: a hash of everything else that shapes the answer (system
+  prompt, earlier turns, model and sampling parameters). Only entries with
+  the same context key can match;
+- the raw response body, an expiry time and a last-used time.
+
+When the matrix is full, expired rows are reused first, then the least
+recently used one. The matrix starts small and doubles up to `capacity`.
+"""
+
+import hashlib
+import json
+import time
+
+import numpy as np
+
+# Parameters that change the answer besides the messages.
+_CONTEXT_PARAMS = ("model", "temperature", "top_p", "max_tokens", "stop")
+_INITIAL_ROWS = 256
+
+
+def split_prompt(body: dict) -> tuple[str, int] | None:
+    """(last user turn, context key) for a request, or None if it does not end with a user turn."""
+    messages = body.get("messages") or []
+    if not messages or messages[-1].get("role") != "user" or not isinstance(messages[-1].get("content"), str):
+        return None
+    context = {
+        "messages": messages[:-1],
+        "params": {k: body.get(k) for k in _CONTEXT_PARAMS},
+    }
+    canonical = json.dumps(context, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    digest = hashlib.blake2b(canonical.encode(), digest_size=8).digest()
+    return messages[-1]["content"], int.from_bytes(digest, "little", signed=True)
+
+
+class SemanticCache:
+    def __init__(self, threshold: float, ttl: float, capacity: int):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.capacity = capacity
+        self._matrix: np.ndarray | None = None  # rows x dim, unit-norm float32
+        self._contexts = np.zeros(0, dtype=np.int64)
+        self._expires = np.zeros(0, dtype=np.float64)  # 0 = empty slot
+        self._last_used = np.zeros(0, dtype=np.float64)
+        self._values: list[bytes | None] = []
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.capacity > 0
+
+    @staticmethod
+    def _normalise(vector) -> np.ndarray | None:
+        q = np.asarray(vector, dtype=np.float32)
+        norm = float(np.linalg.norm(q))
+        return q / norm if norm > 0 else None
+
+    def lookup(self, vector, context: int) -> tuple[bytes, float] | None:
+        """Best stored answer with similarity >= threshold: (body, similarity)."""
+        q = self._normalise(vector)
+        if self._matrix is None or q is None or q.shape[0] != self._matrix.shape[1]:
+            self.misses += 1
+            return None
+        now = time.monotonic()
+        eligible = (self._contexts == context) & (self._expires > now)
+        if not eligible.any():
+            self.misses += 1
+            return None
+        scores = np.where(eligible, self._matrix @ q, -np.inf)
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._last_used[best] = now
+        return self._values[best], float(scores[best])
+
+    def store(self, vector, context: int, value: bytes) -> None:
+        q = self._normalise(vector)
+        if q is None:
+            return
+        if self._matrix is None or q.shape[0] != self._matrix.shape[1]:
+            self._reset(q.shape[0])
+        now = time.monotonic()
+        row = self._free_row(now)
+        self._matrix[row] = q
+        self._contexts[row] = context
+        self._expires[row] = now + self.ttl
+        self._last_used[row] = now
+        self._values[row] = value
+        self.stores += 1
+
+    def _reset(self, dim: int) -> None:
+        rows = min(_INITIAL_ROWS, self.capacity)
+        self._matrix = np.zeros((rows, dim), dtype=np.float32)
+        self._contexts = np.zeros(rows, dtype=np.int64)
+        self._expires = np.zeros(rows, dtype=np.float64)
+        self._last_used = np.zeros(rows, dtype=np.float64)
+        self._values = [None] * rows
+
+    def _free_row(self, now: float) -> int:
+        free = np.flatnonzero(self._expires <= now)
+        if free.size:
+            if self._expires[free[0]] > 0:
+                self.evictions += 1
+            return int(free[0])
+        rows = self._matrix.shape[0]
+        if rows < self.capacity:
+            grow = min(rows * 2, self.capacity)
+            self._matrix = np.concatenate([self._matrix, np.zeros((grow - rows, self._matrix.shape[1]), np.float32)])
+            self._contexts = np.concatenate([self._contexts, np.zeros(grow - rows, np.int64)])
+            self._expires = np.concatenate([self._expires, np.zeros(grow - rows)])
+            self._last_used = np.concatenate([self._last_used, np.zeros(grow - rows)])
+            self._values.extend([None] * (grow - rows))
+            return rows
+        self.evictions += 1
+        return int(np.argmin(self._last_used))
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "threshold": self.threshold,
+            "entries": int((self._expires > now).sum()),
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "stores": self.stores,
+            "evictions": self.evictions,
+        }
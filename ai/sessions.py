@@ -0,0 +1,315 @@
+"""Server-side chat sessions.
+
+A session keeps the message history of one conversation so clients send only
+the new user message on each turn. Sessions are bounded by count and by the
+total size of their messages; the least recently used session is evicted
+first, and sessions idle for longer than the TTL expire.
+
+Stores:
+    SessionStore        per process, OrderedDict LRU
+    SQLiteSessionStore  shared by all worker processes using the same file;
+                        recency is the time of the last turn
+
+A turn claims its session first (claim() fails while another turn, in any
+process, is running) and ends with finish(), which records the exchange.
+
+Each session has a fixed affinity key so all its turns land on the same chat
+backend, whose KV cache then still holds the shared prefix (requests are
+sent with cache_prompt). Optionally a session is also pinned to one
+llama-server slot (id_slot).
+"""
+
+import hashlib
+import logging
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from codec import JSONDecodeError, dumps, loads
+
+logger = logging.getLogger("ai.sessions")
+
+# A claim older than this is from a turn whose process died; it is ignored.
+_STALE_CLAIM = 900  # seconds
+
+
+class Session:
+    __slots__ = ("id", "subject", "params", "messages", "slot", "busy", "created", "last_used", "size", "turns")
+
+    def __init__(self, subject: str, params: dict, system: str | None, slot: int | None):
+        self.id = secrets.token_urlsafe(16)
+        self.subject = subject
+        self.params = params
+        self.messages: list[dict] = [{"role": "system", "content": system}] if system else []
+        self.slot = slot
+        self.busy = False
+        self.created = self.last_used = time.time()
+        self.size = len(system or "")
+        self.turns = 0
+
+    @classmethod
+    def from_row(cls, row: tuple) -> "Session":
+        session = cls.__new__(cls)
+        (session.id, session.subject, params, messages, session.slot, busy,
+         session.created, session.last_used, session.size, session.turns) = row
+        session.params = loads(params)
+        session.messages = loads(messages)
+        session.busy = bool(busy)
+        return session
+
+    @property
+    def affinity(self) -> str:
+        return f"session:{self.id}"
+
+    def trim(self, max_messages: int) -> int:
+        """Drop the oldest non-system messages beyond `max_messages`; returns bytes freed."""
+        freed = 0
+        while len(self.messages) > max_messages:
+            index = next((i for i, m in enumerate(self.messages) if m["role"] != "system"), None)
+            if index is None:
+                break
+            freed += len(self.messages.pop(index)["content"])
+        self.size -= freed
+        return freed
+
+    def info(self) -> dict:
+        return {
+            "session_id": self.id,
+            "params": self.params,
+            "messages": len(self.messages),
+            "turns": self.turns,
+            "slot": self.slot,
+            "created": self.created,
+            "last_used": self.last_used,
+        }
+
+
+class SessionStore:
+    def __init__(self, max_sessions: int, max_bytes: int, idle_ttl: float, slots: int = 0):
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self.slots = slots  # > 0 pins each session to one of this many slots
+        self._sessions: OrderedDict[str, Session] = OrderedDict()
+        self._bytes = 0
+        self.created = 0
+        self.evicted = 0
+        self.expired = 0
+
+    def _new(self, subject: str, params: dict, system: str | None) -> Session:
+        session = Session(subject, params, system, None)
+        if self.slots > 0:
+            digest = hashlib.blake2b(session.id.encode(), digest_size=4).digest()
+            session.slot = int.from_bytes(digest, "big") % self.slots
+        self.created += 1
+        return session
+
+    def create(self, subject: str, params: dict, system: str | None) -> Session:
+        session = self._new(subject, params, system)
+        self._sessions[session.id] = session
+        self._bytes += session.size
+        self._evict()
+        return session
+
+    def get(self, session_id: str, subject: str) -> Session | None:
+        """The session, if it exists, has not expired and belongs to `subject`."""
+        session = self._sessions.get(session_id)
+        if session is None or session.subject != subject:
+            return None
+        if time.time() - session.last_used > self.idle_ttl and not session.busy:
+            self._remove(session)
+            self.expired += 1
+            return None
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def delete(self, session_id: str, subject: str) -> bool:
+        session = self.get(session_id, subject)
+        if session is None:
+            return False
+        self._remove(session)
+        return True
+
+    def claim(self, session: Session) -> bool:
+        """Mark a turn as running; False if one already is."""
+        if session.busy:
+            return False
+        session.busy = True
+        return True
+
+    def finish(self, session: Session, messages: list[dict] | None, max_messages: int) -> None:
+        """End the turn, appending `messages` (None if the turn failed) to the history."""
+        session.busy = False
+        if messages is None or session.id not in self._sessions:
+            return  # failed, or evicted while the turn was running
+        session.messages.extend(messages)
+        added = sum(len(m["content"]) for m in messages)
+        session.size += added
+        self._bytes += added - session.trim(max_messages)
+        session.last_used = time.time()
+        session.turns += 1
+        self._evict()
+
+    def _remove(self, session: Session) -> None:
+        if self._sessions.pop(session.id, None) is not None:
+            self._bytes -= session.size
+
+    def _evict(self) -> None:
+        while len(self._sessions) > self.max_sessions or (self._bytes > self.max_bytes and len(self._sessions) > 1):
+            _, session = next(iter(self._sessions.items()))
+            self._remove(session)
+            self.evicted += 1
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self._sessions),
+            "bytes": self._bytes,
+            "max_sessions": self.max_sessions,
+            "max_bytes": self.max_bytes,
+            "created": self.created,
+            "evicted": self.evicted,
+            "expired": self.expired,
+        }
+
+
+class SQLiteSessionStore(SessionStore):
+    """Sessions in a SQLite file shared by worker processes (put it on tmpfs).
+
+    get() returns a snapshot; claim() refreshes it, so a turn always builds on
+    the latest history even if the previous turn ran in another process.
+    """
+
+    _COLUMNS = "id, subject, params, messages, slot, busy, created, last_used, size, turns"
+
+    def __init__(self, path: str, max_sessions: int, max_bytes: int, idle_ttl: float, slots: int = 0):
+        super().__init__(max_sessions, max_bytes, idle_ttl, slots)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=OFF")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " id TEXT PRIMARY KEY, subject TEXT NOT NULL, params BLOB NOT NULL, messages BLOB NOT NULL,"
+            " slot INTEGER, busy REAL NOT NULL, created REAL NOT NULL, last_used REAL NOT NULL,"
+            " size INTEGER NOT NULL, turns INTEGER NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS sessions_last_used ON sessions (last_used)")
+
+    def _select(self, session_id: str) -> Session | None:
+        row = self._db.execute(f"SELECT {self._COLUMNS} FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        return Session.from_row(row) if row is not None else None
+
+    def create(self, subject: str, params: dict, system: str | None) -> Session:
+        session = self._new(subject, params, system)
+        with self._lock:
+            self._db.execute(
+                f"INSERT INTO sessions ({self._COLUMNS}) VALUES (?, ?, ?, ?, ?, 0, ?, ?, ?, 0)",
+                (session.id, subject, dumps(params), dumps(session.messages), session.slot,
+                 session.created, session.last_used, session.size),
+            )
+            self._evict()
+        return session
+
+    def get(self, session_id: str, subject: str) -> Session | None:
+        with self._lock:
+            session = self._select(session_id)
+            if session is None or session.subject != subject:
+                return None
+            if time.time() - session.last_used > self.idle_ttl and not session.busy:
+                self._db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+                self.expired += 1
+                return None
+        return session
+
+    def _remove(self, session: Session) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM sessions WHERE id = ?", (session.id,))
+
+    def claim(self, session: Session) -> bool:
+        now = time.time()
+        with self._lock:
+            claimed = self._db.execute(
+                "UPDATE sessions SET busy = ? WHERE id = ? AND busy < ?", (now, session.id, now - _STALE_CLAIM)
+            ).rowcount
+            fresh = self._select(session.id) if claimed else None
+        if fresh is None:
+            return False
+        session.messages, session.size, session.turns = fresh.messages, fresh.size, fresh.turns
+        session.busy = True
+        return True
+
+    def finish(self, session: Session, messages: list[dict] | None, max_messages: int) -> None:
+        session.busy = False
+        with self._lock:
+            if messages is None:
+                self._db.execute("UPDATE sessions SET busy = 0 WHERE id = ?", (session.id,))
+                return
+            session.messages.extend(messages)
+            session.size += sum(len(m["content"]) for m in messages)
+            session.trim(max_messages)
+            session.last_used = time.time()
+            session.turns += 1
+            self._db.execute(
+                "UPDATE sessions SET messages = ?, size = ?, turns = ?, last_used = ?, busy = 0 WHERE id = ?",
+                (dumps(session.messages), session.size, session.turns, session.last_used, session.id),
+            )
+            self._evict()
+
+    def _evict(self) -> None:
+        db = self._db
+        self.expired += db.execute(
+            "DELETE FROM sessions WHERE last_used < ? AND busy = 0", (time.time() - self.idle_ttl,)
+        ).rowcount
+        excess = db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0] - self.max_sessions
+        if excess > 0:
+            self.evicted += db.execute(
+                "DELETE FROM sessions WHERE id IN (SELECT id FROM sessions ORDER BY last_used LIMIT ?)", (excess,)
+            ).rowcount
+        # Oldest sessions beyond the byte budget, always keeping the newest one.
+        self.evicted += db.execute(
+            "DELETE FROM sessions WHERE id IN (SELECT id FROM ("
+            " SELECT id, SUM(size) OVER (ORDER BY last_used DESC, id) AS total,"
+            " ROW_NUMBER() OVER (ORDER BY last_used DESC, id) AS n FROM sessions"
+            ") WHERE total > ? AND n > 1)",
+            (self.max_bytes,),
+        ).rowcount
+
+    def stats(self) -> dict:
+        with self._lock:
+            count, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM sessions").fetchone()
+        # created/evicted/expired count this process's share only.
+        return {**super().stats(), "sessions": count, "bytes": size}
+
+
+def build_store(kind: str, path: str, max_sessions: int, max_bytes: int, idle_ttl: float, slots: int = 0):
+    if kind == "sqlite":
+        try:
+            return SQLiteSessionStore(path, max_sessions, max_bytes, idle_ttl, slots)
+        except sqlite3.Error:
+            logger.exception("Cannot open session database %s; falling back to memory", path)
+    elif kind != "memory":
+        logger.warning("Unknown session backend %r; using memory", kind)
+    return SessionStore(max_sessions, max_bytes, idle_ttl, slots)
+
+
+def reply_text(body: bytes, streamed: bool) -> str | None:
+    """Assistant text from a chat completion body (JSON, or the raw SSE stream)."""
+    try:
+        if not streamed:
+            return loads(body)["choices"][0]["message"]["content"]
+        parts = []
+        for line in body.splitlines():
+            if not line.startswith(b"data:"):
+                continue
+            data = line[5:].strip()
+            if data == b"[DONE]":
+                break
+            choices = loads(data).get("choices") or []
+            content = choices[0].get("delta", {}).get("content") if choices else None
+            if content:
+                parts.append(content)
+        return "".join(parts)
+    except (JSONDecodeError, KeyError, IndexError, TypeError, AttributeError):
+        return None
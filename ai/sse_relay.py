@@ -0,0 +1,246 @@
+"""Byte-for-byte relay of an upstream server-sent-events stream.
+
+The upstream response is opened by the route handler (so connection errors
+still map to 502/504 there) and handed to SSERelayResponse, which forwards the
+raw body chunks as they arrive without decoding or re-framing them. Each
+`send` waits for the ASGI server to accept the chunk, so a slow client slows
+down reading from llama-server instead of piling data up in memory.
+
+While relaying, the response also watches for `http.disconnect`. When the
+client goes away the upstream response is closed at once, which drops the
+connection to llama-server and makes it stop generating.
+
+With `coalesce=(interval, max_bytes)` the relay batches events instead:
+chunks are sent at once up to and including the first one that carries
+text (llama-server opens with a role-only delta, and the first token must
+not wait for a flush), later ones are collected and written
+together once `interval` seconds have passed since the first buffered chunk
+or the buffer reaches `max_bytes`. Chunks are concatenated unchanged, so the
+client still receives the exact SSE byte stream, in fewer writes (and fewer
+frames through the ASGI server and reverse proxy).
+
+Per stream it records time to first token and generation speed for /metrics.
+Tokens are counted as SSE `data:` events (one per token with llama-server),
+found with bytes.count so the relay still never decodes the body.
+"""
+
+import logging
+import re
+import time
+from collections.abc import Awaitable, Callable
+
+import anyio
+import anyio.abc
+import httpx
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+from shared import metrics
+
+logger = logging.getLogger("ai.sse_relay")
+
+# A delta with a non-empty "content" (or "reasoning_content") string.
+_CONTENT_RE = re.compile(rb'content"\s*:\s*"(?!")')
+
+
+class RelayStats:
+    """Aggregate counters over all relayed streams."""
+
+    def __init__(self):
+        self.active = 0
+        self.completed = 0
+        self.client_disconnects = 0
+        self.upstream_errors = 0
+        self.bytes = 0
+        self.ttfb_total = 0.0
+        self.ttfb_count = 0
+
+    def snapshot(self) -> dict:
+        return {
+            "active": self.active,
+            "completed": self.completed,
+            "client_disconnects": self.client_disconnects,
+            "upstream_errors": self.upstream_errors,
+            "bytes": self.bytes,
+            "avg_ttfb_ms": round(self.ttfb_total / self.ttfb_count * 1000, 3) if self.ttfb_count else 0.0,
+        }
+
+
+stats = RelayStats()
+
+TTFT = metrics.histogram(
+    "ai_chat_time_to_first_token_seconds",
+    "Time from sending a chat request to the first streamed token",
+    ["backend"],
+)
+TOKENS_PER_SECOND = metrics.histogram(
+    "ai_chat_stream_tokens_per_second",
+    "Streamed tokens per second after the first token",
+    ["backend"],
+    buckets=(1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 500, 1000),
+)
+metrics.gauge("ai_chat_streams_active", "Chat streams being relayed").set_function(lambda: stats.active)
+
+
+class SSERelayResponse(Response):
+    media_type = "text/event-stream"
+
+    def __init__(
+        self,
+        upstream: httpx.Response,
+        close: Callable[[], Awaitable[None]],
+        started: float,
+        label: str = "",
+        coalesce: tuple[float, int] | None = None,
+        on_finish: Callable[[bytes | None], None] | None = None,
+    ):
+        """`close` releases the upstream response (and anything tied to it);
+        `started` is the time.perf_counter() at which the request was sent;
+        `coalesce` is (interval seconds, max bytes) or None to relay as-is;
+        `on_finish` receives the whole relayed body after a complete stream,
+        or None if the client disconnected or upstream broke off."""
+        self.upstream = upstream
+        self.close = close
+        self.started = started
+        self.label = label
+        self.coalesce = coalesce
+        self.on_finish = on_finish
+        self.status_code = 200
+        self.background = None
+        self.init_headers({"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        stats.active += 1
+        sent = 0
+        events = 0
+        done_marker = False
+        first_byte: float | None = None
+        disconnected = False
+        failed = False
+        completed = False
+        kept: list[bytes] | None = [] if self.on_finish is not None else None
+        try:
+            async with anyio.create_task_group() as tg:
+
+                async def watch_disconnect() -> None:
+                    nonlocal disconnected
+                    while True:
+                        message = await receive()
+                        if message["type"] == "http.disconnect":
+                            # After the final send the server reports a
+                            # disconnect for every finished response.
+                            disconnected = not completed
+                            tg.cancel_scope.cancel()
+                            return
+
+                tg.start_soon(watch_disconnect)
+
+                await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+
+                async def forward(chunk: bytes) -> None:
+                    nonlocal first_byte, sent, events, done_marker
+                    if first_byte is None:
+                        first_byte = time.perf_counter()
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                    sent += len(chunk)
+                    events += chunk.count(b"data:")
+                    done_marker = b"[DONE]" in chunk
+                    if kept is not None:
+                        kept.append(chunk)
+
+                try:
+                    if self.coalesce is None:
+                        # aiter_bytes only undoes a Content-Encoding; identity bodies pass through as-is.
+                        async for chunk in self.upstream.aiter_bytes():
+                            await forward(chunk)
+                    else:
+                        await self._relay_coalesced(tg, forward)
+                except httpx.HTTPError as exc:
+                    failed = True
+                    stats.upstream_errors += 1
+                    logger.warning("Upstream stream from %s broke off: %s", self.label, type(exc).__name__)
+                completed = True
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+                tg.cancel_scope.cancel()
+        except OSError:
+            disconnected = True  # send failed: the client is gone
+        finally:
+            with anyio.CancelScope(shield=True):
+                await self.close()
+            if self.on_finish is not None:
+                ok = completed and not disconnected and not failed
+                self.on_finish(b"".join(kept) if ok else None)
+            stats.active -= 1
+            stats.bytes += sent
+            if disconnected:
+                stats.client_disconnects += 1
+            else:
+                stats.completed += 1
+            elapsed = time.perf_counter() - self.started
+            ttfb = None if first_byte is None else first_byte - self.started
+            if ttfb is not None:
+                stats.ttfb_total += ttfb
+                stats.ttfb_count += 1
+                TTFT.labels(self.label).observe(ttfb)
+                tokens = events - done_marker
+                generating = time.perf_counter() - first_byte
+                if tokens > 1 and generating > 0:
+                    TOKENS_PER_SECOND.labels(self.label).observe((tokens - 1) / generating)
+            logger.info(
+                "Stream from %s %s: ttfb=%s bytes=%d rate=%.0fB/s",
+                self.label,
+                "cancelled by client" if disconnected else "finished",
+                "-" if ttfb is None else f"{ttfb * 1000:.1f}ms",
+                sent,
+                sent / elapsed if elapsed > 0 else 0.0,
+            )
+
+    async def _relay_coalesced(
+        self, tg: anyio.abc.TaskGroup, forward: Callable[[bytes], Awaitable[None]]
+    ) -> None:
+        interval, max_bytes = self.coalesce
+        # A separate task reads upstream so that waiting for the flush deadline
+        # never cancels an in-progress read on the httpx stream.
+        tx, rx = anyio.create_memory_object_stream[bytes](64)
+        failure: list[httpx.HTTPError] = []
+
+        async def pump() -> None:
+            async with tx:
+                try:
+                    async for chunk in self.upstream.aiter_bytes():
+                        await tx.send(chunk)
+                except httpx.HTTPError as exc:
+                    failure.append(exc)
+
+        tg.start_soon(pump)
+        buffer = bytearray()
+        flush_at = 0.0
+        first = True  # until the first chunk with text has been sent
+        async with rx:
+            while True:
+                try:
+                    if buffer:
+                        with anyio.fail_after(max(flush_at - time.monotonic(), 0)):
+                            chunk = await rx.receive()
+                    else:
+                        chunk = await rx.receive()
+                except TimeoutError:
+                    await forward(bytes(buffer))
+                    buffer.clear()
+                    continue
+                except anyio.EndOfStream:
+                    break
+                if first:
+                    await forward(chunk)
+                    first = _CONTENT_RE.search(chunk) is None
+                    continue
+                if not buffer:
+                    flush_at = time.monotonic() + interval
+                buffer += chunk
+                if len(buffer) >= max_bytes:
+                    await forward(bytes(buffer))
+                    buffer.clear()
+        if buffer:
+            await forward(bytes(buffer))
+        if failure:
+            raise failure[0]
@@ -0,0 +1,164 @@
+"""Long-lived, pooled HTTP clients for the llama-server upstreams.
+
+One httpx.AsyncClient per upstream is created in the app lifespan and shared
+by every request, so TCP connections (and TLS sessions, for HTTPS upstreams)
+are reused instead of being set up on each call.
+
+Usage:
+    import upstream
+    client = upstream.get_client("chat")
+    resp = await client.post(url, json=body)
+
+Every request goes through _MetricsTransport, which records time to response
+headers per backend, counts connect/timeout/5xx errors for /metrics and
+applies the backend's circuit breaker (see breaker.py).
+"""
+
+import time
+
+import httpx
+
+from breaker import CircuitBreaker, CircuitOpenError
+from config import (
+    CHAT_TIMEOUT,
+    EMBED_TIMEOUT,
+    UPSTREAM_BREAKER_FAILURES,
+    UPSTREAM_BREAKER_RESET,
+    UPSTREAM_CONNECT_TIMEOUT,
+    UPSTREAM_HTTP2,
+    UPSTREAM_KEEPALIVE_EXPIRY,
+    UPSTREAM_MAX_CONNECTIONS,
+    UPSTREAM_MAX_KEEPALIVE,
+)
+from shared import metrics
+
+UPSTREAM_LATENCY = metrics.histogram(
+    "ai_upstream_response_seconds",
+    "Time from sending an upstream request to its response headers",
+    ["upstream", "backend", "path"],
+)
+UPSTREAM_ERRORS = metrics.counter(
+    "ai_upstream_errors_total",
+    "Failed upstream requests by type (connect, timeout, http_5xx, circuit_open, other)",
+    ["upstream", "backend", "type"],
+)
+CIRCUIT_OPEN = metrics.gauge(
+    "ai_upstream_circuit_open", "1 while the backend's circuit breaker rejects requests", ["upstream", "backend"]
+)
+
+_TIMEOUTS = {
+    "chat": CHAT_TIMEOUT,
+    "embed": EMBED_TIMEOUT,
+}
+
+_clients: dict[str, httpx.AsyncClient] = {}
+_breakers: dict[tuple[str, str], CircuitBreaker] = {}
+
+
+def _origin(url: httpx.URL) -> str:
+    return f"{url.scheme}://{url.netloc.decode()}"
+
+
+def circuit(name: str, url: str | httpx.URL) -> CircuitBreaker:
+    """The circuit breaker for one backend (any URL on it) of an upstream."""
+    key = (name, _origin(httpx.URL(url)))
+    breaker = _breakers.get(key)
+    if breaker is None:
+        breaker = _breakers[key] = CircuitBreaker(
+            f"{name} backend {key[1]}", UPSTREAM_BREAKER_FAILURES, UPSTREAM_BREAKER_RESET
+        )
+        CIRCUIT_OPEN.labels(*key).set_function(lambda b=breaker: int(b.blocking))
+    return breaker
+
+
+class _MetricsTransport(httpx.AsyncBaseTransport):
+    def __init__(self, name: str, transport: httpx.AsyncBaseTransport):
+        self.name = name
+        self.transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        url = request.url
+        backend = _origin(url)
+        breaker = circuit(self.name, url)
+        if not breaker.allow():
+            UPSTREAM_ERRORS.labels(self.name, backend, "circuit_open").inc()
+            raise CircuitOpenError(f"circuit open for {backend}", request=request)
+        started = time.perf_counter()
+        try:
+            response = await self.transport.handle_async_request(request)
+        except httpx.ConnectError:
+            breaker.failure()
+            UPSTREAM_ERRORS.labels(self.name, backend, "connect").inc()
+            raise
+        except httpx.TimeoutException:
+            breaker.failure()
+            UPSTREAM_ERRORS.labels(self.name, backend, "timeout").inc()
+            raise
+        except httpx.HTTPError:
+            breaker.abandon()
+            UPSTREAM_ERRORS.labels(self.name, backend, "other").inc()
+            raise
+        except BaseException:
+            breaker.abandon()
+            raise
+        breaker.success()
+        UPSTREAM_LATENCY.labels(self.name, backend, url.path).observe(time.perf_counter() - started)
+        if response.status_code >= 500:
+            UPSTREAM_ERRORS.labels(self.name, backend, "http_5xx").inc()
+        return response
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+def _build_client(name: str, timeout: float) -> httpx.AsyncClient:
+    # Pool settings belong to the inner transport once a transport is given.
+    transport = httpx.AsyncHTTPTransport(
+        limits=httpx.Limits(
+            max_connections=UPSTREAM_MAX_CONNECTIONS,
+            max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE,
+            keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+        ),
+        http2=UPSTREAM_HTTP2,
+        # verify=True ensures TLS cert validation if an upstream uses HTTPS.
+        # Do not set verify=False — it would allow MITM attacks.
+        verify=True,
+    )
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(timeout, connect=min(timeout, UPSTREAM_CONNECT_TIMEOUT)),
+        transport=_MetricsTransport(name, transport),
+    )
+
+
+async def startup() -> None:
+    """Create one client per upstream. Called from the app lifespan."""
+    for name, timeout in _TIMEOUTS.items():
+        if name not in _clients:
+            _clients[name] = _build_client(name, timeout)
+
+
+async def shutdown() -> None:
+    """Close all clients and their pooled connections."""
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        await client.aclose()
+
+
+def get_client(name: str) -> httpx.AsyncClient:
+    """Return the shared client for the named upstream ("chat" or "embed").
+
+    Raises RuntimeError if called outside the app lifespan.
+    """
+    try:
+        return _clients[name]
+    except KeyError:
+        raise RuntimeError(f"Upstream client '{name}' is not started") from None
+
+
+class UpstreamStatusError(Exception):
+    """An upstream answered with a non-200 status."""
+
+    def __init__(self, status_code: int):
+        super().__init__(f"upstream returned status {status_code}")
+        self.status_code = status_code
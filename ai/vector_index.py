@@ -0,0 +1,471 @@
+"""In-process vector collections with cosine top-k search.
+
+Each collection lives in its own directory under VECTOR_DATA_DIR:
+
+    collection.json   dimension, storage dtype, row count and generation
+    vectors.bin       contiguous row-major matrix (float32 or int8), memory-mapped
+    scales.bin        per-row float32 dequantization scales (int8 only)
+    items.sqlite3     row number -> id and JSON metadata
+    collection.lock   flock()ed by worker processes sharing the collection
+
+Vectors are L2-normalized on insert, so cosine similarity is a dot product.
+Rows stay dense: deleting a row moves the last row into its slot.
+
+Exact search scores all rows in blocks with one matrix product per block.
+Approximate search uses an inverted-file index (IVF): rows are assigned to the
+nearest of ~sqrt(n) k-means centroids and a query only scores rows in its
+`nprobe` nearest lists. The IVF index is kept in memory, rebuilt lazily when
+the collection has grown 4x since training, and updated in place on add and
+delete.
+
+Methods block and are thread-safe; call them via asyncio.to_thread from
+request handlers.
+
+With several server processes (SERVE_WORKERS > 1) each process maps the same
+files. Writes take an exclusive flock on collection.lock and bump the header's
+generation; reads take a shared one. Before every operation a process whose
+generation is behind reloads the row ids and re-assigns its IVF lists (the
+centroids are kept).
+"""
+
+import fcntl
+import json
+import logging
+import os
+import re
+import secrets
+import shutil
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+from config import SERVE_WORKERS, VECTOR_DATA_DIR, VECTOR_IVF_MIN_ROWS, VECTOR_IVF_NPROBE
+
+logger = logging.getLogger("ai.vector_index")
+
+NAME_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+DTYPES = {"float32": np.float32, "int8": np.int8}
+
+_MIN_CAPACITY = 1024
+_BLOCK_ROWS = 16_384  # rows scored per matrix product in exact search
+_KMEANS_SAMPLE = 50_000
+_KMEANS_ITERS = 10
+_SHARED = SERVE_WORKERS > 1
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _topk(scores: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    """Return (indices, scores) of the k best columns per row, best first."""
+    k = min(k, scores.shape[1])
+    if k == 0:
+        empty = np.empty((scores.shape[0], 0))
+        return empty.astype(np.int64), empty.astype(np.float32)
+    if k < scores.shape[1]:
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        part = np.broadcast_to(np.arange(scores.shape[1]), scores.shape).copy()
+    part_scores = np.take_along_axis(scores, part, axis=1)
+    order = np.argsort(-part_scores, axis=1, kind="stable")
+    return np.take_along_axis(part, order, axis=1), np.take_along_axis(part_scores, order, axis=1)
+
+
+class _IVF:
+    def __init__(self, centroids: np.ndarray, assign: np.ndarray, trained_rows: int):
+        self.centroids = centroids
+        self.assign = assign  # row -> list number, grown alongside the matrix
+        self.trained_rows = trained_rows
+
+
+class Collection:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.RLock()
+        self._lock_file = open(os.path.join(path, "collection.lock"), "ab") if _SHARED else None
+        header = _read_header(path)
+        self.dim: int = header["dim"]
+        self.dtype: str = header["dtype"]
+        self.count: int = header["count"]
+        self.instance: str | None = header.get("instance")
+        self.generation: int = header.get("generation", 0)
+        self._db = sqlite3.connect(os.path.join(path, "items.sqlite3"), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS items (row INTEGER PRIMARY KEY, id TEXT UNIQUE NOT NULL, meta TEXT)"
+        )
+        self._load_ids()
+        self._ivf: _IVF | None = None
+        self._ivf_stale = False
+        self._open_matrix(max(_MIN_CAPACITY, self.count))
+
+    @classmethod
+    def create(cls, path: str, dim: int, dtype: str) -> "Collection":
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, "collection.lock"), "ab") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            # Another process may have created it first.
+            if not os.path.exists(os.path.join(path, "collection.json")):
+                header = {"dim": dim, "dtype": dtype, "count": 0, "instance": secrets.token_hex(8), "generation": 0}
+                _write_header(path, header)
+        return cls(path)
+
+    def _load_ids(self) -> None:
+        self._ids: list[str] = [None] * self.count
+        for row, item_id in self._db.execute("SELECT row, id FROM items WHERE row < ?", (self.count,)):
+            self._ids[row] = item_id
+        self._rows = {item_id: row for row, item_id in enumerate(self._ids)}
+
+    # --- Sharing between processes ---
+
+    @contextmanager
+    def _locked(self, exclusive: bool):
+        with self._lock:
+            if self._lock_file is None:
+                yield
+                return
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                self._sync()
+                yield
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _sync(self) -> None:
+        """Catch up with writes made by other processes."""
+        header = _read_header(self.path)
+        if header.get("generation", 0) == self.generation:
+            return
+        self.generation = header.get("generation", 0)
+        self.count = header["count"]
+        self._load_ids()
+        if self.count > self.capacity:
+            self._open_matrix(self._file_rows())
+            if self._ivf is not None:
+                self._ivf.assign = np.zeros(self.capacity, dtype=np.int32)
+        self._ivf_stale = self._ivf is not None
+
+    def _file_rows(self) -> int:
+        itemsize = np.dtype(DTYPES[self.dtype]).itemsize
+        return max(self.count, os.path.getsize(os.path.join(self.path, "vectors.bin")) // (self.dim * itemsize))
+
+    # --- Storage ---
+
+    def _open_matrix(self, capacity: int) -> None:
+        np_dtype = DTYPES[self.dtype]
+        files = [("vectors.bin", np_dtype, (capacity, self.dim))]
+        if self.dtype == "int8":
+            files.append(("scales.bin", np.float32, (capacity,)))
+        maps = []
+        for name, dt, shape in files:
+            file_path = os.path.join(self.path, name)
+            nbytes = int(np.prod(shape)) * np.dtype(dt).itemsize
+            with open(file_path, "ab") as f:
+                if f.tell() < nbytes:
+                    f.truncate(nbytes)
+            maps.append(np.memmap(file_path, dtype=dt, mode="r+", shape=shape))
+        self._matrix = maps[0]
+        self._scales = maps[1] if len(maps) > 1 else None
+        self.capacity = capacity
+
+    def _ensure_capacity(self, rows: int) -> None:
+        if rows <= self.capacity:
+            return
+        capacity = self.capacity
+        while capacity < rows:
+            capacity *= 2
+        self._flush_matrix()
+        self._open_matrix(capacity)
+        if self._ivf is not None:
+            assign = np.zeros(capacity, dtype=np.int32)
+            assign[: self.count] = self._ivf.assign[: self.count]
+            self._ivf.assign = assign
+
+    def _flush_matrix(self) -> None:
+        self._matrix.flush()
+        if self._scales is not None:
+            self._scales.flush()
+
+    def _write_rows(self, rows: np.ndarray, vectors: np.ndarray) -> None:
+        if self.dtype == "int8":
+            peak = np.abs(vectors).max(axis=1)
+            peak[peak == 0] = 1.0
+            self._matrix[rows] = np.round(vectors / peak[:, None] * 127).astype(np.int8)
+            self._scales[rows] = peak / 127
+        else:
+            self._matrix[rows] = vectors
+
+    def _read_rows(self, start: int, stop: int) -> np.ndarray:
+        block = np.asarray(self._matrix[start:stop], dtype=np.float32)
+        if self._scales is not None:
+            block *= self._scales[start:stop, None]
+        return block
+
+    def _commit(self) -> None:
+        self._flush_matrix()
+        self._db.commit()
+        self.generation += 1
+        _write_header(self.path, {
+            "dim": self.dim, "dtype": self.dtype, "count": self.count,
+            "instance": self.instance, "generation": self.generation,
+        })
+
+    # --- Mutations ---
+
+    def add(self, ids: list[str], vectors: np.ndarray, metadata: list | None = None) -> dict:
+        """Insert or overwrite rows. Returns counts of added and updated ids."""
+        if vectors.shape != (len(ids), self.dim):
+            raise ValueError(f"expected {len(ids)} vectors of dimension {self.dim}")
+        if len(set(ids)) != len(ids):
+            raise ValueError("ids must be unique within one request")
+        vectors = _normalize(vectors.astype(np.float32, copy=False))
+        metas = [None if m is None else json.dumps(m) for m in (metadata or [None] * len(ids))]
+        with self._locked(exclusive=True):
+            rows = np.empty(len(ids), dtype=np.int64)
+            added = 0
+            for i, item_id in enumerate(ids):
+                row = self._rows.get(item_id)
+                if row is None:
+                    row = self.count + added
+                    added += 1
+                rows[i] = row
+            self._ensure_capacity(self.count + added)
+            self._write_rows(rows, vectors)
+            for i, item_id in enumerate(ids):
+                row = int(rows[i])
+                if row >= self.count:
+                    self._ids.append(item_id)
+                    self._rows[item_id] = row
+            self._db.executemany(
+                "INSERT OR REPLACE INTO items (row, id, meta) VALUES (?, ?, ?)",
+                [(int(r), i, m) for r, i, m in zip(rows, ids, metas)],
+            )
+            self.count += added
+            if self._ivf is not None:
+                self._ivf.assign[rows] = np.argmax(vectors @ self._ivf.centroids.T, axis=1)
+            self._commit()
+        return {"added": added, "updated": len(ids) - added}
+
+    def delete(self, ids: list[str]) -> int:
+        """Remove rows by id. Returns the number of rows removed."""
+        removed = 0
+        with self._locked(exclusive=True):
+            for item_id in ids:
+                row = self._rows.pop(item_id, None)
+                if row is None:
+                    continue
+                last = self.count - 1
+                self._db.execute("DELETE FROM items WHERE row = ?", (row,))
+                if row != last:
+                    moved = self._ids[last]
+                    self._matrix[row] = self._matrix[last]
+                    if self._scales is not None:
+                        self._scales[row] = self._scales[last]
+                    if self._ivf is not None:
+                        self._ivf.assign[row] = self._ivf.assign[last]
+                    self._ids[row] = moved
+                    self._rows[moved] = row
+                    self._db.execute("UPDATE items SET row = ? WHERE row = ?", (row, last))
+                self._ids.pop()
+                self.count -= 1
+                removed += 1
+            if removed:
+                self._commit()
+        return removed
+
+    # --- Search ---
+
+    def search(self, queries: np.ndarray, k: int, approximate: bool = False,
+               nprobe: int = VECTOR_IVF_NPROBE) -> list[list[dict]]:
+        """Cosine top-k for each query row. Returns [{id, score, metadata}] lists."""
+        if queries.ndim != 2 or queries.shape[1] != self.dim:
+            raise ValueError(f"queries must have dimension {self.dim}")
+        queries = _normalize(queries.astype(np.float32, copy=False))
+        with self._locked(exclusive=False):
+            if approximate and self.count >= VECTOR_IVF_MIN_ROWS:
+                self._ensure_ivf()
+                idx, scores = self._search_ivf(queries, k, nprobe)
+            else:
+                idx, scores = self._search_exact(queries, k)
+            ids = [[self._ids[r] for r in row if r >= 0] for row in idx]
+            scores = [row[: len(row_ids)] for row, row_ids in zip(scores, ids)]
+            meta = self._metadata({i for row in ids for i in row})
+        return [
+            [{"id": i, "score": float(s), "metadata": meta.get(i)} for i, s in zip(row_ids, row_scores)]
+            for row_ids, row_scores in zip(ids, scores)
+        ]
+
+    def _search_exact(self, queries: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        best_idx = np.empty((len(queries), 0), dtype=np.int64)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        for start in range(0, self.count, _BLOCK_ROWS):
+            stop = min(start + _BLOCK_ROWS, self.count)
+            idx, scores = _topk(queries @ self._read_rows(start, stop).T, k)
+            merged_idx = np.concatenate([best_idx, idx + start], axis=1)
+            merged_scores = np.concatenate([best_scores, scores], axis=1)
+            order, best_scores = _topk(merged_scores, k)
+            best_idx = np.take_along_axis(merged_idx, order, axis=1)
+        return best_idx, best_scores
+
+    def _search_ivf(self, queries: np.ndarray, k: int, nprobe: int) -> tuple[np.ndarray, np.ndarray]:
+        ivf = self._ivf
+        probes, _ = _topk(queries @ ivf.centroids.T, max(1, nprobe))
+        # wanted[q, l] is True when query q probes list l.
+        wanted = np.zeros((len(queries), len(ivf.centroids)), dtype=bool)
+        np.put_along_axis(wanted, probes, True, axis=1)
+        assign = ivf.assign[: self.count]
+        candidates = np.flatnonzero(wanted.any(axis=0)[assign])
+        if len(candidates) == 0:
+            empty = np.empty((len(queries), 0))
+            return empty.astype(np.int64), empty.astype(np.float32)
+        block = np.asarray(self._matrix[candidates], dtype=np.float32)
+        if self._scales is not None:
+            block *= self._scales[candidates, None]
+        # One product for the whole query batch over the union of probed lists;
+        # rows outside a query's own lists are masked out.
+        scores = queries @ block.T
+        scores[~wanted[:, assign[candidates]]] = -np.inf
+        idx, scores = _topk(scores, k)
+        idx = np.where(np.isfinite(scores), candidates[idx], -1)
+        return idx, scores
+
+    def _ensure_ivf(self) -> None:
+        if self._ivf is not None and self.count <= 4 * self._ivf.trained_rows:
+            if self._ivf_stale:
+                self._ivf.assign = self._assign(self._ivf.centroids)
+                self._ivf_stale = False
+            return
+        nlist = max(1, int(np.sqrt(self.count)))
+        rng = np.random.default_rng(0)
+        sample_rows = np.sort(rng.choice(self.count, min(self.count, _KMEANS_SAMPLE), replace=False))
+        sample = np.asarray(self._matrix[sample_rows], dtype=np.float32)
+        if self._scales is not None:
+            sample *= self._scales[sample_rows, None]
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)]
+        # Spherical k-means: centroids stay unit length, assignment by dot product.
+        for _ in range(_KMEANS_ITERS):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            empty = np.bincount(labels, minlength=nlist) == 0
+            sums[empty] = centroids[empty]
+            centroids = _normalize(sums)
+        self._ivf = _IVF(centroids, self._assign(centroids), self.count)
+        self._ivf_stale = False
+        logger.info("Built IVF index for %s: %d rows, %d lists", self.path, self.count, nlist)
+
+    def _assign(self, centroids: np.ndarray) -> np.ndarray:
+        assign = np.zeros(self.capacity, dtype=np.int32)
+        for start in range(0, self.count, _BLOCK_ROWS):
+            stop = min(start + _BLOCK_ROWS, self.count)
+            assign[start:stop] = np.argmax(self._read_rows(start, stop) @ centroids.T, axis=1)
+        return assign
+
+    # --- Misc ---
+
+    def _metadata(self, ids: set[str]) -> dict:
+        if not ids:
+            return {}
+        id_list = list(ids)
+        marks = ",".join("?" * len(id_list))
+        rows = self._db.execute(f"SELECT id, meta FROM items WHERE id IN ({marks})", id_list)
+        return {i: (json.loads(m) if m is not None else None) for i, m in rows}
+
+    def stats(self) -> dict:
+        return {
+            "dim": self.dim,
+            "dtype": self.dtype,
+            "count": self.count,
+            "capacity": self.capacity,
+            "ivf_lists": 0 if self._ivf is None else len(self._ivf.centroids),
+        }
+
+    def close(self) -> None:
+        with self._locked(exclusive=True):
+            self._commit()
+        self._release()
+
+    def _release(self) -> None:
+        self._db.close()
+        if self._lock_file is not None:
+            self._lock_file.close()
+
+
+def _read_header(path: str) -> dict:
+    with open(os.path.join(path, "collection.json")) as f:
+        return json.load(f)
+
+
+def _write_header(path: str, header: dict) -> None:
+    tmp = os.path.join(path, "collection.json.tmp")
+    with open(tmp, "w") as f:
+        json.dump(header, f)
+    os.replace(tmp, os.path.join(path, "collection.json"))
+
+
+# --- Registry ---
+
+_collections: dict[str, Collection] = {}
+_registry_lock = threading.Lock()
+
+
+def get_collection(name: str, dim: int | None = None, dtype: str = "float32") -> Collection | None:
+    """Return the named collection, loading it from disk on first use.
+
+    If it does not exist and `dim` is given, it is created; otherwise None.
+    """
+    with _registry_lock:
+        path = os.path.join(VECTOR_DATA_DIR, name)
+        coll = _collections.get(name)
+        if coll is not None and _SHARED and not _current(coll):
+            del _collections[name]  # dropped (and maybe recreated) by another process
+            coll._release()
+            coll = None
+        if coll is not None:
+            return coll
+        if os.path.exists(os.path.join(path, "collection.json")):
+            coll = Collection(path)
+        elif dim is not None:
+            coll = Collection.create(path, dim, dtype)
+        else:
+            return None
+        _collections[name] = coll
+        return coll
+
+
+def _current(coll: Collection) -> bool:
+    try:
+        return _read_header(coll.path).get("instance") == coll.instance
+    except FileNotFoundError:
+        return False
+
+
+def _close(coll: Collection) -> None:
+    if _SHARED and not _current(coll):
+        coll._release()  # its files are gone; nothing to save
+    else:
+        coll.close()
+
+
+def drop_collection(name: str) -> bool:
+    with _registry_lock:
+        coll = _collections.pop(name, None)
+        if coll is not None:
+            _close(coll)
+        path = os.path.join(VECTOR_DATA_DIR, name)
+        if not os.path.exists(path):
+            return coll is not None
+        shutil.rmtree(path)
+        return True
+
+
+def close_all() -> None:
+    with _registry_lock:
+        for coll in _collections.values():
+            _close(coll)
+        _collections.clear()
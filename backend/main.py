@@ -1,12 +1,16 @@
+import json
 import os
+from contextlib import asynccontextmanager
 from datetime import datetime
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, Header, HTTPException, Query, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
 
+from shared import debug, metrics
 from shared.auth.router import router as auth_router
+from store import FruitStore
 
 class Fruit(BaseModel):
     name: str
@@ -14,7 +18,19 @@ class Fruit(BaseModel):
 class Fruits(BaseModel):
     fruits: List[Fruit]
 
-app = FastAPI(debug=True)
+class FruitPage(Fruits):
+    # Cursor for the next page; null on the last page and without `limit`.
+    next_cursor: Optional[int] = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    debug.start_monitor("backend")
+    try:
+        yield
+    finally:
+        await debug.stop_monitor()
+
+app = FastAPI(debug=True, lifespan=lifespan)
 
 cors_env = os.environ.get("CORS_ORIGINS", "http://localhost:5173,http://localhost:3000")
 origins = [o.strip() for o in cors_env.split(",")]
@@ -27,9 +43,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(metrics.MetricsMiddleware, prefix="backend")
+app.add_route("/metrics", metrics.metrics_endpoint, include_in_schema=False)
+debug.install(app)
+
 app.include_router(auth_router)
 
-memory_db = {"fruits": []}
+store = FruitStore(os.environ.get("BACKEND_DB_PATH", "data/backend.sqlite3"))
+MAX_PAGE_SIZE = 1000
 
 @app.get("/health")
 def health():
@@ -37,23 +58,56 @@ def health():
         "status": "ok",
         "service": "ReseachAI Bsd",
         "time": datetime.now().isoformat(),
-        "fruit_count": len(memory_db["fruits"]),
+        "fruit_count": store.count(),
     }
 
-@app.get("/fruits", response_model=Fruits)
-def get_fruits():
-    return Fruits(fruits=memory_db["fruits"])
+@app.get("/fruits", response_model=FruitPage)
+def get_fruits(
+    cursor: int = 0,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    if_none_match: Optional[str] = Header(None),
+):
+    """All fruits, or one page of them with `limit` (follow `next_cursor`).
+
+    Responses carry an ETag; a matching If-None-Match gets 304 with no body.
+    The FruitPage body is serialized here (the full list from a cache), so
+    `response_model` only documents it.
+    """
+    etag = store.etag()
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if if_none_match and etag in (t.strip() for t in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+    if cursor == 0 and limit is None:
+        return Response(content=store.all_json(etag), media_type="application/json", headers=headers)
+    items, next_cursor = store.page(cursor, limit)
+    return Response(
+        content=json.dumps({"fruits": items, "next_cursor": next_cursor}, separators=(",", ":")),
+        media_type="application/json",
+        headers=headers,
+    )
+
+@app.get("/fruits/{name}", response_model=Fruit)
+def get_fruit(name: str):
+    fruit = store.get(name)
+    if fruit is None:
+        raise HTTPException(status_code=404, detail="Fruit not found")
+    return Fruit(name=fruit["name"])
 
 @app.post("/fruits")
 def add_fruit(fruit: Fruit):
-    memory_db["fruits"].append(fruit)
-    return {"name": fruit.name, "total": len(memory_db["fruits"])}
+    total = store.add(fruit.name)
+    return {"name": fruit.name, "total": total}
+
+@app.post("/fruits/bulk")
+def add_fruits(fruits: Fruits):
+    total = store.add_many([f.name for f in fruits.fruits])
+    return {"inserted": len(fruits.fruits), "total": total}
 
 @app.delete("/fruits")
 def clear_fruits():
-    memory_db["fruits"].clear()
+    store.clear()
     return {"status": "cleared"}
 
-
 if __name__ == "__main__":
+    # Single process for development; production runs `python -m shared.serve main:app`.
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,97 @@
+"""SQLite-backed storage for fruits.
+
+The database runs in WAL mode, so readers (one connection per thread; sync
+FastAPI endpoints run in a thread pool) never block on a writer, and several
+uvicorn workers can share the same file.
+
+Every write bumps a version number stored next to the data. Together with a
+random id chosen when the database is created it forms the collection's
+ETag, which lets unchanged collections be answered with 304 without reading
+any rows.
+"""
+
+import json
+import os
+import secrets
+import sqlite3
+import threading
+
+
+class FruitStore:
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        self._body_cache: tuple[str, bytes] | None = None  # (etag, full-list JSON)
+        db = self._db()
+        with db:
+            db.execute("CREATE TABLE IF NOT EXISTS fruits (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL)")
+            db.execute("CREATE INDEX IF NOT EXISTS fruits_name ON fruits (name)")
+            db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            db.execute("INSERT OR IGNORE INTO meta VALUES ('epoch', ?)", (secrets.token_hex(4),))
+            db.execute("INSERT OR IGNORE INTO meta VALUES ('version', '0')")
+
+    def _db(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=5.0)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def _bump(self, db: sqlite3.Connection) -> None:
+        db.execute("UPDATE meta SET value = CAST(value AS INTEGER) + 1 WHERE key = 'version'")
+
+    def etag(self) -> str:
+        rows = dict(self._db().execute("SELECT key, value FROM meta WHERE key IN ('epoch', 'version')"))
+        return f'"{rows["epoch"]}-{rows["version"]}"'
+
+    def count(self) -> int:
+        return self._db().execute("SELECT COUNT(*) FROM fruits").fetchone()[0]
+
+    def add(self, name: str) -> int:
+        """Insert one fruit; returns the new total."""
+        return self.add_many([name])
+
+    def add_many(self, names: list[str]) -> int:
+        """Insert fruits in a single transaction; returns the new total."""
+        db = self._db()
+        with db:
+            db.executemany("INSERT INTO fruits (name) VALUES (?)", ((n,) for n in names))
+            self._bump(db)
+            return db.execute("SELECT COUNT(*) FROM fruits").fetchone()[0]
+
+    def clear(self) -> None:
+        db = self._db()
+        with db:
+            db.execute("DELETE FROM fruits")
+            self._bump(db)
+
+    def get(self, name: str) -> dict | None:
+        row = self._db().execute("SELECT id, name FROM fruits WHERE name = ? ORDER BY id LIMIT 1", (name,)).fetchone()
+        return None if row is None else {"id": row[0], "name": row[1]}
+
+    def page(self, after: int = 0, limit: int | None = None) -> tuple[list[dict], int | None]:
+        """Fruits with id > `after` in insertion order; returns (items, next_cursor)."""
+        db = self._db()
+        if limit is None:
+            rows = db.execute("SELECT id, name FROM fruits WHERE id > ? ORDER BY id", (after,)).fetchall()
+            return [{"name": name} for _, name in rows], None
+        rows = db.execute(
+            "SELECT id, name FROM fruits WHERE id > ? ORDER BY id LIMIT ?", (after, limit + 1)
+        ).fetchall()
+        next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+        return [{"name": name} for _, name in rows[:limit]], next_cursor
+
+    def all_json(self, etag: str) -> bytes:
+        """The full list as {"fruits": [...]} JSON, reused while `etag` holds."""
+        cached = self._body_cache
+        if cached is not None and cached[0] == etag:
+            return cached[1]
+        items, _ = self.page()
+        body = json.dumps({"fruits": items}, separators=(",", ":")).encode()
+        self._body_cache = (etag, body)
+        return body
@@ -0,0 +1,98 @@
+"""Validations per second for /auth/validate with the token cache on and off.
+
+Measures both the bare verification call (decode_token vs
+decode_token_cached) and the full /auth/validate route through the ASGI app
+in-process, and prints one JSON object per measurement.
+
+Usage:
+    python bench/bench_auth.py --seconds 2 --tokens 1 100
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("JWT_SECRET", "bench-only-secret-not-for-production-use")
+
+
+def _rate(fn, seconds: float) -> float:
+    """Calls per second of `fn()` over roughly `seconds`."""
+    n = 0
+    deadline = time.perf_counter() + seconds
+    start = time.perf_counter()
+    while time.perf_counter() < deadline:
+        for _ in range(100):
+            fn()
+        n += 100
+    return n / (time.perf_counter() - start)
+
+
+async def _route_rate(app, tokens: list[str], seconds: float) -> float:
+    import httpx
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        headers = [{"Authorization": f"Bearer {t}"} for t in tokens]
+        n = 0
+        start = time.perf_counter()
+        deadline = start + seconds
+        while time.perf_counter() < deadline:
+            resp = await client.get("/auth/validate", headers=headers[n % len(headers)])
+            assert resp.status_code == 200, resp.text
+            n += 1
+        return n / (time.perf_counter() - start)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=2.0)
+    parser.add_argument("--tokens", type=int, nargs="+", default=[1, 100],
+                        help="number of distinct tokens cycled through")
+    args = parser.parse_args()
+
+    from fastapi import FastAPI
+
+    from shared.auth import jwt_handler
+    from shared.auth.router import router
+
+    app = FastAPI()
+    app.include_router(router)
+
+    for n_tokens in args.tokens:
+        tokens = [jwt_handler.create_access_token(f"user{i}") for i in range(n_tokens)]
+        results = {"tokens": n_tokens}
+
+        i = 0
+
+        def uncached():
+            nonlocal i
+            jwt_handler.decode_token(tokens[i % n_tokens])
+            i += 1
+
+        def cached():
+            nonlocal i
+            jwt_handler.decode_token_cached(tokens[i % n_tokens])
+            i += 1
+
+        results["decode_per_s"] = round(_rate(uncached, args.seconds))
+        jwt_handler.clear_token_cache()
+        results["decode_cached_per_s"] = round(_rate(cached, args.seconds))
+
+        size = jwt_handler.TOKEN_CACHE_SIZE
+        jwt_handler.TOKEN_CACHE_SIZE = 0
+        results["validate_route_per_s"] = round(asyncio.run(_route_rate(app, tokens, args.seconds)))
+        jwt_handler.TOKEN_CACHE_SIZE = size
+        jwt_handler.clear_token_cache()
+        results["validate_route_cached_per_s"] = round(asyncio.run(_route_rate(app, tokens, args.seconds)))
+
+        print(json.dumps(results), flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,104 @@
+"""Query latency of the AI service vector index against collection size.
+
+Builds random collections of increasing size in a temporary directory,
+checks exact search against a NumPy brute-force baseline, measures recall of
+the approximate (IVF) mode, and prints one JSON object per size.
+
+Usage:
+    python bench/bench_vector_index.py --sizes 1000 10000 100000 --dim 1024
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _timed(fn, repeat: int) -> float:
+    """Median wall time of `fn()` in milliseconds."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return float(np.median(samples))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--queries", type=int, default=16)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--dtype", choices=["float32", "int8"], default="float32")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--clusters", type=int, default=256,
+                        help="draw data around this many centres (0 = isotropic noise)")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench-vectors-")
+    os.environ["VECTOR_DATA_DIR"] = tmp
+    os.environ["VECTOR_IVF_MIN_ROWS"] = "0"
+    sys.path.insert(0, os.path.join(ROOT, "ai"))
+    import vector_index
+
+    rng = np.random.default_rng(0)
+    ok = True
+    for size in args.sizes:
+        data = rng.standard_normal((size, args.dim), dtype=np.float32)
+        queries = rng.standard_normal((args.queries, args.dim), dtype=np.float32)
+        if args.clusters:
+            # Real embeddings are clustered; isotropic noise is the worst case for IVF.
+            centres = rng.standard_normal((args.clusters, args.dim), dtype=np.float32) * 3
+            data += centres[rng.integers(args.clusters, size=size)]
+            queries += centres[rng.integers(args.clusters, size=args.queries)]
+        ids = [str(i) for i in range(size)]
+        coll = vector_index.get_collection(f"bench{size}", args.dim, args.dtype)
+        for start in range(0, size, 10_000):
+            coll.add(ids[start:start + 10_000], data[start:start + 10_000])
+
+        normed = data / np.linalg.norm(data, axis=1, keepdims=True)
+        qn = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+        truth = [set(np.argsort(-row)[: args.k].astype(str)) for row in qn @ normed.T]
+
+        exact = coll.search(queries, args.k)
+        exact_recall = np.mean([len(t & {r["id"] for r in res}) / args.k for t, res in zip(truth, exact)])
+        if args.dtype == "float32" and exact_recall < 1.0:
+            ok = False
+
+        coll.search(queries[:1], args.k, approximate=True)  # build the IVF index outside the timing
+        approx = coll.search(queries, args.k, approximate=True)
+        approx_recall = np.mean([len(t & {r["id"] for r in res}) / args.k for t, res in zip(truth, approx)])
+
+        print(json.dumps({
+            "size": size,
+            "dim": args.dim,
+            "dtype": args.dtype,
+            "queries": args.queries,
+            "k": args.k,
+            "exact_ms": round(_timed(lambda: coll.search(queries, args.k), args.repeat), 3),
+            "exact_single_ms": round(_timed(lambda: coll.search(queries[:1], args.k), args.repeat), 3),
+            "approx_ms": round(_timed(lambda: coll.search(queries, args.k, approximate=True), args.repeat), 3),
+            "exact_recall": round(float(exact_recall), 4),
+            "approx_single_ms": round(
+                _timed(lambda: coll.search(queries[:1], args.k, approximate=True), args.repeat), 3),
+            "approx_recall": round(float(approx_recall), 4),
+        }), flush=True)
+        vector_index.drop_collection(f"bench{size}")
+
+    vector_index.close_all()
+    os.rmdir(tmp)
+    if not ok:
+        print("exact search disagreed with the brute-force baseline", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,393 @@
+"""Load generator for the AI service: latency percentiles and throughput.
+
+Runs closed-loop workers (each sends its next request as soon as the last one
+finished) for every scenario at every concurrency level, and prints one JSON
+object per (scenario, concurrency) cell. --out writes all results plus run
+metadata (git commit, settings) as one JSON document; --baseline compares
+against such a file from an earlier commit.
+
+Scenarios:
+    chat            POST /chat/completions
+    chat_stream     POST /chat/completions with stream=true (also reports TTFT)
+    embed           POST /embed (unique texts, so the cache is not hit)
+    auth_token      POST /auth/token (client_credentials)
+    auth_validate   GET /auth/validate
+    upstream_chat   POST /v1/chat/completions straight to the mock, i.e. the
+                    cost without the proxy; compare with chat for overhead
+
+With --spawn the harness starts bench/mock_llama.py and the AI service itself
+(from ai/, on free local ports, through shared.serve) and stops both
+afterwards. --workers 1 2 4 restarts the service with each worker count in
+turn, which shows how throughput scales with cores; --clients spreads the
+load generator itself over several processes so it does not become the
+bottleneck first.
+
+Usage:
+    python bench/loadgen.py --spawn --concurrency 1 8 32 --duration 10 --out results.json
+    python bench/loadgen.py --target http://127.0.0.1:8090 --scenarios chat embed
+    python bench/loadgen.py --spawn --baseline results.json
+    python bench/loadgen.py --spawn --scenarios chat --workers 1 2 4 --clients 4 --concurrency 64
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import itertools
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ("chat", "chat_stream", "embed", "auth_token", "auth_validate", "upstream_chat")
+_unique = itertools.count()
+
+
+def _percentile(sorted_values: list[float], q: float) -> float:
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, round(q / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[rank]
+
+
+def _chat_body(args, stream: bool) -> dict:
+    return {
+        "messages": [
+            {"role": "system", "content": "You are a benchmark."},
+            {"role": "user", "content": f"Request {next(_unique)}: say something."},
+        ],
+        "max_tokens": args.max_tokens,
+        # Non-zero so the deterministic response cache never answers.
+        "temperature": 0.7,
+        "stream": stream,
+    }
+
+
+async def _request(client: httpx.AsyncClient, scenario: str, args, ctx: dict) -> tuple[bool, float | None]:
+    """Send one request; returns (ok, time_to_first_byte or None)."""
+    headers = ctx.get("headers", {})
+    if scenario == "chat":
+        resp = await client.post("/chat/completions", json=_chat_body(args, False), headers=headers)
+        return resp.status_code == 200, None
+    if scenario == "upstream_chat":
+        resp = await client.post(f"{ctx['mock']}/v1/chat/completions", json=_chat_body(args, False))
+        return resp.status_code == 200, None
+    if scenario == "chat_stream":
+        started = time.perf_counter()
+        first = None
+        async with client.stream("POST", "/chat/completions", json=_chat_body(args, True), headers=headers) as resp:
+            async for _ in resp.aiter_raw():
+                if first is None:
+                    first = time.perf_counter() - started
+            return resp.status_code == 200, first
+    if scenario == "embed":
+        texts = [f"benchmark passage {next(_unique)} " * 8 for _ in range(args.embed_batch)]
+        resp = await client.post("/embed", json={"input": texts}, headers=headers)
+        return resp.status_code == 200, None
+    if scenario == "auth_token":
+        resp = await client.post("/auth/token", json=ctx["credentials"])
+        return resp.status_code == 200, None
+    if scenario == "auth_validate":
+        resp = await client.get("/auth/validate", headers=ctx["headers"])
+        return resp.status_code == 200, None
+    raise ValueError(scenario)
+
+
+async def _measure(client: httpx.AsyncClient, scenario: str, concurrency: int, args, ctx: dict) -> tuple:
+    """Run one cell; returns (latencies, ttfbs, errors, elapsed seconds)."""
+    latencies: list[float] = []
+    ttfbs: list[float] = []
+    errors = 0
+
+    async def worker(deadline: float, record: bool) -> None:
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                ok, ttfb = await _request(client, scenario, args, ctx)
+            except httpx.HTTPError:
+                ok, ttfb = False, None
+            if not record:
+                continue
+            if ok:
+                latencies.append(time.perf_counter() - started)
+                if ttfb is not None:
+                    ttfbs.append(ttfb)
+            else:
+                errors += 1
+
+    if args.warmup > 0:
+        deadline = time.perf_counter() + args.warmup
+        await asyncio.gather(*(worker(deadline, False) for _ in range(concurrency)))
+
+    started = time.perf_counter()
+    deadline = started + args.duration
+    await asyncio.gather(*(worker(deadline, True) for _ in range(concurrency)))
+    return latencies, ttfbs, errors, time.perf_counter() - started
+
+
+def _measure_in_process(scenario: str, concurrency: int, args, ctx: dict) -> tuple:
+    """_measure with a client of its own, for --clients > 1."""
+    async def run() -> tuple:
+        async with httpx.AsyncClient(base_url=args.target, timeout=args.timeout, limits=_limits(concurrency)) as client:
+            return await _measure(client, scenario, concurrency, args, ctx)
+
+    return asyncio.run(run())
+
+
+async def _run_cell(client: httpx.AsyncClient, scenario: str, concurrency: int, args, ctx: dict, pool=None) -> dict:
+    if pool is None:
+        latencies, ttfbs, errors, elapsed = await _measure(client, scenario, concurrency, args, ctx)
+    else:
+        # Split the concurrency over the client processes and merge their samples.
+        shares = [concurrency // args.clients + (i < concurrency % args.clients) for i in range(args.clients)]
+        loop = asyncio.get_running_loop()
+        parts = await asyncio.gather(*(
+            loop.run_in_executor(pool, _measure_in_process, scenario, share, args, ctx) for share in shares if share
+        ))
+        latencies = [x for part in parts for x in part[0]]
+        ttfbs = [x for part in parts for x in part[1]]
+        errors = sum(part[2] for part in parts)
+        elapsed = max(part[3] for part in parts)
+
+    latencies.sort()
+    ttfbs.sort()
+    result = {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "workers": args.current_workers,
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 2),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+    }
+    for q in (50, 95, 99):
+        result[f"p{q}_ms"] = round(_percentile(latencies, q) * 1000, 3)
+    if ttfbs:
+        for q in (50, 95, 99):
+            result[f"ttft_p{q}_ms"] = round(_percentile(ttfbs, q) * 1000, 3)
+    return result
+
+
+async def _prepare(client: httpx.AsyncClient, scenarios: list[str], args) -> dict:
+    ctx: dict = {"mock": args.mock, "credentials": None, "headers": {}}
+    if args.user and args.password:
+        ctx["credentials"] = {"grant_type": "client_credentials", "username": args.user, "password": args.password}
+        resp = await client.post("/auth/token", json=ctx["credentials"])
+        resp.raise_for_status()
+        ctx["headers"] = {"Authorization": f"Bearer {resp.json()['access_token']}"}
+    elif {"auth_token", "auth_validate"} & set(scenarios):
+        raise SystemExit("auth scenarios need --user and --password")
+    if "upstream_chat" in scenarios and not args.mock:
+        raise SystemExit("upstream_chat needs --mock (or --spawn)")
+    return ctx
+
+
+def _limits(concurrency: int) -> httpx.Limits:
+    return httpx.Limits(max_connections=concurrency * 2, max_keepalive_connections=concurrency)
+
+
+async def _run(args) -> list[dict]:
+    pool = concurrent.futures.ProcessPoolExecutor(args.clients) if args.clients > 1 else None
+    try:
+        async with httpx.AsyncClient(
+            base_url=args.target, timeout=args.timeout, limits=_limits(max(args.concurrency))
+        ) as client:
+            ctx = await _prepare(client, args.scenarios, args)
+            results = []
+            for scenario in args.scenarios:
+                for concurrency in args.concurrency:
+                    result = await _run_cell(client, scenario, concurrency, args, ctx, pool)
+                    print(json.dumps(result), flush=True)
+                    results.append(result)
+            return results
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_ready(url: str, proc: subprocess.Popen, timeout: float = 30.0) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"process for {url} exited with {proc.returncode}")
+        try:
+            if httpx.get(f"{url}/health", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise SystemExit(f"{url} did not become ready")
+
+
+def _spawn_mock(args) -> subprocess.Popen:
+    """Start the mock upstream; point args at it."""
+    mock_port = _free_port()
+    mock = subprocess.Popen([
+        sys.executable, os.path.join(ROOT, "bench", "mock_llama.py"), "--port", str(mock_port),
+        "--latency-ms", str(args.mock_latency_ms), "--tokens-per-sec", str(args.mock_tokens_per_sec),
+        "--dim", str(args.mock_dim), "--error-rate", str(args.mock_error_rate),
+    ])
+    args.mock = f"http://127.0.0.1:{mock_port}"
+    try:
+        _wait_ready(args.mock, mock)
+    except BaseException:
+        _stop([mock])
+        raise
+    return mock
+
+
+def _spawn(args, workers: int) -> subprocess.Popen:
+    """Start the AI service with `workers` processes; point args at it."""
+    ai_port = _free_port()
+    env = {
+        **os.environ,
+        "PYTHONPATH": ROOT,
+        "LLAMA_CHAT_URL": args.mock,
+        "LLAMA_EMBED_URL": args.mock,
+        "AI_DATA_DIR": os.path.join(ROOT, "bench", ".data"),
+        "JWT_SECRET": os.environ.get("JWT_SECRET", "bench-only-secret-not-for-production-use"),
+        "SERVER_AUTH_USER": args.user or "bench",
+        "SERVER_AUTH_PASS": args.password or "bench-password",
+    }
+    args.user, args.password = env["SERVER_AUTH_USER"], env["SERVER_AUTH_PASS"]
+    ai = subprocess.Popen(
+        [
+            sys.executable, "-m", "shared.serve", "main:app", "--port", str(ai_port),
+            "--workers", str(workers), "--preload", "config", "--log-level", "warning",
+        ],
+        cwd=os.path.join(ROOT, "ai"),
+        env=env,
+    )
+    args.target = f"http://127.0.0.1:{ai_port}"
+    try:
+        _wait_ready(args.target, ai)
+    except BaseException:
+        _stop([ai])
+        raise
+    return ai
+
+
+def _stop(procs: list[subprocess.Popen]) -> None:
+    for proc in procs:
+        proc.terminate()
+    for proc in procs:
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def _git_commit() -> str:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True)
+        return out.stdout.strip()
+    except OSError:
+        return ""
+
+
+def _compare(results: list[dict], baseline_path: str) -> None:
+    with open(baseline_path) as f:
+        baseline = {(r["scenario"], r["concurrency"], r.get("workers", 1)): r for r in json.load(f)["results"]}
+    for result in results:
+        old = baseline.get((result["scenario"], result["concurrency"], result["workers"]))
+        if old is None:
+            continue
+        delta = {
+            "scenario": result["scenario"],
+            "concurrency": result["concurrency"],
+            "workers": result["workers"],
+            "compare": True,
+        }
+        for field in ("rps", "p50_ms", "p95_ms", "p99_ms"):
+            if old.get(field):
+                delta[f"{field}_change_pct"] = round((result[field] - old[field]) / old[field] * 100, 1)
+        print(json.dumps(delta), flush=True)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--target", default="http://127.0.0.1:8090", help="AI service base URL")
+    parser.add_argument("--mock", default="", help="mock upstream base URL (for upstream_chat)")
+    parser.add_argument("--spawn", action="store_true", help="start the mock and the AI service locally")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument(
+        "--workers", type=int, nargs="+", default=[1],
+        help="AI service worker processes; with --spawn, each count is run in turn",
+    )
+    parser.add_argument("--clients", type=int, default=1, help="load generator processes")
+    parser.add_argument("--duration", type=float, default=10.0, help="measured seconds per cell")
+    parser.add_argument("--warmup", type=float, default=1.0, help="unmeasured seconds before each cell")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--max-tokens", type=int, default=32)
+    parser.add_argument("--embed-batch", type=int, default=8, help="texts per /embed request")
+    parser.add_argument("--user", default=os.environ.get("SERVER_AUTH_USER", ""))
+    parser.add_argument("--password", default=os.environ.get("SERVER_AUTH_PASS", ""))
+    parser.add_argument("--mock-latency-ms", type=float, default=20.0)
+    parser.add_argument("--mock-tokens-per-sec", type=float, default=200.0)
+    parser.add_argument("--mock-dim", type=int, default=1024)
+    parser.add_argument("--mock-error-rate", type=float, default=0.0)
+    parser.add_argument("--out", help="write all results as one JSON document")
+    parser.add_argument("--baseline", help="results file from an earlier run to compare with")
+    args = parser.parse_args()
+    if not args.spawn and len(args.workers) > 1:
+        parser.error("several --workers counts need --spawn")
+
+    if not args.spawn and "upstream_chat" in args.scenarios and not args.mock:
+        args.scenarios = [s for s in args.scenarios if s != "upstream_chat"]
+    results = []
+    mock = _spawn_mock(args) if args.spawn else None
+    try:
+        for workers in args.workers:
+            args.current_workers = workers
+            ai = _spawn(args, workers) if args.spawn else None
+            try:
+                results += asyncio.run(_run(args))
+            finally:
+                if ai is not None:
+                    _stop([ai])
+    finally:
+        if mock is not None:
+            _stop([mock])
+
+    if args.out:
+        document = {
+            "meta": {
+                "commit": _git_commit(),
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "python": platform.python_version(),
+                "target": "spawned" if args.spawn else args.target,
+                "duration": args.duration,
+                "clients": args.clients,
+                "cpus": os.cpu_count(),
+                "mock": {
+                    "latency_ms": args.mock_latency_ms,
+                    "tokens_per_sec": args.mock_tokens_per_sec,
+                    "dim": args.mock_dim,
+                    "error_rate": args.mock_error_rate,
+                } if args.spawn else None,
+            },
+            "results": results,
+        }
+        with open(args.out, "w") as f:
+            json.dump(document, f, indent=2)
+    if args.baseline:
+        _compare(results, args.baseline)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
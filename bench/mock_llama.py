@@ -0,0 +1,126 @@
+"""Mock OpenAI-compatible llama-server for benchmarking the AI service.
+
+Stands in for LLAMA_CHAT_URL and LLAMA_EMBED_URL. It answers the endpoints
+the AI service uses (/v1/chat/completions with and without streaming,
+/v1/embeddings, /tokenize, /props, /health) with synthetic data and a
+configurable cost, so benchmark runs measure the proxy rather than a model.
+
+Usage:
+    python bench/mock_llama.py --port 18181 --latency-ms 20 --tokens-per-sec 50 --dim 1024
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import sys
+
+import numpy as np
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+
+def build_app(latency_ms: float, tokens_per_sec: float, tokens: int, dim: int, error_rate: float, n_ctx: int):
+    latency = latency_ms / 1000
+    token_delay = 1 / tokens_per_sec if tokens_per_sec > 0 else 0.0
+
+    def failed() -> Response | None:
+        if error_rate and random.random() < error_rate:
+            return JSONResponse({"error": {"message": "mock failure"}}, status_code=500)
+        return None
+
+    def embedding(text: str) -> list[float]:
+        seed = int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), "little")
+        vec = np.random.default_rng(seed).standard_normal(dim, dtype=np.float32)
+        return (vec / np.linalg.norm(vec)).tolist()
+
+    async def chat(request: Request) -> Response:
+        body = await request.json()
+        if (error := failed()) is not None:
+            return error
+        await asyncio.sleep(latency)
+        n = min(int(body.get("max_tokens") or tokens), tokens)
+        if body.get("stream"):
+
+            async def events():
+                # llama-server opens with a role-only delta before the first token.
+                role = {"object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {"role": "assistant"}}]}
+                yield f"data: {json.dumps(role)}\n\n".encode()
+                for i in range(n):
+                    if i and token_delay:
+                        await asyncio.sleep(token_delay)
+                    chunk = {"object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {"content": f"tok{i} "}}]}
+                    yield f"data: {json.dumps(chunk)}\n\n".encode()
+                yield b"data: [DONE]\n\n"
+
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        await asyncio.sleep(token_delay * n)
+        return JSONResponse({
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "model": body.get("model", "mock"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": " ".join(f"tok{i}" for i in range(n))},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 16, "completion_tokens": n, "total_tokens": 16 + n},
+        })
+
+    async def embeddings(request: Request) -> Response:
+        body = await request.json()
+        if (error := failed()) is not None:
+            return error
+        texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        await asyncio.sleep(latency)
+        used = sum(len(t.split()) for t in texts)
+        return JSONResponse({
+            "object": "list",
+            "model": body.get("model", "mock"),
+            "data": [{"object": "embedding", "index": i, "embedding": embedding(t)} for i, t in enumerate(texts)],
+            "usage": {"prompt_tokens": used, "total_tokens": used},
+        })
+
+    async def tokenize(request: Request) -> Response:
+        body = await request.json()
+        return JSONResponse({"tokens": list(range(len(body.get("content", "").split())))})
+
+    async def props(request: Request) -> Response:
+        return JSONResponse({"default_generation_settings": {"n_ctx": n_ctx}})
+
+    async def health(request: Request) -> Response:
+        return JSONResponse({"status": "ok"})
+
+    return Starlette(routes=[
+        Route("/v1/chat/completions", chat, methods=["POST"]),
+        Route("/v1/embeddings", embeddings, methods=["POST"]),
+        Route("/tokenize", tokenize, methods=["POST"]),
+        Route("/props", props),
+        Route("/health", health),
+    ])
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18181)
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="delay before the first token / embedding")
+    parser.add_argument("--tokens-per-sec", type=float, default=50.0, help="generation speed (0 = instant)")
+    parser.add_argument("--tokens", type=int, default=32, help="completion length")
+    parser.add_argument("--dim", type=int, default=1024, help="embedding dimension")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 500")
+    parser.add_argument("--n-ctx", type=int, default=8192, help="context size reported by /props")
+    args = parser.parse_args()
+
+    app = build_app(args.latency_ms, args.tokens_per_sec, args.tokens, args.dim, args.error_rate, args.n_ctx)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
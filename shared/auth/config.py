@@ -42,3 +42,18 @@ for key in os.environ:
                 "user": user,
                 "pass": password,
             }
+
+# Verified-token cache for decode_token_cached (entries; 0 disables)
+TOKEN_CACHE_SIZE = int(os.environ.get("AUTH_TOKEN_CACHE_SIZE", "10000"))
+
+# Worker processes of this server; set by shared.serve before forking.
+SERVE_WORKERS = int(os.environ.get("SERVE_WORKERS", "1"))
+
+# Rate limiting of failed /auth/token attempts per client IP.
+# Backend "memory" is per process; "sqlite" shares counters between worker
+# processes through a SQLite file (put it on tmpfs, e.g. /dev/shm).
+RATE_LIMIT_WINDOW = 60  # seconds
+RATE_LIMIT_MAX = 10  # max failed attempts per window per IP
+RATE_LIMIT_BACKEND = os.environ.get("AUTH_RATE_LIMIT_BACKEND", "sqlite" if SERVE_WORKERS > 1 else "memory")
+RATE_LIMIT_PATH = os.environ.get("AUTH_RATE_LIMIT_PATH", "/dev/shm/research-ai-ratelimit.sqlite3")
+RATE_LIMIT_MAX_KEYS = int(os.environ.get("AUTH_RATE_LIMIT_MAX_KEYS", "100000"))
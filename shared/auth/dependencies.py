@@ -0,0 +1,49 @@
+"""FastAPI dependencies for in-process JWT authentication.
+
+Routers that sit behind this service's own tokens can verify them directly
+instead of making an HTTP round trip to /auth/validate. Verification goes
+through decode_token_cached, so repeated requests with the same token cost a
+hash and a dict lookup.
+
+Usage:
+    from fastapi import Depends
+    from shared.auth.dependencies import require_access_token
+
+    @router.get("/private")
+    async def private(claims: dict = Depends(require_access_token)):
+        return {"user": claims["sub"]}
+"""
+
+from fastapi import Header, HTTPException
+
+from shared.auth.jwt_handler import decode_token_cached
+
+
+def access_claims(authorization: str) -> dict | None:
+    """Return the claims of a valid access token in an Authorization header, else None."""
+    if not authorization.startswith("Bearer "):
+        return None
+    try:
+        payload = decode_token_cached(authorization[len("Bearer "):])
+    except Exception:
+        return None
+    if payload.get("type") != "access":
+        return None
+    return payload
+
+
+async def require_access_token(authorization: str = Header(default="")) -> dict:
+    """Dependency: the caller's access-token claims, or 401."""
+    claims = access_claims(authorization)
+    if claims is None:
+        raise HTTPException(
+            status_code=401,
+            detail="Token is invalid or expired",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return claims
+
+
+async def optional_access_token(authorization: str = Header(default="")) -> dict | None:
+    """Dependency: the caller's access-token claims, or None when absent/invalid."""
+    return access_claims(authorization)
@@ -1,4 +1,7 @@
+import hashlib
+import threading
 import time
+from collections import OrderedDict
 
 import jwt
 
@@ -7,6 +10,7 @@ from shared.auth.config import (
     JWT_ALGORITHM,
     JWT_SECRET,
     REFRESH_TOKEN_EXPIRE_SECONDS,
+    TOKEN_CACHE_SIZE,
 )
 
 
@@ -37,3 +41,42 @@ def decode_token(token: str) -> dict:
         algorithms=[JWT_ALGORITHM],
         options={"require": ["exp", "iat", "sub", "type"]},
     )
+
+
+# --- Verified-token cache ---
+# Maps sha256(token) -> (exp, claims) for tokens that passed decode_token.
+# Entries are dropped once `exp` has passed, so a cached token never outlives
+# its own validity; the LRU bound caps memory.
+_verified: OrderedDict[bytes, tuple[int, dict]] = OrderedDict()
+_verified_lock = threading.Lock()
+
+
+def decode_token_cached(token: str) -> dict:
+    """decode_token with an in-process cache of already verified tokens.
+
+    Raises like decode_token on invalid tokens (failures are never cached).
+    The returned claims dict is shared between callers; do not mutate it.
+    """
+    if TOKEN_CACHE_SIZE <= 0:
+        return decode_token(token)
+    key = hashlib.sha256(token.encode()).digest()
+    now = time.time()
+    with _verified_lock:
+        entry = _verified.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                _verified.move_to_end(key)
+                return entry[1]
+            del _verified[key]
+
+    payload = decode_token(token)
+    with _verified_lock:
+        _verified[key] = (payload["exp"], payload)
+        while len(_verified) > TOKEN_CACHE_SIZE:
+            _verified.popitem(last=False)
+    return payload
+
+
+def clear_token_cache() -> None:
+    with _verified_lock:
+        _verified.clear()
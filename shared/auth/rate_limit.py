@@ -0,0 +1,157 @@
+"""Sliding-window-counter rate limiter with pluggable storage.
+
+Each key keeps two counters: events in the current fixed window and in the
+previous one. The rate is estimated as
+
+    previous * (1 - elapsed_fraction_of_current_window) + current
+
+which approximates a true sliding window in O(1) time and constant memory per
+key. The number of keys is capped; the least recently touched keys are
+evicted first.
+
+Backends:
+    MemoryBackend  per process, OrderedDict LRU
+    SQLiteBackend  shared by all worker processes using the same file
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger("shared.auth.rate_limit")
+
+
+class MemoryBackend:
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        # key -> [window_index, previous_count, current_count]
+        self._counters: OrderedDict[str, list[int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def counts(self, key: str, window_index: int) -> tuple[int, int]:
+        with self._lock:
+            entry = self._counters.get(key)
+            if entry is None:
+                return 0, 0
+            return _roll(entry, window_index)
+
+    def add(self, key: str, window_index: int) -> None:
+        with self._lock:
+            entry = self._counters.get(key)
+            if entry is None:
+                entry = self._counters[key] = [window_index, 0, 0]
+                if len(self._counters) > self.max_keys:
+                    self._counters.popitem(last=False)
+            else:
+                self._counters.move_to_end(key)
+            entry[1], entry[2] = _roll(entry, window_index)
+            entry[0] = window_index
+            entry[2] += 1
+
+    def __len__(self) -> int:
+        return len(self._counters)
+
+
+class SQLiteBackend:
+    _CLEANUP_EVERY = 1000  # writes between sweeps of stale and excess keys
+
+    def __init__(self, path: str, max_keys: int, window: int):
+        self.max_keys = max_keys
+        self.window = window
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=1.0, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=OFF")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS rate ("
+            " key TEXT PRIMARY KEY, win INTEGER NOT NULL, prev INTEGER NOT NULL,"
+            " curr INTEGER NOT NULL, touched REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS rate_touched ON rate (touched)")
+
+    def counts(self, key: str, window_index: int) -> tuple[int, int]:
+        with self._lock:
+            row = self._db.execute("SELECT win, prev, curr FROM rate WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return 0, 0
+        return _roll(list(row), window_index)
+
+    def add(self, key: str, window_index: int) -> None:
+        now = time.time()
+        with self._lock:
+            # One statement, so concurrent workers cannot lose updates.
+            self._db.execute(
+                "INSERT INTO rate (key, win, prev, curr, touched) VALUES (?1, ?2, 0, 1, ?3) "
+                "ON CONFLICT(key) DO UPDATE SET "
+                " prev = CASE WHEN win = ?2 THEN prev WHEN win = ?2 - 1 THEN curr ELSE 0 END,"
+                " curr = CASE WHEN win = ?2 THEN curr + 1 ELSE 1 END,"
+                " win = ?2, touched = ?3",
+                (key, window_index, now),
+            )
+            self._writes += 1
+            if self._writes % self._CLEANUP_EVERY == 0:
+                self._cleanup(now)
+
+    def _cleanup(self, now: float) -> None:
+        self._db.execute("DELETE FROM rate WHERE touched < ?", (now - 2 * self.window,))
+        excess = self._db.execute("SELECT COUNT(*) FROM rate").fetchone()[0] - self.max_keys
+        if excess > 0:
+            self._db.execute(
+                "DELETE FROM rate WHERE key IN (SELECT key FROM rate ORDER BY touched LIMIT ?)", (excess,)
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM rate").fetchone()[0]
+
+
+def _roll(entry: list[int], window_index: int) -> tuple[int, int]:
+    """(previous, current) counts as seen from `window_index`."""
+    stored_index, previous, current = entry
+    if stored_index == window_index:
+        return previous, current
+    if stored_index == window_index - 1:
+        return current, 0
+    return 0, 0
+
+
+class RateLimiter:
+    def __init__(self, backend, window: int, max_events: int):
+        self.backend = backend
+        self.window = window
+        self.max_events = max_events
+        self.rejections = 0
+
+    def _position(self) -> tuple[int, float]:
+        now = time.time()
+        index = int(now // self.window)
+        return index, (now - index * self.window) / self.window
+
+    def estimate(self, key: str) -> float:
+        index, elapsed = self._position()
+        previous, current = self.backend.counts(key, index)
+        return previous * (1 - elapsed) + current
+
+    def is_limited(self, key: str) -> bool:
+        limited = self.estimate(key) >= self.max_events
+        if limited:
+            self.rejections += 1
+        return limited
+
+    def record(self, key: str) -> None:
+        index, _ = self._position()
+        self.backend.add(key, index)
+
+
+def build_backend(kind: str, path: str, max_keys: int, window: int):
+    if kind == "sqlite":
+        try:
+            return SQLiteBackend(path, max_keys, window)
+        except sqlite3.Error:
+            logger.exception("Cannot open rate-limit database %s; falling back to memory", path)
+    elif kind != "memory":
+        logger.warning("Unknown rate-limit backend %r; using memory", kind)
+    return MemoryBackend(max_keys)
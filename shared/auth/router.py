@@ -1,42 +1,51 @@
 import secrets
-import time
-from collections import defaultdict
 
 from fastapi import APIRouter, Header, Request
 from fastapi.responses import JSONResponse
 
-from shared.auth.config import ACCESS_TOKEN_EXPIRE_SECONDS, OAUTH_CREDENTIALS
-from shared.auth.jwt_handler import create_access_token, create_refresh_token, decode_token
+from shared import metrics
+from shared.auth.config import (
+    ACCESS_TOKEN_EXPIRE_SECONDS,
+    OAUTH_CREDENTIALS,
+    RATE_LIMIT_BACKEND,
+    RATE_LIMIT_MAX,
+    RATE_LIMIT_MAX_KEYS,
+    RATE_LIMIT_PATH,
+    RATE_LIMIT_WINDOW,
+)
+from shared.auth.jwt_handler import (
+    create_access_token,
+    create_refresh_token,
+    decode_token,
+    decode_token_cached,
+)
 from shared.auth.models import TokenResponse
+from shared.auth.rate_limit import RateLimiter, build_backend
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
-# --- Simple in-memory rate limiter for /auth/token ---
-_rate_window = 60  # seconds
-_rate_max = 10  # max attempts per window per IP
-_rate_store: dict[str, list[float]] = defaultdict(list)
-_rate_last_cleanup = 0.0
-_rate_cleanup_interval = 300  # full cleanup every 5 minutes
+# --- Rate limiter for failed /auth/token attempts ---
+rate_limiter = RateLimiter(
+    build_backend(RATE_LIMIT_BACKEND, RATE_LIMIT_PATH, RATE_LIMIT_MAX_KEYS, RATE_LIMIT_WINDOW),
+    window=RATE_LIMIT_WINDOW,
+    max_events=RATE_LIMIT_MAX,
+)
 
 
-def _is_rate_limited(client_ip: str) -> bool:
-    global _rate_last_cleanup
-    now = time.monotonic()
+RATE_LIMITED = metrics.counter(
+    "auth_rate_limit_rejections_total", "Token requests rejected by the failed-login rate limiter"
+)
 
-    # Periodic full cleanup to prevent unbounded memory growth
-    if now - _rate_last_cleanup > _rate_cleanup_interval:
-        _rate_last_cleanup = now
-        stale = [ip for ip, ts in _rate_store.items() if not ts or now - ts[-1] > _rate_window]
-        for ip in stale:
-            del _rate_store[ip]
 
-    # Prune expired entries for this IP
-    _rate_store[client_ip] = [t for t in _rate_store[client_ip] if now - t < _rate_window]
-    return len(_rate_store[client_ip]) >= _rate_max
+def _is_rate_limited(client_ip: str) -> bool:
+    if rate_limiter.is_limited(client_ip):
+        RATE_LIMITED.inc()
+        return True
+    return False
 
 
 def _record_failure(client_ip: str) -> None:
-    _rate_store[client_ip].append(time.monotonic())
+    rate_limiter.record(client_ip)
 
 
 @router.post("/token", response_model=TokenResponse)
@@ -112,7 +121,7 @@ async def validate(authorization: str = Header(default="")):
 
     token_str = authorization[len("Bearer "):]
     try:
-        payload = decode_token(token_str)
+        payload = decode_token_cached(token_str)
         if payload.get("type") != "access":
             raise ValueError("not an access token")
     except Exception:
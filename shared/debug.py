@@ -0,0 +1,271 @@
+"""Diagnostics for a slow service: CPU profiles, task dumps, event-loop lag.
+
+Everything here is off unless configured, and costs nothing then:
+
+- DEBUG_ENDPOINTS=1 mounts an authenticated /debug router (access token
+  required):
+    GET /debug/profile?seconds=10&hz=100   sampling CPU profile of all
+        threads in collapsed-stack format ("frame;frame;frame count" per
+        line), which flamegraph.pl, speedscope and inferno read directly;
+    GET /debug/tasks                        live asyncio tasks and their
+        await stacks;
+    GET /debug/loop                         event-loop lag monitor stats.
+- LOOP_LAG_THRESHOLD_MS > 0 starts the lag monitor: a task that sleeps for
+  LOOP_LAG_INTERVAL_MS and measures how late it wakes up. Stalls above the
+  threshold are counted in {prefix}_event_loop_stalls_total and logged. A
+  watchdog thread also logs the loop thread's stack while a stall is still
+  going on, which names the code that is blocking the loop.
+
+The sampler reads sys._current_frames() from its own thread, so profiling
+needs no tracing hooks and the profiled code runs unmodified.
+
+Usage (in an app's lifespan and setup):
+    debug.install(app)
+    debug.start_monitor("ai")    # in lifespan startup
+    await debug.stop_monitor()   # in lifespan shutdown
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from fastapi import APIRouter, Depends, FastAPI, Query
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+from shared import metrics
+from shared.auth.dependencies import require_access_token
+
+logger = logging.getLogger("shared.debug")
+
+DEBUG_ENDPOINTS = os.environ.get("DEBUG_ENDPOINTS", "").strip().lower() in ("1", "true", "yes", "on")
+LOOP_LAG_THRESHOLD_MS = float(os.environ.get("LOOP_LAG_THRESHOLD_MS", "0"))  # 0 disables the monitor
+LOOP_LAG_INTERVAL_MS = float(os.environ.get("LOOP_LAG_INTERVAL_MS", "100"))
+
+MAX_PROFILE_SECONDS = 60
+MAX_PROFILE_HZ = 1000
+
+# Longest sys.path entries first, so frames show paths relative to the
+# import root ("routers/chat.py") rather than absolute file names.
+_PATH_PREFIXES = sorted({os.path.join(os.path.abspath(p), "") for p in sys.path if p}, key=len, reverse=True)
+
+
+def _short_path(filename: str) -> str:
+    for prefix in _PATH_PREFIXES:
+        if filename.startswith(prefix):
+            return filename[len(prefix):]
+    return filename
+
+
+def _qualname(code) -> str:
+    return getattr(code, "co_qualname", code.co_name)  # co_qualname is 3.11+
+
+
+def _frame_label(code) -> str:
+    return f"{_qualname(code)}({_short_path(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _thread_stack(frame) -> list[str]:
+    """Frames of one thread, outermost first."""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+
+def _await_stack(coro) -> list[str]:
+    """A task's await chain, outermost first. Task.get_stack() only returns
+    the outermost frame of a suspended coroutine, so follow cr_await."""
+    lines = []
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None) or getattr(coro, "ag_frame", None)
+        if frame is None:
+            lines.append(f"awaiting {type(coro).__name__}")
+            break
+        code = frame.f_code
+        lines.append(f"{_short_path(code.co_filename)}:{frame.f_lineno} in {_qualname(code)}")
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None) or getattr(coro, "ag_await", None)
+    return lines
+
+
+# --- Sampling profiler ---
+
+_profile_lock = threading.Lock()
+
+
+def sample_profile(seconds: float, hz: int) -> tuple[Counter, int]:
+    """Sample every thread's stack `hz` times a second; returns (collapsed stacks, samples).
+
+    Blocks the calling thread for `seconds`; run it off the event loop.
+    """
+    names = {t.ident: t.name for t in threading.enumerate()}
+    own = threading.get_ident()
+    stacks: Counter = Counter()
+    interval = 1 / hz
+    deadline = time.perf_counter() + seconds
+    samples = 0
+    next_at = time.perf_counter()
+    while next_at < deadline:
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            if ident not in names:
+                names = {t.ident: t.name for t in threading.enumerate()}
+            thread = names.get(ident, f"thread-{ident}").replace(" ", "_")
+            stacks[";".join([thread, *_thread_stack(frame)])] += 1
+        samples += 1
+        next_at += interval
+        delay = next_at - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+    return stacks, samples
+
+
+# --- Event-loop lag monitor ---
+
+class LoopLagMonitor:
+    def __init__(self, prefix: str, threshold: float, interval: float):
+        self.threshold = threshold
+        self.interval = interval
+        self.lag = metrics.histogram(
+            f"{prefix}_event_loop_lag_seconds",
+            "How late the event loop ran a timer",
+            buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+        )
+        self.stalls = metrics.counter(f"{prefix}_event_loop_stalls_total", "Event-loop stalls above the threshold")
+        self.max_lag = 0.0
+        self.stall_count = 0
+        self._beat = time.monotonic()
+        self._loop_thread: int | None = None
+        self._task: asyncio.Task | None = None
+        self._stop = threading.Event()
+        self._watchdog: threading.Thread | None = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            self._beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(loop.time() - started - self.interval, 0.0)
+            self.lag.observe(lag)
+            self.max_lag = max(self.max_lag, lag)
+            if lag > self.threshold:
+                self.stall_count += 1
+                self.stalls.inc()
+                logger.warning("Event loop stalled for %.0f ms", lag * 1000)
+
+    def _watch(self) -> None:
+        reported = None
+        while not self._stop.wait(self.interval):
+            beat = self._beat
+            if time.monotonic() - beat - self.interval <= self.threshold or reported == beat:
+                continue
+            reported = beat
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is not None:
+                logger.warning(
+                    "Event loop blocked for over %.0f ms in:\n  %s",
+                    self.threshold * 1000,
+                    "\n  ".join(_thread_stack(frame)[-15:]),
+                )
+
+    def start(self) -> None:
+        if self._task is not None:
+            return
+        self._loop_thread = threading.get_ident()
+        self._task = asyncio.create_task(self._run())
+        self._stop.clear()
+        self._watchdog = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._stop.set()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "enabled": True,
+            "threshold_ms": self.threshold * 1000,
+            "interval_ms": self.interval * 1000,
+            "stalls": self.stall_count,
+            "max_lag_ms": round(self.max_lag * 1000, 3),
+        }
+
+
+_monitor: LoopLagMonitor | None = None
+
+
+def start_monitor(prefix: str) -> None:
+    """Start the lag monitor if LOOP_LAG_THRESHOLD_MS is set. Call from the lifespan."""
+    global _monitor
+    if LOOP_LAG_THRESHOLD_MS <= 0:
+        return
+    if _monitor is None:
+        _monitor = LoopLagMonitor(prefix, LOOP_LAG_THRESHOLD_MS / 1000, LOOP_LAG_INTERVAL_MS / 1000)
+    _monitor.start()
+
+
+async def stop_monitor() -> None:
+    if _monitor is not None:
+        await _monitor.stop()
+
+
+# --- Endpoints ---
+
+router = APIRouter(prefix="/debug", dependencies=[Depends(require_access_token)], include_in_schema=False)
+
+
+@router.get("/profile")
+async def profile(
+    seconds: float = Query(10, gt=0, le=MAX_PROFILE_SECONDS),
+    hz: int = Query(100, ge=1, le=MAX_PROFILE_HZ),
+):
+    if not _profile_lock.acquire(blocking=False):
+        return JSONResponse(status_code=409, content={"error": "A profile is already being taken"})
+    try:
+        stacks, samples = await asyncio.to_thread(sample_profile, seconds, hz)
+    finally:
+        _profile_lock.release()
+    body = "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+    return PlainTextResponse(body, headers={"X-Profile-Samples": str(samples)})
+
+
+@router.get("/tasks")
+async def tasks():
+    current = asyncio.current_task()
+    dump = []
+    for task in asyncio.all_tasks():
+        if task is current:
+            continue
+        coro = task.get_coro()
+        dump.append({
+            "name": task.get_name(),
+            "coro": getattr(coro, "__qualname__", repr(coro)),
+            "stack": _await_stack(coro),
+        })
+    dump.sort(key=lambda t: t["coro"])
+    return {"count": len(dump), "tasks": dump}
+
+
+@router.get("/loop")
+def loop_stats():
+    return _monitor.stats() if _monitor is not None else {"enabled": False}
+
+
+def install(app: FastAPI) -> None:
+    """Mount the /debug endpoints when DEBUG_ENDPOINTS is set."""
+    if DEBUG_ENDPOINTS:
+        app.include_router(router)
@@ -0,0 +1,308 @@
+"""Minimal Prometheus metrics: counters, gauges, histograms and /metrics.
+
+Recording is kept cheap for the request path:
+- a labelled child is looked up once (`metric.labels(...)`) and can be kept
+  by the caller; updating it is a plain attribute/list-slot increment;
+- histograms store per-bucket counts in a preallocated list and find the
+  bucket with bisect, so an observation allocates nothing;
+- there are no locks: every update happens on the event-loop thread, and a
+  racing update from a worker thread could at worst lose one increment.
+
+Gauges can also be backed by a function that is only called at scrape time
+(`set_function`), which is how queue depths and pool sizes are exported
+without touching the hot path at all.
+
+Usage:
+    from shared import metrics
+    REQUESTS = metrics.counter("app_requests_total", "Requests", ["kind"])
+    REQUESTS.labels("chat").inc()
+
+    app.add_middleware(metrics.MetricsMiddleware, prefix="ai")
+    app.add_route("/metrics", metrics.metrics_endpoint, include_in_schema=False)
+"""
+
+import math
+import time
+from bisect import bisect_left
+from collections.abc import Callable, Iterable
+
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; covers sub-millisecond proxy overhead up to long generations.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_text(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+
+class _GaugeChild:
+    __slots__ = ("value", "function")
+
+    def __init__(self):
+        self.value = 0.0
+        self.function: Callable[[], float] | None = None
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """Report function() at scrape time instead of the stored value."""
+        self.function = function
+
+    def get(self) -> float:
+        return self.function() if self.function is not None else self.value
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # last slot is +Inf
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: dict[tuple[str, ...], object] = {}
+        self._default = None if self.labelnames else self.labels()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    def remove(self, *values: str) -> None:
+        self._children.pop(values, None)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in list(self._children.items()):
+            lines.extend(self._samples(values, child))
+        return lines
+
+    def _samples(self, values, child) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._default.inc(amount)
+
+    def _samples(self, values, child) -> list[str]:
+        return [f"{self.name}{_label_text(self.labelnames, values)} {_format_value(child.value)}"]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._default.inc(amount)
+
+    def dec(self, amount: float = 1.0) -> None:
+        self._default.dec(amount)
+
+    def set(self, value: float) -> None:
+        self._default.set(value)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self._default.set_function(function)
+
+    def _samples(self, values, child) -> list[str]:
+        return [f"{self.name}{_label_text(self.labelnames, values)} {_format_value(float(child.get()))}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS,
+    ):
+        self.bounds = tuple(sorted(float(b) for b in buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.bounds)
+
+    def observe(self, value: float) -> None:
+        self._default.observe(value)
+
+    def _samples(self, values, child) -> list[str]:
+        lines = []
+        cumulative = 0
+        counts = list(child.counts)
+        for bound, count in zip(self.bounds + (math.inf,), counts):
+            cumulative += count
+            le = f'le="{_format_value(bound)}"'
+            lines.append(f"{self.name}_bucket{_label_text(self.labelnames, values, le)} {cumulative}")
+        labels = _label_text(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            # Modules can be imported twice (e.g. by two apps); share the metric.
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name: str, documentation: str, labelnames: Iterable[str] = ()) -> Gauge:
+    return REGISTRY.register(Gauge(name, documentation, labelnames))
+
+
+def histogram(
+    name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS
+) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+async def metrics_endpoint(request: Request) -> Response:
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+
+def _route_template(scope: Scope) -> str:
+    """Path template of the matched route, including any include_router prefix.
+
+    Depending on the FastAPI version, scope["route"] may be the route as
+    declared on its APIRouter (without the prefix), so the prefix is
+    recovered from the request path.
+    """
+    route = scope.get("route")
+    template = getattr(route, "path", None)
+    if template is None:
+        return "unmatched"
+    try:
+        tail = route.path_format.format(**scope.get("path_params", {}))
+    except (AttributeError, KeyError, IndexError, ValueError):
+        return template
+    path = scope["path"]
+    if tail and path.endswith(tail):
+        return path[: len(path) - len(tail)] + template
+    return template
+
+
+class MetricsMiddleware:
+    """Times every HTTP request by route template and counts requests in flight.
+
+    Duration runs until the last body chunk is sent, so for streamed
+    responses it covers the whole stream. Requests that match no route are
+    labelled "unmatched" to keep label cardinality bounded.
+    """
+
+    def __init__(self, app: ASGIApp, prefix: str = "http"):
+        self.app = app
+        self.duration = histogram(
+            f"{prefix}_request_duration_seconds",
+            "HTTP request duration by method, route and status",
+            ["method", "route", "status"],
+        )
+        self.in_flight = gauge(f"{prefix}_requests_in_flight", "HTTP requests currently being served")
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+        in_flight = self.in_flight
+        in_flight.inc()
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            in_flight.dec()
+            route = _route_template(scope)
+            self.duration.labels(scope["method"], route, str(status)).observe(time.perf_counter() - started)
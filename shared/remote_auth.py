@@ -7,6 +7,10 @@ Usage:
     from shared.remote_auth import get_remote_client
     client = get_remote_client("ai")
     headers = await client.auth_header()
+    resp = await client.request("GET", "/chat/stats")
+
+Call start_all() at startup to renew tokens in the background, and
+close_all() at shutdown to stop that and close the pooled connections.
 """
 
 from shared.auth.config import REMOTE_SERVERS
@@ -40,3 +44,15 @@ def get_remote_client(name: str) -> TokenClient:
 def list_remote_servers() -> list[str]:
     """Return names of all configured remote servers."""
     return sorted(_clients)
+
+
+async def start_all() -> None:
+    """Start background token renewal for every remote server."""
+    for client in _clients.values():
+        client.start()
+
+
+async def close_all() -> None:
+    """Stop background renewal and close each remote's HTTP client."""
+    for client in _clients.values():
+        await client.stop()
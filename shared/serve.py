@@ -0,0 +1,230 @@
+"""Pre-forked multi-process server for the FastAPI apps.
+
+Run from the app's directory (with the repo root on PYTHONPATH):
+
+    python -m shared.serve main:app --port 8090 --workers 4 --preload config
+
+The master process binds the listening socket, imports the --preload modules
+(shared.auth.config always) so configuration is parsed once, then forks the
+workers. Each worker imports the app itself and runs one uvicorn server on the
+shared socket; the kernel spreads new connections across them. The app is
+deliberately not imported before forking: it opens SQLite databases and
+other handles that must not be shared between processes.
+
+Before importing anything the master sets SERVE_WORKERS in the environment,
+so config modules can pick multi-process-safe defaults (see
+AUTH_RATE_LIMIT_BACKEND and CHAT_SESSION_BACKEND).
+
+Signals to the master:
+    SIGTERM, SIGINT  stop: workers close their listeners at once and get up
+                     to --drain-timeout seconds to finish open requests,
+                     including chat streams, before being cancelled. A
+                     second signal cancels them right away.
+    SIGHUP           rolling restart: a fresh set of workers is started
+                     (re-importing the app code, with the same config), then
+                     the old ones drain as above.
+
+Workers that die are restarted; a worker whose master is gone shuts itself
+down.
+"""
+
+import argparse
+import importlib
+import logging
+import os
+import select
+import signal
+import socket
+import sys
+import threading
+import time
+
+SERVE_WORKERS = int(os.environ.get("SERVE_WORKERS", "1"))
+SERVE_DRAIN_TIMEOUT = float(os.environ.get("SERVE_DRAIN_TIMEOUT", "30"))
+
+logger = logging.getLogger("shared.serve")
+
+_KILL_GRACE = 5  # seconds past the drain timeout before workers are killed
+_MIN_LIFETIME = 1  # workers that die sooner are restarted with a delay
+
+
+def _bind(host: str, port: int, backlog: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _watch_master(master: int) -> None:
+    """Stop this worker (gracefully, via SIGTERM) once the master has exited."""
+    while os.getppid() == master:
+        time.sleep(1)
+    os.kill(os.getpid(), signal.SIGTERM)
+
+
+def _run_worker(args: argparse.Namespace, sock: socket.socket, master: int) -> None:
+    import uvicorn
+
+    threading.Thread(target=_watch_master, args=(master,), name="serve-master-watch", daemon=True).start()
+    config = uvicorn.Config(
+        args.app,
+        log_level=args.log_level,
+        timeout_graceful_shutdown=args.drain_timeout,
+        proxy_headers=True,
+        forwarded_allow_ips=args.forwarded_allow_ips,
+    )
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+class Master:
+    def __init__(self, args: argparse.Namespace, sock: socket.socket):
+        self.args = args
+        self.sock = sock
+        self.workers: dict[int, float] = {}  # pid -> start time (current generation)
+        self.retiring: dict[int, float] = {}  # pid -> kill deadline (draining after SIGHUP)
+        self.respawn_at: list[float] = []
+        self.stopping = False
+
+    def spawn(self) -> None:
+        master = os.getpid()
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                signal.set_wakeup_fd(-1)
+                for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+                    signal.signal(sig, signal.SIG_DFL)
+                signal.signal(signal.SIGHUP, signal.SIG_IGN)
+                _run_worker(self.args, self.sock, master)
+            except BaseException:
+                logger.exception("Worker %d crashed", os.getpid())
+                code = 1
+            finally:
+                os._exit(code)
+        self.workers[pid] = time.monotonic()
+        logger.info("Started worker %d", pid)
+
+    def signal_all(self, sig: int) -> None:
+        for pid in [*self.workers, *self.retiring]:
+            try:
+                os.kill(pid, sig)
+            except ProcessLookupError:
+                pass
+
+    def reap(self) -> None:
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            started = self.workers.pop(pid, None)
+            self.retiring.pop(pid, None)
+            if started is None or self.stopping:
+                continue
+            code = os.waitstatus_to_exitcode(status)
+            logger.warning("Worker %d exited unexpectedly (%d); restarting", pid, code)
+            delay = _MIN_LIFETIME if time.monotonic() - started < _MIN_LIFETIME else 0
+            self.respawn_at.append(time.monotonic() + delay)
+
+    def reload(self) -> None:
+        logger.info("Reloading: starting %d new workers, draining the old ones", self.args.workers)
+        old = self.workers
+        self.workers = {}
+        deadline = time.monotonic() + self.args.drain_timeout + _KILL_GRACE
+        for _ in range(self.args.workers):
+            self.spawn()
+        for pid in old:
+            self.retiring[pid] = deadline
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def stop(self, sig: int) -> None:
+        if self.stopping:
+            self.signal_all(signal.SIGINT)  # uvicorn: a second SIGINT skips the drain
+            return
+        logger.info("Stopping: draining %d workers (up to %.0fs)", len(self.workers), self.args.drain_timeout)
+        self.stopping = True
+        self.sock.close()
+        self.signal_all(signal.SIGTERM)
+
+    def run(self) -> int:
+        wake_r, wake_w = os.pipe()
+        os.set_blocking(wake_w, False)
+        signal.set_wakeup_fd(wake_w)
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGCHLD):
+            signal.signal(sig, lambda *_: None)  # handled below via the wakeup fd
+
+        for _ in range(self.args.workers):
+            self.spawn()
+        kill_at = None
+        while self.workers or self.retiring or not self.stopping:
+            ready, _, _ = select.select([wake_r], [], [], 1.0)
+            for signum in os.read(wake_r, 512) if ready else b"":
+                if signum in (signal.SIGTERM, signal.SIGINT):
+                    self.stop(signum)
+                    kill_at = kill_at or time.monotonic() + self.args.drain_timeout + _KILL_GRACE
+                elif signum == signal.SIGHUP and not self.stopping:
+                    self.reload()
+            self.reap()
+            now = time.monotonic()
+            if not self.stopping:
+                due = [t for t in self.respawn_at if t <= now]
+                self.respawn_at = [t for t in self.respawn_at if t > now]
+                for _ in due:
+                    self.spawn()
+            for pid, deadline in list(self.retiring.items()):
+                if now > deadline:
+                    logger.warning("Worker %d did not drain in time; killing it", pid)
+                    os.kill(pid, signal.SIGKILL)
+                    self.retiring[pid] = float("inf")
+            if kill_at is not None and now > kill_at:
+                logger.warning("Workers did not drain in time; killing them")
+                self.signal_all(signal.SIGKILL)
+                kill_at = float("inf")
+        logger.info("All workers stopped")
+        return 0
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("app", help="ASGI app as module:attribute, e.g. main:app")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=SERVE_WORKERS, help="worker processes (SERVE_WORKERS)")
+    parser.add_argument(
+        "--drain-timeout", type=float, default=SERVE_DRAIN_TIMEOUT,
+        help="seconds open requests get to finish on shutdown (SERVE_DRAIN_TIMEOUT)",
+    )
+    parser.add_argument("--preload", default="", help="comma-separated modules to import before forking")
+    parser.add_argument("--backlog", type=int, default=2048)
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--forwarded-allow-ips", default="127.0.0.1")
+    args = parser.parse_args(argv)
+    args.workers = max(1, args.workers)
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(levelname)s:     [serve] %(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+    os.environ["SERVE_WORKERS"] = str(args.workers)
+    if "" not in sys.path and os.getcwd() not in sys.path:
+        sys.path.insert(0, os.getcwd())
+    for module in ["shared.auth.config", *filter(None, args.preload.split(","))]:
+        importlib.import_module(module.strip())
+
+    sock = _bind(args.host, args.port, args.backlog)
+    logger.info("Listening on %s:%d with %d workers", args.host, args.port, args.workers)
+    return Master(args, sock).run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,15 +1,33 @@
 """Client for obtaining and caching JWTs from remote servers."""
 
+import asyncio
+import logging
 import time
 
 import httpx
 
+logger = logging.getLogger("shared.token_client")
+
+# Tokens count as expired this many seconds before their real expiry.
+EXPIRY_MARGIN = 60
+# The background task renews this many seconds before expiry, i.e. before
+# callers would see the token as expired and have to wait for a refresh;
+# tokens that live shorter than that are renewed at half their lifetime.
+BACKGROUND_RENEW_BEFORE = 2 * EXPIRY_MARGIN
+# Delay before retrying a failed background renewal.
+RENEW_RETRY_DELAY = 10
+
 
 class TokenClient:
     """Authenticates against a remote server's /auth/token endpoint.
 
     Each instance caches its own token independently, so holding multiple
     TokenClient instances (one per remote server) never causes collisions.
+
+    All requests to the remote go through one pooled httpx.AsyncClient.
+    Concurrent callers that find the token expired share a single
+    refresh; after start() a background task renews the token ahead of
+    expiry so get_token() normally returns without any network call.
     """
 
     def __init__(self, name: str, auth_url: str, username: str, password: str):
@@ -20,16 +38,40 @@ class TokenClient:
         self._access_token: str | None = None
         self._refresh_token: str | None = None
         self._expires_at: float = 0.0
+        self._lifetime: float = 0.0
+        self._http: httpx.AsyncClient | None = None
+        self._lock = asyncio.Lock()
+        self._renew_task: asyncio.Task | None = None
+
+    @property
+    def http(self) -> httpx.AsyncClient:
+        """Pooled HTTP client for this remote (created on first use)."""
+        if self._http is None or self._http.is_closed:
+            self._http = httpx.AsyncClient(base_url=self.auth_url, timeout=10)
+        return self._http
 
     def _is_expired(self) -> bool:
-        # Refresh 60 seconds before actual expiry
-        return time.time() >= (self._expires_at - 60)
+        return time.time() >= (self._expires_at - EXPIRY_MARGIN)
 
     async def get_token(self) -> str:
         """Return a valid access token, fetching or refreshing as needed."""
         if self._access_token and not self._is_expired():
             return self._access_token
 
+        async with self._lock:
+            # Another caller may have refreshed while we waited for the lock.
+            if self._access_token and not self._is_expired():
+                return self._access_token
+            return await self._renew()
+
+    def invalidate(self, token: str | None = None) -> None:
+        """Drop the cached access token (only if it is still `token`, when given)."""
+        if token is None or token == self._access_token:
+            self._access_token = None
+            self._expires_at = 0.0
+
+    async def _renew(self) -> str:
+        """Refresh if possible, else authenticate. Caller holds the lock."""
         if self._refresh_token:
             try:
                 return await self._refresh()
@@ -40,44 +82,94 @@ class TokenClient:
 
     async def _authenticate(self) -> str:
         """Full client_credentials grant against the remote server."""
-        async with httpx.AsyncClient() as client:
-            resp = await client.post(
-                f"{self.auth_url}/auth/token",
-                json={
-                    "grant_type": "client_credentials",
-                    "username": self.username,
-                    "password": self.password,
-                },
-                timeout=10,
-            )
-            resp.raise_for_status()
-            data = resp.json()
-
-        self._access_token = data["access_token"]
-        self._refresh_token = data["refresh_token"]
-        self._expires_at = time.time() + data.get("expires_in", 86400)
-        return self._access_token
+        return await self._grant(
+            {
+                "grant_type": "client_credentials",
+                "username": self.username,
+                "password": self.password,
+            }
+        )
 
     async def _refresh(self) -> str:
         """Use refresh_token grant to get a new access token."""
-        async with httpx.AsyncClient() as client:
-            resp = await client.post(
-                f"{self.auth_url}/auth/token",
-                json={
-                    "grant_type": "refresh_token",
-                    "refresh_token": self._refresh_token,
-                },
-                timeout=10,
-            )
-            resp.raise_for_status()
-            data = resp.json()
+        return await self._grant(
+            {
+                "grant_type": "refresh_token",
+                "refresh_token": self._refresh_token,
+            }
+        )
+
+    async def _grant(self, payload: dict) -> str:
+        resp = await self.http.post("/auth/token", json=payload)
+        resp.raise_for_status()
+        data = resp.json()
 
         self._access_token = data["access_token"]
         self._refresh_token = data["refresh_token"]
-        self._expires_at = time.time() + data.get("expires_in", 86400)
+        self._lifetime = data.get("expires_in", 86400)
+        self._expires_at = time.time() + self._lifetime
         return self._access_token
 
     async def auth_header(self) -> dict[str, str]:
         """Return an Authorization header dict ready for use with httpx."""
         token = await self.get_token()
         return {"Authorization": f"Bearer {token}"}
+
+    async def request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        """Send an authenticated request to the remote server.
+
+        `path` is relative to the remote's base URL. On a 401 the token is
+        dropped and the request is retried once with a fresh one.
+        """
+        headers = dict(kwargs.pop("headers", None) or {})
+        for attempt in range(2):
+            token = await self.get_token()
+            headers["Authorization"] = f"Bearer {token}"
+            resp = await self.http.request(method, path, headers=headers, **kwargs)
+            if resp.status_code != 401 or attempt:
+                return resp
+            await resp.aclose()
+            self.invalidate(token)
+        return resp
+
+    # --- Background renewal ---
+
+    def start(self) -> None:
+        """Start renewing the token ahead of expiry (call from a running loop)."""
+        if self._renew_task is None or self._renew_task.done():
+            self._renew_task = asyncio.create_task(self._renew_loop(), name=f"token-renew-{self.name}")
+
+    async def stop(self) -> None:
+        """Stop background renewal and close the pooled HTTP client."""
+        if self._renew_task is not None:
+            self._renew_task.cancel()
+            try:
+                await self._renew_task
+            except asyncio.CancelledError:
+                pass
+            self._renew_task = None
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    def _renew_at(self) -> float:
+        return self._expires_at - min(BACKGROUND_RENEW_BEFORE, self._lifetime / 2)
+
+    async def _renew_loop(self) -> None:
+        renewed = False
+        while True:
+            delay = self._renew_at() - time.time()
+            if renewed:
+                # Never renew back to back, however short-lived the tokens are.
+                delay = max(delay, RENEW_RETRY_DELAY)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            renewed = False
+            try:
+                async with self._lock:
+                    if time.time() >= self._renew_at():
+                        await self._renew()
+                        renewed = True
+            except Exception as exc:
+                logger.warning("Renewing token for %s failed: %s", self.name, exc)
+                await asyncio.sleep(RENEW_RETRY_DELAY)